@@ -6,6 +6,7 @@
 ;		Date : 		28th December 2018
 ;		Purpose :	Boot-Loads code by loading "boot.img" into memory
 ;					from $8000-$BFFF then banks 32-94 (2 per page) into $C000-$FFFF
+;					or from a sparse image, only the banks it uses
 ;
 ; ***************************************************************************************
 ; ***************************************************************************************
@@ -22,8 +23,8 @@ LastPage = 95 												; unexpanded ZXNext.
 		db 		7
 
 		org 	$5AFE
-		dw 		$7F00	
-		org 	$7F00 							
+		dw 		$7E00	
+		org 	$7E00 							
 
 Start:	ld 		sp,Start-1 									; set up the stack.
 		;db 	$DD,$01
@@ -48,13 +49,38 @@ FindDefaultDrive:
 ;
 ;			Read ZXNext memory from $8000-$BFFF then pages from $C000-$FFFF
 ;
+;		The image is either flat, or sparse. A sparse image starts "HLA",1 and is
+;		followed by records of page (even, 0 for $8000-$BFFF), address, type and
+;		length, each 6 bytes. Type 0 ends the image, type 1 is followed by data, 
+;		type 2 by one byte repeated for the length. Banks not used are not there,
+;		so all the pages are cleared first.
+;
 ; ***************************************************************************************
 
 ReadNextMemory:
 		call 	FindDefaultDrive 							; get default drive
 		call 	OpenFileRead 								; open for reading
-		ld 		ix,$8000 									; read in 8000-BFFF
-		call 	Read16kBlock
+		ld 		ix,$8000 									; read the first 4 bytes
+		ld 		bc,4
+		call 	ReadBlock
+		ld 		hl,$8000 									; check for the sparse 
+		ld 		de,SparseMagic 								; image header
+		ld 		b,4
+__CheckMagic:
+		ld 		a,(de)
+		cp 		(hl)
+		jr 		nz,__ReadFlat
+		inc 	hl
+		inc 	de
+		djnz 	__CheckMagic
+		call 	ClearPages 									; clear the banks
+		call 	ReadSparse 									; load the records
+		jr 		__ReadEnd
+
+__ReadFlat:
+		ld 		ix,$8004 									; read the rest of 8000-BFFF
+		ld 		bc,$4000-4
+		call 	ReadBlock
 		ld 		b,FirstPage 								; current page
 __ReadBlockLoop:
 		call 	SetPaging 									; access the pages
@@ -65,9 +91,77 @@ __ReadBlockLoop:
 		ld 		a,b
 		cp 		LastPage+1 									; until read in pages 32-95
 		jr 		nz,__ReadBlockLoop
+__ReadEnd:
 		call 	CloseFile 									; close file.
 		ret
 
+; ***************************************************************************************
+;
+;							Read the records of a sparse image
+;
+; ***************************************************************************************
+
+ReadSparse:
+		ld 		ix,Record 									; read the record header
+		ld 		bc,6
+		call 	ReadBlock
+		ld 		a,(Record+3) 								; type 0 is the end
+		or 		a
+		ret 	z
+		ld 		a,(Record+0) 								; page it goes in, if not
+		or 		a 											; $8000-$BFFF
+		ld 		b,a
+		call 	nz,SetPaging
+		ld 		ix,(Record+1) 								; where it goes
+		ld 		bc,(Record+4) 								; how many bytes
+		ld 		a,(Record+3)
+		cp 		1 											; type 1, data read
+		jr 		nz,__ReadRun 								; straight in
+		call 	ReadBlock
+		jr 		ReadSparse
+
+__ReadRun:
+		push 	bc 											; read the byte into the
+		ld 		bc,1 										; first address
+		call 	ReadBlock
+		pop 	bc
+		dec 	bc 											; copy it through the rest
+		ld 		a,b 										; of the run
+		or 		c
+		jr 		z,ReadSparse
+		push 	ix
+		pop 	hl
+		ld 		d,h
+		ld 		e,l
+		inc 	de
+		ldir
+		jr 		ReadSparse
+
+; ***************************************************************************************
+;
+;						Clear pages 32-95, as a sparse image leaves out
+;						   the banks which are all zero
+;
+; ***************************************************************************************
+
+ClearPages:
+		ld 		b,FirstPage 								; current page
+__ClearLoop:
+		call 	SetPaging 									; access the pages
+		push 	bc
+		ld 		hl,$C000 									; zero C000-FFFF
+		ld 		(hl),0
+		ld 		de,$C001
+		ld 		bc,$4000-1
+		ldir
+		pop 	bc
+		inc 	b 											; two 8k blocks per page
+		inc 	b
+		ld 		a,b
+		cp 		LastPage+1 									; until cleared pages 32-95
+		jr 		nz,__ClearLoop
+		ret
+
 ; ***************************************************************************************
 ;
 ;						   Map $C000-$FFFF onto blocks b and b+1
@@ -105,16 +199,22 @@ __OpenFile:
 
 ; ***************************************************************************************
 ;
-;									Read 16k block
+;						Read 16k block, or BC bytes, to IX
 ;
 ; ***************************************************************************************
 
 Read16kBlock:
+		push 	bc
+		ld 		bc,$4000
+		call 	ReadBlock
+		pop 	bc
+		ret
+
+ReadBlock:
 		push 	af
 		push 	bc
 		push 	ix
 		ld 		a,(FileHandle)
-		ld 		bc,$4000
 		rst 	$08
 		db 		$9D
 		pop 	ix
@@ -140,6 +240,10 @@ DefaultDrive:
 		db 		0
 FileHandle:
 		db 		0
+SparseMagic:
+		db 		"HLA",1
+Record:
+		ds 		6
 
 		org 	$7FF0
 ImageName:
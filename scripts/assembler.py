@@ -11,7 +11,10 @@
 
 from democodegen import *
 from z80codegen import *
-import re
+from lexer import *
+from ir import *
+from buildcache import *
+import concurrent.futures,os,sys
 
 # ***************************************************************************************
 #									Exception for HLA
@@ -28,135 +31,315 @@ class AssemblerException(Exception):
 # ***************************************************************************************
 
 class AssemblerWorker(object):
-	def __init__(self,codeGen):
+	def __init__(self,codeGen,listing = None,cache = None,workers = 1):
 		self.codeGen = codeGen 												# code generator.
+		self.cache = cache 													# BuildCache or None
+		self.workers = workers 												# processes compiling
+		if listing is not None:												# listing sink
+			codeGen.setListing(listing)
+		self.listing = codeGen.getListing()
 		self.globals = {}													# global identifiers.
-		self.rxIdentifier = "[\$a-z][a-z0-9\_\.]*"							# identifier rx match
-		self.keywords = "if,endif,defproc,endproc,while,endwhile".split(",")# keywords
+		self.lexer = Lexer()												# tokeniser
+		self.signatures = {}												# procedure -> cache key
 	#
 	#		Assemble an array of strings.
 	#
 	def assemble(self,src):
-		#
+		self.assembleStream(src)
+	#
+	#		Assemble from a file name, an open file or any iterable of lines. The source
+	#		is read a line at a time, and each procedure is compiled as soon as it is 
+	#		complete, at its endproc or the next defproc. With more than one worker, 
+	#		and a code generator which can run in a worker process, the procedures are
+	#		all read in first and compiled in parallel.
+	#
+	def assembleStream(self,source):
 		AssemblerException.LINE = 0											# reset line ref.
-		src = self.preProcess(src)											# pre-process
-		src = (":~:".join(src)).replace(" ","").lower()						# make one string
-		src = re.split("(defproc\w+\()",src)								# split into parts
-		for i in range(0,len(src)):											# variable proecess
-			if not src[i].startswith("defproc"):							# replace variables
-				src[i] = self.processVars(src[i])							# with @<address>
-		for i in range(0,len(src)):											# and now do stuff.
-			if src[i].startswith("defproc"):								# defproc<name>(
-				procName = src[i][7:]										# get name
-				if procName in self.globals:								# check duplicates
-					raise AssemblerException("Duplicate Procedure "+procName[:-1])
-				self.globals[procName] = self.codeGen.getAddress()			# define as here.
-			else:
-				if i > 0:
-					self.compileBody(src[i])								# otherwise do the body.
+		self.includes = []													# files being read
+		self.sources = []													# every file read
+		procedure = None 													# tokens of current proc
+		depth = 0 															# structure depth
+		procedures = []
+		parallel = self.workers > 1 and self.codeGen.getWorker() is not None
+		compileProcedure = procedures.append if parallel else self.compileProcedure
+		for token in self.tokenStream(source):
+			if token.kind == Token.Keyword:
+				if token.value == "defproc":								# new procedure
+					if procedure is not None:
+						compileProcedure(procedure)
+					procedure = []
+					depth = 0
+				elif token.value == "if" or token.value == "while":
+					depth += 1
+				elif token.value == "endif" or token.value == "endwhile":
+					depth -= 1
+			if procedure is not None:										# tokens outside procs
+				procedure.append(token)										# are ignored.
+				if token.kind == Token.Keyword and token.value == "endproc" and depth == 0:
+					compileProcedure(procedure)
+					procedure = None
+		if procedure is not None:
+			compileProcedure(procedure)
+		if parallel:
+			self.compileParallel(procedures)
+		self.globals.update(self.codeGen.link())							# link, now have addresses
+	#
+	#		Tokenise, converting lexer errors to assembler errors, and reading in files
+	#		from include "<file>". Included files are relative to the including file.
+	#
+	def tokenStream(self,source):
+		if isinstance(source,str):											# file name
+			fileName = os.path.abspath(source)
+			if fileName in self.includes:
+				raise AssemblerException("Recursive include of "+source)
+			self.includes.append(fileName)
+			if fileName not in self.sources:
+				self.sources.append(fileName)
+			try:
+				handle = open(fileName)
+			except OSError:
+				raise AssemblerException("Cannot open include file "+fileName)
+			with handle:
+				for token in self.tokenStream(handle):
+					yield token
+			self.includes.pop()
+			return
+		directory = os.path.dirname(self.includes[-1]) if len(self.includes) > 0 else \
+						os.path.dirname(os.path.abspath(getattr(source,"name","")))
+		include = None 														# include token.
+		try:
+			for token in self.lexer.tokenise(source):
+				if include is not None:										# include "file"
+					AssemblerException.LINE = include.line
+					if token.kind != Token.String:
+						raise AssemblerException("Bad include")
+					for t in self.tokenStream(os.path.join(directory,token.value)):
+						yield t
+					include = None
+				elif token.kind == Token.Keyword and token.value == "include":
+					include = token
 				else:
-					AssemblerException.LINE += src[i].count("~")			# preliminary lines
+					yield token
+		except LexerError as e:
+			AssemblerException.LINE = e.line
+			raise AssemblerException(e.message)
+	#
+	#		Compile a procedure, tokens from defproc up to the next defproc.
+	#
+	def compileProcedure(self,tokens):
+		AssemblerException.LINE = tokens[0].line
+		if not self.isDefinition(tokens):
+			raise AssemblerException("Bad procedure definition")
+		procName = tokens[1].value+"("										# name is <name>(
+		if procName in self.globals:										# check duplicates
+			raise AssemblerException("Duplicate Procedure "+procName[:-1])
+		if self.cache is not None:											# already compiled ?
+			key = self.signatures[procName] = self.procedureKey(tokens)
+			module = self.cache.get(key,tokens[0].line)
+			if module is not None:
+				self.globals[procName] = self.codeGen.addModule(module)
+				return module
+		body = self.processVars([self.quoteProcess(x) for x in tokens[3:]])	# strings and variables
+		self.globals[procName] = self.codeGen.defineProcedure(procName)		# define as here.
+		self.procedure = IRProcedure(procName)								# IR for procedure.
+		self.compileBody(body)												# do the body.
+		module = self.codeGen.lower(self.procedure)							# generate the code.
+		if self.cache is not None and module is not None:
+			self.cache.put(self.signatures[procName],module,tokens[0].line)
+		return module
+	#
+	def isDefinition(self,tokens):
+		return len(tokens) >= 3 and tokens[1].kind == Token.Identifier and tokens[2].value == "("
+	#
+	#		Compile procedures in a process pool. A first pass finds the names, and the
+	#		modules already in the cache. The rest are compiled by the workers, each 
+	#		knowing the procedures before it, as if done one at a time. They are done
+	#		in waves, each procedure in the wave after the last of those it calls, and
+	#		is given the modules of those it calls which can be inlined, so it inlines
+	#		the same calls as a serial build. The modules are then added in source
+	#		order, so linking is the same as a serial build.
+	#
+	def compileParallel(self,procedures):
+		modules = [None] * len(procedures)
+		names = []
+		for i in range(0,len(procedures)):
+			tokens = procedures[i]
+			name = tokens[1].value+"(" if self.isDefinition(tokens) else None
+			if name is not None and self.cache is not None and name not in self.globals and name not in names:
+				self.signatures[name] = self.procedureKey(tokens)
+				modules[i] = self.cache.get(self.signatures[name],tokens[0].line)
+			names.append(name)
+		compiled = [i for i in range(0,len(procedures)) if modules[i] is None]
+		index = {} 															# name -> first procedure
+		callees = [] 														# procedure -> called
+		wave = [0] * len(procedures)
+		for i in range(0,len(procedures)):
+			callees.append([index[c] for c in self.callees(procedures[i]) if c in index])
+			if modules[i] is None:
+				wave[i] = max([wave[j]+1 for j in callees[i] if modules[j] is None]+[0])
+			if names[i] is not None and names[i] not in index:
+				index[names[i]] = i
+		known = [m for m in modules if m is not None]						# cached, before any wave
+		with concurrent.futures.ProcessPoolExecutor(self.workers,initializer = startWorker,
+							initargs = (self.codeGen.getWorker(),self.globals,names,known)) as pool:
+			for level in range(0,max([wave[i]+1 for i in compiled]+[0])):
+				jobs = [(i,procedures[i],self.inlinable(modules,callees[i],known)) for i in compiled if wave[i] == level]
+				results = pool.map(compileJob,jobs,chunksize = max(1,len(jobs) // (self.workers*4)))
+				for (i,tokens,inlines),module in zip(jobs,results):
+					modules[i] = module
+		for i in range(0,len(procedures)):
+			if isinstance(modules[i],tuple):								# error in the worker
+				AssemblerException.LINE = modules[i][1]
+				raise AssemblerException(modules[i][0])
+			if self.cache is not None and i in compiled:
+				self.cache.put(self.signatures[names[i]],modules[i],procedures[i][0].line)
+			self.globals[names[i]] = self.codeGen.addModule(modules[i])
+	#
+	#		Names of the procedures called in a procedure's tokens.
+	#
+	def callees(self,tokens):
+		called = []
+		for i in range(3,len(tokens)-1):
+			if tokens[i].kind == Token.Identifier and tokens[i+1].value == "(" and tokens[i].value+"(" not in called:
+				called.append(tokens[i].value+"(")
+		return called
+	#
+	#		Compiled modules of the procedures called which can be inlined, and are not
+	#		known to the workers already.
+	#
+	def inlinable(self,modules,called,known):
+		return [modules[j] for j in called if not isinstance(modules[j],tuple) and modules[j] not in known \
+															and getattr(modules[j],"inline",None) is not None]
 	#
-	#		Preprocess, and handle quoted text.
+	#		Cache key for a procedure. This is its tokens without line numbers, and the
+	#		keys of the procedures it calls, so callers are rebuilt if they change.
 	#
-	def preProcess(self,src):
-		src = [x if x.find("//") < 0 else x[:x.find("//")] for x in src]	# remove comments
-		src = [x.replace("\t"," ").strip() for x in src]					# remove tabs and strip
-		src = [self.quoteProcess(x) if x.find('"') >= 0 else x for x in src]# remove quoted strings	
-		return src
+	def procedureKey(self,tokens):
+		parts = [self.codeGen.getConfiguration()]
+		for i in range(1,len(tokens)):
+			parts.append(tokens[i].kind+tokens[i].text())
+			if tokens[i].kind == Token.Identifier and i+1 < len(tokens) and tokens[i+1].value == "(" and i > 1:
+				callee = tokens[i].value+"("
+				parts.append(self.signatures.get(callee,str(self.globals.get(callee))))
+		return self.cache.key(parts)
 	#
-	#		Remove quoted string from a line.
+	#		Convert quoted strings to constants, the code generator stores them
 	#
-	def quoteProcess(self,l):
-		if l.count('"') % 2 != 0:											# check even quotes.
-			raise AssemblerException("Imbalanced quotes "+l)
-		parts = re.split("(\".*?\")",l)										# split up into qstrings
-		parts = [str(self.codeGen.createStringConstant(x[1:-1])) 			# convert "x" to addresses
-								if x.startswith('"') else x for x in parts]
-		return "".join(parts)												# rebuild line.
+	def quoteProcess(self,token):
+		if token.kind != Token.String:
+			return token
+		return Token(Token.Number,self.codeGen.createStringConstant(token.value),token.line)
 	#
 	#		Process local/global variables, convert to addresses.
 	#
-	def processVars(self,code):
+	def processVars(self,tokens):
 		self.locals = {}													# new set of locals
-		rxSplit = "("+self.rxIdentifier+"\(?)"								# splitter check proc calls.
-		parts = re.split(rxSplit,code)										# split it up.
-		idrx = re.compile("^"+self.rxIdentifier+"$")						# matching ID, not call
-		parts = [self.createVar(x) if idrx.match(x) else x for x in parts]
-		return "".join(parts).replace("@@","")								# restick, fix @var 
+		for i in range(0,len(tokens)):
+			t = tokens[i]
+			if t.kind == Token.Identifier or t.kind == Token.Global:		# identifier
+				isCall = i+1 < len(tokens) and tokens[i+1].value == "("		# not a procedure call
+				if not isCall:
+					tokens[i] = Token(Token.Variable,self.createVar(t.value),t.line)
+			elif t.kind == Token.Address:									# @name is constant
+				if isinstance(t.value,int):									# @nnnn is memory
+					tokens[i] = Token(Token.Variable,t.value,t.line)
+				else:
+					tokens[i] = Token(Token.Number,self.createVar(t.value),t.line)
+		return tokens
 	#
 	#		Create variable
 	#
 	def createVar(self,ident):
-		if ident in self.keywords:											# keyword
-			return ident
 		target = self.globals if ident.startswith("$") else self.locals 	# where to look/create
 		if ident not in target:												# create if required.
 			target[ident] = self.codeGen.allocVar(ident)				
-		return "@"+str(target[ident])										# return address
+		return target[ident]												# return address
 	#
-	#		Compile procedure body
+	#		Compile procedure body. tokens start after the opening bracket.
 	#
 	def compileBody(self,body):
-		body = [x for x in body.split(":") if x != ""]						# split into bits
-		if body[0][-1] != ")":												# first is param list.
-			raise CompilerException("Parameter syntax")
-		params = [x for x in body[0][:-1].split(",") if x != ""]			# get the param list
+		params = []
+		while len(body) > 0 and body[0].value != ")":						# get the param list
+			t = body.pop(0)
+			if t.kind == Token.Separator:									# line ended before )
+				raise AssemblerException("Missing )")
+			if t.kind != Token.Variable:									# in parameters.
+				raise AssemblerException("Bad parameter "+t.text())
+			params.append(t.value)
+			if len(body) > 0 and body[0].value == ",":
+				body.pop(0)
+		if len(body) == 0:													# source ended before )
+			raise AssemblerException("Missing )")
+		if len(params) > 4:													# HL DE BC and memory
+			raise AssemblerException("Too many parameters")
 		for p in range(0,len(params)):										# code to store registers
-			if re.match("^\@\d+$",params[p]) is None:						# in parameters.
-				raise CompilerException("Bad parameter "+params[p])
-			self.codeGen.storeParamRegister(p,int(params[p][1:]))
+			self.procedure.add("param",p,params[p])
 		self.structStack = [ ["marker"]]									# structure stack.
-		for cmd in body[1:]:												# for the rest
-			if cmd == "~":													# line marker.
-				AssemblerException.LINE += 1
+		command = []
+		for t in body[1:]:													# for the rest
+			if t.kind == Token.Separator:									# : or end of line
+				if len(command) > 0:
+					self.compileCommand(command)
+				command = []
 			else:
-				self.compileCommand(cmd)
+				command.append(t)
+		if len(command) > 0:
+			self.compileCommand(command)
 		if len(self.structStack) != 1:										# check all closed.
 			raise AssemblerException("Unclosed structure")
 	#
 	#		Compile a single command.
 	#
 	def compileCommand(self,cmd):
-		print("\t==== "+cmd+" ====")
-		#
-		if cmd == "endproc":												# endproc command
-			self.codeGen.returnSubroutine()
-			return
-		#
-		if cmd.startswith("while(") or cmd.startswith("if("):				# IF/WHILE
-			m = re.match("^(\w+)\((.*)([\#\=\<])0\)$",cmd)					# decode it
-			if m is None:
-				raise AssemblerException("Syntax Error in structure")
-			test = { "#":"z","=":"nz","<":"p" }[m.group(3)]					# test is *fail*
-			info = [ m.group(1),self.codeGen.getAddress(),test ]
-			self.compileExpression(m.group(2))								# test.
-			info.append(self.codeGen.getAddress())							# add test position.
-			self.structStack.append(info)									# add to stack.
-			self.codeGen.jumpInstruction(test,self.codeGen.getAddress()) 	# incomplete branch
-			return
+		AssemblerException.LINE = cmd[0].line
+		if self.listing.level >= Listing.Source:
+			self.procedure.add("source",cmd[0].line,"".join([x.text() for x in cmd]))
+		first = cmd[0]
 		#
-		if cmd == "endwhile" or cmd == "endif":								# ENDIF/ENDWHILE
-			info = self.structStack.pop()									# get info
-			if info[0] != cmd[3:]:											# not mixed up ?
-				raise AssemblerException(cmd+" without "+cmd[3:])
-			if cmd == "endwhile":											# while, jump to top
-				self.codeGen.jumpInstruction("",info[1])
-			self.codeGen.jumpInstruction(info[2],self.codeGen.getAddress(),info[3])
-			return
+		if first.kind == Token.Keyword:
+			if first.value == "endproc" and len(cmd) == 1:					# endproc command
+				self.procedure.add("return")
+				return
+			#
+			if first.value == "while" or first.value == "if":				# IF/WHILE
+				if len(cmd) < 6 or cmd[1].value != "(" or cmd[-1].value != ")" or \
+						cmd[-3].kind != Token.Operator or cmd[-3].value not in "#=<" or \
+						cmd[-2].kind != Token.Number or cmd[-2].value != 0:
+					raise AssemblerException("Syntax Error in structure")
+				test = { "#":"z","=":"nz","<":"p" }[cmd[-3].value]			# test is *fail*
+				info = [ first.value,None,test,self.procedure.newLabel() ]	# loop, test, exit
+				if first.value == "while":									# loop back here.
+					info[1] = self.procedure.newLabel()
+					self.procedure.add("label",info[1])
+				self.compileExpression(cmd[2:-3])							# test.
+				self.structStack.append(info)								# add to stack.
+				self.procedure.add("branch",test,info[3])					# exit on fail
+				return
+			#
+			if first.value == "endwhile" or first.value == "endif":			# ENDIF/ENDWHILE
+				info = self.structStack.pop()								# get info
+				if info[0] != first.value[3:]:								# not mixed up ?
+					raise AssemblerException(first.value+" without "+first.value[3:])
+				if first.value == "endwhile":								# while, jump to top
+					self.procedure.add("branch","",info[1])
+				self.procedure.add("label",info[3])							# exit comes here.
+				return
+			raise AssemblerException("Syntax Error "+first.value)
 		#
-		m = re.match("^("+self.rxIdentifier+"\()(.*?)\)$",cmd)				# procedure invocation.
-		if m is not None:
-			if m.group(1) not in self.globals:								# call exists ?
-				raise AssemblerException("Unknown procedure "+m.group(1)[:-1])
-			params = [x for x in m.group(2).split(",") if x != ""]			# parameters
+		if first.kind == Token.Identifier:									# procedure invocation.
+			if len(cmd) < 3 or cmd[1].value != "(" or cmd[-1].value != ")":
+				raise AssemblerException("Bad procedure call")
+			if first.value+"(" not in self.globals:							# call exists ?
+				raise AssemblerException("Unknown procedure "+first.value)
+			params = [x for x in cmd[2:-1] if x.value != ","]				# parameters
+			if len(params) > 4:
+				raise AssemblerException("Too many parameters")
 			for i in range(0,len(params)):									# work through them
-				m2 = re.match("^(\@?)(\d+)$",params[i])						# check syntax
-				if m2 is None:
-					raise AssemblerException("Bad parameter "+params[i])
+				if params[i].kind != Token.Number and params[i].kind != Token.Variable:
+					raise AssemblerException("Bad parameter "+params[i].text())
 																			# code to load to temp reg
-				self.codeGen.loadParamRegister(i,m2.group(1) == "",int(m2.group(2)))
-			self.codeGen.callSubroutine(self.globals[m.group(1)])			# caller code.
+				self.procedure.add("loadparam",i,params[i].kind == Token.Number,params[i].value)
+			self.procedure.add("call",self.globals[first.value+"("])		# caller code.
 			return		
 		#
 		self.compileExpression(cmd)											# compile as expression.
@@ -164,20 +347,112 @@ class AssemblerWorker(object):
 	#		Compile an expression.
 	#		
 	def compileExpression(self,expr):
-		expr = [x for x in re.split("(\@?\d+)",expr) if x != ""]			# split round terms
+		terms = [] 															# [operator,isConstant,value]
 		pendingOp = None													# No operator in progress
 		for x in expr:														# work through.
-			m = re.match("^(\@?)(\d+)$",x)									# is it nnnn or @nnnn
-			if m is not None:
-				if pendingOp is not None:									# Operator, do it.
-					self.codeGen.binaryOperation(pendingOp,m.group(1) == "",int(m.group(2)))
-				else:														# No Op, load first value
-					self.codeGen.loadDirect(m.group(1) == "",int(m.group(2)))
+			if x.kind == Token.Number or x.kind == Token.Variable:			# is it nnnn or @nnnn
+				terms.append([pendingOp,x.kind == Token.Number,x.value])	# None is a load
 				pendingOp = None											# No pending operator
 			else:
-				if "+-*/%&|^>!".find(x) < 0:								# check its a known operator
-					raise AssemblerException("Can't recognise "+x+" in expression")
-				pendingOp = x												# mark as pending.
+				if x.kind != Token.Operator or "+-*/%&|^>!?".find(x.value) < 0 or pendingOp is not None:
+					raise AssemblerException("Can't recognise "+x.text()+" in expression")
+				pendingOp = x.value											# mark as pending.
+		if pendingOp is not None:
+			raise AssemblerException("Missing term in expression")
+		for op,isConstant,value in self.foldConstants(terms):
+			if op is not None:												# Operator, do it.
+				self.procedure.add("binary",op,isConstant,value)
+			else:															# No Op, load first value
+				self.procedure.add("load",isConstant,value)
+	#
+	#		Fold constants. Expressions are evaluated left to right, so a constant load
+	#		followed by constant terms is worked out here, as are runs of constant terms
+	#		that can be combined (+ and -, *, /, &, |, ^). Arithmetic is 16 bit unsigned.
+	#		Addresses only known when linked are symbols, which can be offset but not
+	#		otherwise folded.
+	#
+	def foldConstants(self,terms):
+		folded = []
+		for term in terms:
+			op,isConstant,value = term
+			if isConstant and isinstance(value,Symbol):						# address of symbol
+				previous = folded[-1] if len(folded) > 0 else None
+				if op == "+" and previous is not None and previous[0] is None \
+									and previous[1] and isinstance(previous[2],int):
+					previous[2] = value.add(previous[2])					# n+symbol
+					continue
+				folded.append(list(term))
+				continue
+			if op is not None and isConstant and (op == "/" or op == "%") and value & 0xFFFF == 0:
+				raise AssemblerException("Division by zero")
+			previous = folded[-1] if len(folded) > 0 else None
+			if previous is not None and previous[1] and isinstance(previous[2],Symbol) and isConstant:
+				if previous[0] is None and (op == "+" or op == "-"):		# symbol load +/- offset
+					previous[2] = previous[2].add(value if op == "+" else -value)
+					continue
+				folded.append(list(term))
+				continue
+			if previous is not None and previous[1] and isConstant:
+				if previous[0] is None and op in AssemblerWorker.evaluate:	# constant load, work out.
+					previous[2] = AssemblerWorker.evaluate[op](previous[2] & 0xFFFF,value & 0xFFFF) & 0xFFFF
+					continue
+				combine = AssemblerWorker.combine.get(op)					# constant run, combine.
+				if previous[0] is not None and AssemblerWorker.combine.get(previous[0]) == combine \
+															and combine is not None:
+					if op == "-":											# +/- done as adds.
+						op,value = "+",-value
+					if previous[0] == "-":
+						previous[0],previous[2] = "+",-previous[2]
+					if op == "/" and previous[2] * value > 0xFFFF:			# x/a/b is x/(a*b)
+						folded.append(list(term))
+						continue
+					previous[2] = AssemblerWorker.merge[combine](previous[2] & 0xFFFF,value & 0xFFFF) & 0xFFFF
+					if previous[2] == AssemblerWorker.identity[combine]:	# does nothing now
+						folded.pop()
+					continue
+			if op is not None and isConstant and AssemblerWorker.identity.get(op) == value & 0xFFFF:
+				continue													# x+0 x*1 etc.
+			folded.append(list(term))
+		return folded
+
+	evaluate = { "+":lambda a,b:a+b,"-":lambda a,b:a-b,"*":lambda a,b:a*b,"/":lambda a,b:a//b,
+				 "%":lambda a,b:a % b,"&":lambda a,b:a & b,"|":lambda a,b:a | b,"^":lambda a,b:a ^ b }
+	combine = { "+":"+","-":"+","*":"*","/":"/","&":"&","|":"|","^":"^" }
+	merge = { "+":lambda a,b:a+b,"*":lambda a,b:a*b,"/":lambda a,b:a*b,
+			  "&":lambda a,b:a & b,"|":lambda a,b:a | b,"^":lambda a,b:a ^ b }
+	identity = { "+":0,"-":0,"*":1,"/":1,"&":0xFFFF,"|":0,"^":0 }
+
+# ***************************************************************************************
+#
+#		Worker process, compiles one procedure at a time. Errors are returned as
+#		(message,line) and reported by the main process.
+#
+# ***************************************************************************************
+
+def startWorker(factory,knownGlobals,names,modules):
+	global processWorker,processGlobals,processNames
+	sys.stdout = open(os.devnull,"w")
+	processWorker = AssemblerWorker(factory[0](*factory[1]))
+	processGlobals = knownGlobals
+	processNames = names
+	for module in modules:													# compiled already, for
+		processWorker.codeGen.addModule(module)								# inlining
+
+def compileJob(job):
+	index,tokens,inlines = job
+	for module in inlines:													# called, compiled in an
+		processWorker.codeGen.addModule(module)								# earlier wave
+	processWorker.globals = dict(processGlobals)							# procedures before this
+	for name in processNames[:index]:										# are linked by name.
+		if name is not None:
+			processWorker.globals[name] = Symbol(name)
+	try:
+		module = processWorker.compileProcedure(tokens)
+	except AssemblerException as e:
+		return (e.message,AssemblerException.LINE)
+	finally:
+		processWorker.codeGen.modules = []
+	return module
 
 if __name__ == "__main__":
 	src = """
@@ -198,7 +473,11 @@ if __name__ == "__main__":
 	""".split("\n")
 	#cg = DemoCodeGenerator()
 	cg = Z80CodeGenerator()
-	aw = AssemblerWorker(cg)		
+	aw = AssemblerWorker(cg,ListingWriter(sys.stdout))
 	aw.assemble(src)
+	aw.listing.close()
 	print(aw.globals)
+	if isinstance(cg,Z80CodeGenerator):
+		print(cg.report())
+		print(cg.profileReport())
 	#aw.codeGen.image.save()
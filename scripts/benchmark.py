@@ -0,0 +1,252 @@
+# ***************************************************************************************
+# ***************************************************************************************
+#
+#		Name : 		benchmark.py
+#		Author :	Paul Robson (paul@robsons.org.uk)
+#		Date : 		25th January 2019
+#		Purpose :	Assembler throughput benchmarks, with timing of each phase
+#
+# ***************************************************************************************
+# ***************************************************************************************
+
+from assembler import *
+import contextlib,inspect,json,platform,random,tempfile,time,tracemalloc
+
+# ***************************************************************************************
+#
+#		Synthetic HLA program. Each procedure has up to three parameters and the rest
+#		of its locals, uses some string constants, has loops and ifs nested to the
+#		given depth, and calls fanOut of the procedures before it.
+#
+# ***************************************************************************************
+
+class ProgramGenerator(object):
+	def __init__(self,procedures = 100,locals = 4,strings = 2,depth = 2,fanOut = 2,seed = 42):
+		self.procedures = procedures
+		self.locals = max(1,locals)
+		self.strings = strings
+		self.depth = depth
+		self.fanOut = fanOut
+		self.random = random.Random(seed)
+	#
+	#		Parameters, for the results file.
+	#
+	def settings(self):
+		return { "procedures":self.procedures,"locals":self.locals,"strings":self.strings,
+				 "depth":self.depth,"fanOut":self.fanOut }
+	#
+	#		Generate the program, a list of lines.
+	#
+	def generate(self):
+		lines = []
+		for n in range(0,self.procedures):
+			names = ["v{0}".format(i) for i in range(0,self.locals)]
+			lines.append("defproc proc{0}({1})".format(n,",".join(names[:3])))
+			for i in range(0,self.locals):
+				lines.append("\t{0}*{1}+{2}>@{3}".format(self.pick(names),self.random.randrange(1,9),
+																self.random.randrange(0,100),names[i]))
+			for i in range(0,self.strings):									# strings are shared
+				lines.append("\t\"text {0}\">@{1}".format(self.random.randrange(0,64),self.pick(names)))
+			lines += self.nested(names,self.depth,n,"\t")
+			lines.append("\t$total{0}+{1}>@$total{0}".format(n % 8,self.pick(names)))
+			lines.append("endproc")
+			lines.append("")
+		return lines
+	#
+	def pick(self,names):
+		return names[self.random.randrange(0,len(names))]
+	#
+	#		Body at a nesting depth, a while with an if inside, down to the calls.
+	#
+	def nested(self,names,depth,n,indent):
+		if depth == 0:
+			lines = []
+			for i in range(0,min(n,self.fanOut)):
+				callee = self.random.randrange(0,n)
+				arguments = [self.pick(names) for a in range(0,min(3,self.locals))]
+				lines.append(indent+"proc{0}({1})".format(callee,",".join(arguments)))
+			lines.append(indent+"{0}/3-{1}&255>@{2}".format(self.pick(names),self.pick(names),self.pick(names)))
+			return lines
+		counter,test = self.pick(names),self.pick(names)
+		lines = [indent+"while ({0}#0)".format(counter)]
+		lines.append(indent+"\tif ({0}<0)".format(test))
+		lines += self.nested(names,depth-1,n,indent+"\t\t")
+		lines.append(indent+"\tendif")
+		lines.append(indent+"\t{0}-1>@{0}".format(counter))
+		lines.append(indent+"endwhile")
+		return lines
+
+# ***************************************************************************************
+#
+#		Opt in timing of phases. Methods of an object are replaced by timed versions,
+#		so nothing is changed when this is not used. Times include the phases called
+#		from inside. Generators are timed while producing each item.
+#
+# ***************************************************************************************
+
+class PhaseTimer(object):
+	def __init__(self):
+		self.phases = {} 													# phase -> [seconds,calls]
+	#
+	def instrument(self,owner,method,phase = None):
+		phase = method if phase is None else phase
+		original = getattr(owner,method)
+		def timed(*args,**kwargs):
+			start = time.perf_counter()
+			try:
+				result = original(*args,**kwargs)
+			finally:
+				self.add(phase,time.perf_counter()-start)
+			return self.timeGenerator(phase,result) if inspect.isgenerator(result) else result
+		setattr(owner,method,timed)
+	#
+	def timeGenerator(self,phase,generator):
+		while True:
+			start = time.perf_counter()
+			try:
+				item = next(generator)
+			except StopIteration:
+				self.add(phase,time.perf_counter()-start,0)
+				return
+			self.add(phase,time.perf_counter()-start,0)
+			yield item
+	#
+	def add(self,phase,seconds,calls = 1):
+		entry = self.phases.setdefault(phase,[0.0,0])
+		entry[0] += seconds
+		entry[1] += calls
+	#
+	def results(self):
+		return { phase:{ "seconds":round(s,6),"calls":c } for phase,(s,c) in self.phases.items() }
+
+# ***************************************************************************************
+#
+#		Runs the benchmarks. Each program is assembled once plain for the throughput,
+#		once with the phases timed, and once with tracemalloc for the peak memory.
+#
+# ***************************************************************************************
+
+class Benchmark(object):
+	codeGenerators = ("z80","demo")
+
+	def __init__(self,imageFile = None,repeat = 3,memory = True):
+		self.imageFile = imageFile or os.path.join(os.path.dirname(os.path.abspath(__file__)),"boot.img")
+		self.repeat = repeat
+		self.memory = memory
+		self.results = []
+	#
+	#		Create a code generator and an assembler for it.
+	#
+	def create(self,kind):
+		codeGen = Z80CodeGenerator(MemoryImage(self.imageFile)) if kind == "z80" else DemoCodeGenerator()
+		return codeGen,AssemblerWorker(codeGen)
+	#
+	#		Bytes of code generated. The demo code generator counts its own units.
+	#
+	def codeSize(self,codeGen,start):
+		if isinstance(codeGen,DemoCodeGenerator):
+			return codeGen.getAddress()-start
+		paged = sum([free-0xC000 for free in codeGen.linker.pageFree.values()])
+		return codeGen.image.getCodeAddress()-start+paged
+	#
+	#		Assemble and save once, returns (seconds,bytes). The demo code generator
+	#		prints its code, which is thrown away.
+	#
+	def assembleOnce(self,kind,lines,timer = None):
+		codeGen,worker = self.create(kind)
+		if timer is not None:
+			for method in ("compileProcedure","processVars","compileBody","compileExpression"):
+				timer.instrument(worker,method)
+			timer.instrument(worker.lexer,"tokenise")
+			timer.instrument(codeGen,"lower")
+			timer.instrument(codeGen,"link")
+			if kind == "z80":
+				timer.instrument(codeGen.image,"save")
+		start = codeGen.image.getCodeAddress() if kind == "z80" else codeGen.getAddress()
+		with open(os.devnull,"w") as null, contextlib.redirect_stdout(null):
+			began = time.perf_counter()
+			worker.assemble(lines)
+			if kind == "z80":
+				with tempfile.TemporaryDirectory() as directory:
+					codeGen.image.save(os.path.join(directory,"benchmark.img"))
+			seconds = time.perf_counter()-began
+		return seconds,self.codeSize(codeGen,start)
+	#
+	#		Run a generated program through each code generator.
+	#
+	def run(self,name,generator):
+		lines = generator.generate()
+		for kind in Benchmark.codeGenerators:
+			seconds,size = min([self.assembleOnce(kind,lines) for i in range(0,self.repeat)])
+			timer = PhaseTimer()
+			self.assembleOnce(kind,lines,timer)
+			result = { "name":name,"codeGenerator":kind,"settings":generator.settings(),
+					   "lines":len(lines),"bytes":size,"seconds":round(seconds,6),
+					   "linesPerSecond":round(len(lines)/seconds,1),"bytesPerSecond":round(size/seconds,1),
+					   "phases":timer.results() }
+			if self.memory:
+				tracemalloc.start()
+				self.assembleOnce(kind,lines)
+				result["peakMemory"] = tracemalloc.get_traced_memory()[1]
+				tracemalloc.stop()
+			self.results.append(result)
+			print("{0:12} {1:5} {2:7} lines {3:9.0f} lines/s {4:9.0f} bytes/s {5}".format(name,kind,len(lines),
+					result["linesPerSecond"],result["bytesPerSecond"],
+					"{0:.1f}Mb".format(result["peakMemory"]/1048576) if self.memory else ""))
+	#
+	def save(self,fileName):
+		with open(fileName,"w") as h:
+			json.dump({ "python":platform.python_version(),"machine":platform.machine(),
+						"time":time.strftime("%Y-%m-%d %H:%M:%S"),"results":self.results },h,indent = 1)
+
+# ***************************************************************************************
+#
+#		Compare two results files, the change in each measurement as a percentage.
+#
+# ***************************************************************************************
+
+def compareResults(oldFile,newFile):
+	old,new = [json.load(open(f))["results"] for f in (oldFile,newFile)]
+	old = { (r["name"],r["codeGenerator"]):r for r in old }
+	report = []
+	change = lambda a,b: "{0:+7.1f}%".format((b-a)*100.0/a) if a else "      -"
+	for r in new:
+		o = old.get((r["name"],r["codeGenerator"]))
+		if o is None:
+			report.append("{0:12} {1:5} new".format(r["name"],r["codeGenerator"]))
+			continue
+		report.append("{0:12} {1:5} lines/s {2} bytes/s {3} memory {4}".format(r["name"],r["codeGenerator"],
+					change(o["linesPerSecond"],r["linesPerSecond"]),change(o["bytesPerSecond"],r["bytesPerSecond"]),
+					change(o.get("peakMemory"),r.get("peakMemory",0))))
+		for phase in sorted(r["phases"]):
+			if phase in o["phases"]:
+				report.append("    {0:20} {1}".format(phase,change(o["phases"][phase]["seconds"],r["phases"][phase]["seconds"])))
+	return "\n".join(report)
+
+#
+#		Standard suite, growing in each direction from a small program.
+#
+suite = [
+	("small",{ "procedures":50 }),
+	("procedures",{ "procedures":400 }),
+	("locals",{ "procedures":100,"locals":12 }),
+	("strings",{ "procedures":100,"strings":10 }),
+	("nesting",{ "procedures":100,"depth":5 }),
+	("calls",{ "procedures":200,"fanOut":8 }),
+]
+
+if __name__ == "__main__":
+	import argparse
+	parser = argparse.ArgumentParser(description = "Benchmark the assembler")
+	parser.add_argument("-o","--output",default = "benchmark.json",help = "results file")
+	parser.add_argument("-c","--compare",metavar = "OLD",help = "compare the results with an earlier file")
+	parser.add_argument("-r","--repeat",type = int,default = 3,help = "timed runs, the best is used")
+	parser.add_argument("-q","--quick",action = "store_true",help = "first benchmark only")
+	parser.add_argument("--no-memory",action = "store_true",help = "do not measure peak memory")
+	args = parser.parse_args()
+	benchmark = Benchmark(repeat = args.repeat,memory = not args.no_memory)
+	for name,settings in suite[:1] if args.quick else suite:
+		benchmark.run(name,ProgramGenerator(**settings))
+	benchmark.save(args.output)
+	if args.compare is not None:
+		print(compareResults(args.compare,args.output))
@@ -0,0 +1,174 @@
+# ***************************************************************************************
+# ***************************************************************************************
+#
+#		Name : 		buildcache.py
+#		Author :	Paul Robson (paul@robsons.org.uk)
+#		Date : 		23rd January 2019
+#		Purpose :	On disk cache of compiled object modules
+#
+# ***************************************************************************************
+# ***************************************************************************************
+
+from objectcode import *
+import collections,hashlib,os,pickle,tempfile
+
+# ***************************************************************************************
+#
+#		Object modules stored one per file, named by the hash of everything that went
+#		into compiling them. Files are touched when used, and the least recently used
+#		are removed when the cache is larger than maxSize bytes.
+#
+# ***************************************************************************************
+
+class BuildCache(object):
+	def __init__(self,directory = ".hlacache",maxSize = 16*1024*1024):
+		self.directory = directory
+		self.maxSize = maxSize
+		self.hits = 0
+		self.misses = 0
+		if not os.path.isdir(directory):
+			os.makedirs(directory)
+		self.files = {} 													# key -> (time,size)
+		for entry in os.scandir(directory):
+			if entry.name.endswith(".obj"):
+				info = entry.stat()
+				self.files[entry.name[:-4]] = (info.st_mtime,info.st_size)
+		self.version = BuildCache.compilerVersion()
+		self.evict()
+	#
+	#		Hash of the compiler source, so a changed compiler does not use old code.
+	#
+	@staticmethod
+	def compilerVersion():
+		directory = os.path.dirname(os.path.abspath(__file__))
+		digest = hashlib.sha1()
+		for name in sorted(os.listdir(directory)):
+			if name.endswith(".py"):
+				with open(os.path.join(directory,name),"rb") as h:
+					digest.update(h.read())
+		return digest.hexdigest()
+	#
+	#		Key from a list of strings.
+	#
+	def key(self,parts):
+		digest = hashlib.sha1(self.version.encode())
+		for part in parts:
+			digest.update(b"\0"+part.encode())
+		return digest.hexdigest()
+	#
+	def fileName(self,key):
+		return os.path.join(self.directory,key+".obj")
+	#
+	#		Get a module, or None. Source line numbers are stored relative to the
+	#		start of the procedure, line is where it now starts.
+	#
+	def get(self,key,line = 0):
+		if key not in self.files:
+			self.misses += 1
+			return None
+		try:
+			with open(self.fileName(key),"rb") as h:
+				module = pickle.load(h)
+			os.utime(self.fileName(key))
+		except (OSError,EOFError,pickle.UnpicklingError):					# gone or damaged
+			self.files.pop(key)
+			self.misses += 1
+			return None
+		self.files[key] = (os.path.getmtime(self.fileName(key)),self.files[key][1])
+		self.hits += 1
+		module.moveLines(line)
+		return module
+	#
+	#		Store a module, written to a temporary file and renamed, so a cache file
+	#		is never seen half written.
+	#
+	def put(self,key,module,line = 0):
+		module.moveLines(-line)
+		data = pickle.dumps(module,pickle.HIGHEST_PROTOCOL)
+		module.moveLines(line)
+		handle,tempName = tempfile.mkstemp(dir = self.directory,suffix = ".tmp")
+		with os.fdopen(handle,"wb") as h:
+			h.write(data)
+		os.replace(tempName,self.fileName(key))
+		self.files[key] = (os.path.getmtime(self.fileName(key)),len(data))
+		self.evict()
+	#
+	#		Remove least recently used modules until within the size limit.
+	#
+	def evict(self):
+		total = sum([size for time,size in self.files.values()])
+		for key in sorted(self.files,key = lambda k:self.files[k][0]):
+			if total <= self.maxSize:
+				break
+			total -= self.files.pop(key)[1]
+			try:
+				os.remove(self.fileName(key))
+			except OSError:
+				pass
+	#
+	#		Remove everything.
+	#
+	def clear(self):
+		for key in list(self.files):
+			os.remove(self.fileName(key))
+		self.files = {}
+	#
+	def report(self):
+		size = sum([size for time,size in self.files.values()])
+		return "cache {0} hits {1} misses, {2} modules {3} bytes".format(self.hits,self.misses,len(self.files),size)
+
+# ***************************************************************************************
+#
+#		The same kept in memory, for a long running assembler. Modules are stored
+#		pickled, so each build gets its own copy. Misses can be looked up in an on
+#		disk BuildCache, and modules stored are written through to it.
+#
+# ***************************************************************************************
+
+class MemoryCache(BuildCache):
+	def __init__(self,backing = None,maxSize = 64*1024*1024):
+		self.backing = backing
+		self.maxSize = maxSize
+		self.hits = 0
+		self.misses = 0
+		self.files = collections.OrderedDict() 								# key -> pickled module
+		self.version = BuildCache.compilerVersion() if backing is None else backing.version
+	#
+	def get(self,key,line = 0):
+		if key not in self.files:
+			module = self.backing.get(key,line) if self.backing is not None else None
+			if module is None:
+				self.misses += 1
+				return None
+			self.hits += 1
+			self.store(key,module,line)
+			return module
+		self.files.move_to_end(key)
+		self.hits += 1
+		module = pickle.loads(self.files[key])
+		module.moveLines(line)
+		return module
+	#
+	def put(self,key,module,line = 0):
+		self.store(key,module,line)
+		if self.backing is not None:
+			self.backing.put(key,module,line)
+	#
+	def store(self,key,module,line):
+		module.moveLines(-line)
+		self.files[key] = pickle.dumps(module,pickle.HIGHEST_PROTOCOL)
+		module.moveLines(line)
+		self.files.move_to_end(key)
+		self.evict()
+	#
+	def evict(self):
+		total = sum([len(data) for data in self.files.values()])
+		while total > self.maxSize:
+			total -= len(self.files.popitem(last = False)[1])
+	#
+	def clear(self):
+		self.files = collections.OrderedDict()
+	#
+	def report(self):
+		size = sum([len(data) for data in self.files.values()])
+		return "memory cache {0} hits {1} misses, {2} modules {3} bytes".format(self.hits,self.misses,len(self.files),size)
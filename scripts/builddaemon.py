@@ -0,0 +1,265 @@
+# ***************************************************************************************
+# ***************************************************************************************
+#
+#		Name : 		builddaemon.py
+#		Author :	Paul Robson (paul@robsons.org.uk)
+#		Date : 		25th January 2019
+#		Purpose :	Long running assembler, rebuilding when the source changes
+#
+# ***************************************************************************************
+# ***************************************************************************************
+
+from assembler import *
+import ctypes,ctypes.util,json,select,socket,struct,time
+
+# ***************************************************************************************
+#
+#		Watches a set of files for changes. Directories are watched rather than the
+#		files, as editors often save by writing a new file and renaming it.
+#
+# ***************************************************************************************
+
+class PollingWatcher(object):
+	def __init__(self,interval = 0.25):
+		self.interval = interval 											# seconds between polls
+		self.files = {} 													# file -> (mtime,size)
+	#
+	#		Set the files being watched.
+	#
+	def watch(self,files):
+		self.files = { f:self.state(f) for f in files }
+	#
+	def state(self,fileName):
+		try:
+			info = os.stat(fileName)
+			return (info.st_mtime_ns,info.st_size)
+		except OSError:
+			return None
+	#
+	#		Descriptor to wait on, None if the files have to be polled.
+	#
+	def fileno(self):
+		return None
+	#
+	#		Files changed since the last call.
+	#
+	def changes(self):
+		changed = set()
+		for fileName,state in self.files.items():
+			now = self.state(fileName)
+			if now != state:
+				self.files[fileName] = now
+				changed.add(fileName)
+		return changed
+	#
+	def close(self):
+		pass
+
+class InotifyWatcher(PollingWatcher):
+	events = 0x08|0x80|0x100|0x200 										# close write, moved to,
+																			# create, delete
+	def __init__(self):
+		PollingWatcher.__init__(self)
+		self.libc = ctypes.CDLL(ctypes.util.find_library("c"),use_errno = True)
+		self.handle = self.libc.inotify_init1(os.O_NONBLOCK|os.O_CLOEXEC)
+		if self.handle < 0:
+			raise OSError(ctypes.get_errno(),"inotify_init1 failed")
+		self.directories = {} 												# watch -> directory
+	#
+	def watch(self,files):
+		self.files = { f:None for f in files }
+		for directory in set([os.path.dirname(f) for f in files]) - set(self.directories.values()):
+			watch = self.libc.inotify_add_watch(self.handle,directory.encode(),InotifyWatcher.events)
+			if watch < 0:
+				raise OSError(ctypes.get_errno(),"Can't watch "+directory)
+			self.directories[watch] = directory
+	#
+	def fileno(self):
+		return self.handle
+	#
+	#		Read the events, each is watch,mask,cookie,length then the name padded
+	#		with zeros.
+	#
+	def changes(self):
+		changed = set()
+		while True:
+			try:
+				data = os.read(self.handle,65536)
+			except BlockingIOError:
+				return changed
+			p = 0
+			while p < len(data):
+				watch,mask,cookie,length = struct.unpack_from("iIII",data,p)
+				name = data[p+16:p+16+length].rstrip(b"\0").decode()
+				fileName = os.path.join(self.directories.get(watch,""),name)
+				if fileName in self.files:
+					changed.add(fileName)
+				p = p + 16 + length
+	#
+	def close(self):
+		os.close(self.handle)
+
+#
+#		inotify if the C library has it, otherwise polling.
+#
+def createWatcher():
+	try:
+		return InotifyWatcher()
+	except (OSError,AttributeError,TypeError):
+		return PollingWatcher()
+
+# ***************************************************************************************
+#
+#		The daemon. The boot image is loaded and its dictionary indexed once, each
+#		build starts from a copy of it. Compiled procedures are kept in a MemoryCache,
+#		so only those whose source has changed, or which call one that has, are
+#		compiled again. Requests come in on a unix socket, one line each:
+#
+#			build 		rebuild now
+#			status		the result of the last build
+#			stop		stop the daemon
+#
+#		and are answered with a line of JSON.
+#
+# ***************************************************************************************
+
+class BuildDaemon(object):
+	def __init__(self,source,output,imageFile = "boot.img",boot = None,socketName = ".hlad.socket",cache = None,sparse = False):
+		self.source = os.path.abspath(source)
+		self.output = output
+		self.sparse = sparse 												# write sparse images
+		self.boot = boot 													# boot procedure or None
+		self.socketName = socketName
+		self.base = MemoryImage(imageFile)
+		self.cache = MemoryCache(cache)
+		self.watcher = createWatcher()
+		self.watcher.watch([self.source])
+		self.delay = 0.05 													# wait for more changes
+		self.builds = 0
+		self.result = None
+		self.running = False
+	#
+	#		Build from a copy of the base image, returning a dictionary describing the
+	#		result. The files watched are the ones read, including the includes.
+	#
+	def build(self):
+		began = time.perf_counter()
+		hits,misses = self.cache.hits,self.cache.misses
+		codeGen = Z80CodeGenerator(self.base.copy())
+		worker = AssemblerWorker(codeGen,cache = self.cache)
+		self.builds += 1
+		result = { "build":self.builds,"ok":False }
+		try:
+			worker.assemble(self.source)
+			if self.boot is not None:
+				if self.boot+"(" not in worker.globals:
+					raise AssemblerException("Unknown procedure "+self.boot)
+				address = worker.globals[self.boot+"("]
+				codeGen.image.setBoot(address >> 16,address & 0xFFFF)
+			if self.sparse:
+				size = codeGen.image.saveSparse(self.output)
+			else:
+				codeGen.image.save(self.output)
+				size = codeGen.image.getSize()
+			result.update({ "ok":True,"output":self.output,"size":size })
+		except AssemblerException as e:
+			result.update({ "error":e.message,"line":AssemblerException.LINE })
+		except (LinkerError,ImageError,OSError) as e:
+			result.update({ "error":str(e) })
+		self.watcher.watch(list(set([self.source]+getattr(worker,"sources",[]))))
+		result.update({ "compiled":self.cache.misses-misses,"cached":self.cache.hits-hits,
+						"seconds":round(time.perf_counter()-began,4) })
+		self.result = result
+		return result
+	#
+	#		Serve until stopped. The socket and the watcher are waited on together,
+	#		with a timeout if the watcher has to poll.
+	#
+	def serve(self):
+		if os.path.exists(self.socketName):
+			os.remove(self.socketName)
+		server = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+		server.bind(self.socketName)
+		server.listen(4)
+		self.log(self.build())
+		self.running = True
+		try:
+			while self.running:
+				waiting = [server] if self.watcher.fileno() is None else [server,self.watcher]
+				ready = select.select(waiting,[],[],self.watcher.interval if self.watcher.fileno() is None else None)[0]
+				if server in ready:
+					self.request(server.accept()[0])
+				if self.watcher.fileno() is None or self.watcher in ready:
+					if len(self.watcher.changes()) > 0:
+						time.sleep(self.delay)								# a save can be several
+						self.watcher.changes()								# writes, take them all
+						self.log(self.build())
+		finally:
+			server.close()
+			self.watcher.close()
+			os.remove(self.socketName)
+	#
+	#		Answer one request.
+	#
+	def request(self,connection):
+		with connection:
+			connection.settimeout(5)
+			try:
+				command = connection.makefile().readline().strip()
+			except OSError:
+				return
+			if command == "build":
+				reply = self.build()
+				self.log(reply)
+			elif command == "status":
+				reply = self.result
+			elif command == "stop":
+				self.running = False
+				reply = { "ok":True }
+			else:
+				reply = { "ok":False,"error":"Unknown command "+command }
+			connection.sendall((json.dumps(reply)+"\n").encode())
+	#
+	def log(self,result):
+		if result["ok"]:
+			text = "{0} bytes".format(result["size"])
+		else:
+			text = "error {0}".format(result["error"])+(" at {0}".format(result["line"]) if "line" in result else "")
+		print("build {0}: {1}, {2} compiled, {3} cached, {4:.1f}ms".format(result["build"],text,result["compiled"],
+																			result["cached"],result["seconds"]*1000))
+		sys.stdout.flush()
+
+#
+#		Send a command to a running daemon, returns the reply.
+#
+def sendCommand(command,socketName = ".hlad.socket"):
+	with socket.socket(socket.AF_UNIX,socket.SOCK_STREAM) as client:
+		client.connect(socketName)
+		client.sendall((command+"\n").encode())
+		return json.loads(client.makefile().readline())
+
+if __name__ == "__main__":
+	import argparse
+	parser = argparse.ArgumentParser(description = "Assembler daemon, rebuilds when the source changes")
+	parser.add_argument("source",nargs = "?",help = "source file")
+	parser.add_argument("-o","--output",default = "test.img",help = "image written")
+	parser.add_argument("-i","--image",default = "boot.img",help = "boot image built on")
+	parser.add_argument("-b","--boot",help = "procedure run at boot")
+	parser.add_argument("-s","--socket",default = ".hlad.socket",help = "socket for requests")
+	parser.add_argument("-c","--cache",help = "on disk cache directory")
+	parser.add_argument("--sparse",action = "store_true",help = "write a sparse image")
+	parser.add_argument("--poll",action = "store_true",help = "poll for changes rather than use inotify")
+	parser.add_argument("--send",metavar = "COMMAND",help = "send build, status or stop to a running daemon")
+	args = parser.parse_args()
+	if args.send is not None:
+		print(json.dumps(sendCommand(args.send,args.socket)))
+	elif args.source is None:
+		parser.error("no source file")
+	else:
+		daemon = BuildDaemon(args.source,args.output,args.image,args.boot,args.socket,
+										None if args.cache is None else BuildCache(args.cache),args.sparse)
+		if args.poll:
+			daemon.watcher.close()
+			daemon.watcher = PollingWatcher()
+			daemon.watcher.watch([daemon.source])
+		daemon.serve()
@@ -0,0 +1,168 @@
+# ***************************************************************************************
+# ***************************************************************************************
+#
+#		Name : 		costmodel.py
+#		Author :	Paul Robson (paul@robsons.org.uk)
+#		Date : 		24th January 2019
+#		Purpose :	T-state costs and static profile of generated code
+#
+# ***************************************************************************************
+# ***************************************************************************************
+
+from objectcode import *
+
+# ***************************************************************************************
+#
+#		T-states for the instruction templates the Z80 code generator uses, from the
+#		Zilog timings. Conditional branches are (taken,not taken). nextreg is the
+#		Spectrum Next timing.
+#
+# ***************************************************************************************
+
+class CostModel(object):
+	cycles = {
+		"ld hl,nn":10,				"ld hl,(nn)":16,				"ld (nn),hl":16,
+		"ld de,nn":10,				"ld de,(nn)":20,				"ld (nn),de":20,
+		"ld bc,nn":10,				"ld bc,(nn)":20,				"ld (nn),bc":20,
+		"ld ix,nn":14,				"ld ix,(nn)":20,				"ld (nn),ix":20,
+		"add hl,bc":11,				"sbc hl,bc":15,					"xor a":4,
+		"inc hl":6,					"dec hl":6,						"ex de,hl":4,
+		"ld a,(hl)":7,				"ld l,(hl)":7,					"ld h,(hl)":7,
+		"ld l,a":4,					"ld h,n":7,						"ld b,h":4,
+		"ld c,l":4,					"ld (hl),e":7,					"ld (hl),d":7,
+		"call nn":17,				"jp nn":10,						"ret":10,
+		"add hl,hl":11,				"add hl,de":11,					"ld d,h":4,
+		"ld e,l":4,					"srl h":8,						"rr l":8,
+		"srl l":8,
+		"ld a,h":4,					"ld a,l":4,						"ld h,a":4,
+		"ld l,h":4,					"ld l,n":7,						"cpl":4,
+		"and n":7,					"or n":7,						"xor n":7,
+		"or l":4,					"bit 7,h":8,
+		"jr e":12,					"jr z,e":(12,7),				"jr nz,e":(12,7),
+		"jp z,nn":(10,10),			"jp nz,nn":(10,10),				"jp p,nn":(10,10),
+		"and d":4,					"and e":4,						"or d":4,
+		"or e":4,					"xor d":4,						"xor e":4,
+		"ld a,(nn)":13,				"ld (nn),a":13,					"ld a,n":7,
+		"push af":11,				"pop af":10,					"inc a":4,
+		"nextreg $56,a":17,			"nextreg $57,a":17,
+		"ld b,d":4,					"ld c,e":4,						"ld h,b":4,
+		"ld l,c":4,					"ld d,b":4,						"ld e,c":4,
+		"ex af,af'":4,				"push bc":11,					"pop bc":10,
+		"out (c),a":12,				"in a,(c)":12,					"inc b":4,
+		"jp (ix)":8,
+	}
+	#
+	#		Cost if a branch is taken, and if it is not. The same for anything else.
+	#
+	@staticmethod
+	def taken(template):
+		cost = CostModel.cycles[template]
+		return cost[0] if isinstance(cost,tuple) else cost
+	@staticmethod
+	def notTaken(template):
+		cost = CostModel.cycles[template]
+		return cost[1] if isinstance(cost,tuple) else cost
+	#
+	#		Cost as text, for the listing.
+	#
+	@staticmethod
+	def text(template):
+		cost = CostModel.cycles[template]
+		return "{0}/{1}".format(*cost) if isinstance(cost,tuple) else str(cost)
+
+# ***************************************************************************************
+#
+#		Static profile of a procedure, from its laid out code. The code is split into
+#		basic blocks, at labels and after branches. Each block is
+#
+#			(start,end,cycles,exits)
+#
+#		cycles being the cost of everything but the final branch, exits a list of
+#		(target,cost) for the ways out of it, target None for leaving the procedure.
+#		A branch back is a loop, from its target to the end of its block. The cost of
+#		one iteration, and of running through the procedure once, is the best and
+#		worst of the paths through, not going round inner loops. Calls cost the call
+#		instruction only.
+#
+# ***************************************************************************************
+
+class StaticProfile(object):
+	def __init__(self,name,code,sizes):
+		self.name = name
+		self.blocks = []
+		start = address = cycles = 0
+		for template,operand in code:
+			if template == "source":
+				continue
+			if template == "label":
+				if address > start:											# falls into the label
+					self.blocks.append((start,address,cycles,[(address,0)]))
+				start,cycles = address,0
+				continue
+			address += sizes[template]
+			if template == "ret" or template.startswith("jr") or template.startswith("jp"):
+				exits = [(self.target(template,operand),CostModel.taken(template))]
+				if "," in template:											# conditional, can fall through
+					exits.append((address,CostModel.notTaken(template)))
+				self.blocks.append((start,address,cycles,exits))
+				start,cycles = address,0
+			else:
+				cycles += CostModel.cycles[template]
+		if address > start:
+			self.blocks.append((start,address,cycles,[(None,0)]))
+		self.size = address
+		self.once = self.paths(0,address,None)
+		self.loops = []
+		for start,end,cycles,exits in self.blocks:
+			for target,cost in exits:
+				if target is not None and target <= start and target not in [l[0] for l in self.loops]:
+					self.loops.append((target,end)+self.paths(target,end,target))
+	#
+	#		Where a branch goes, as an offset in the procedure, or None if it leaves it.
+	#
+	def target(self,template,operand):
+		if template.startswith("jr"):
+			return operand
+		if isinstance(operand,Symbol) and operand.name == self.name:
+			return operand.offset
+		return None
+	#
+	#		Best and worst cost of the paths from the block at first, through the blocks
+	#		before last, to a branch to end. Only forward branches are followed.
+	#
+	def paths(self,first,last,end):
+		reached = { first:(0,0) }											# block -> best,worst
+		best = worst = None
+		for start,blockEnd,cycles,exits in self.blocks:
+			if start < first or start >= last or start not in reached:
+				continue
+			low,high = reached[start]
+			for target,cost in exits:
+				low2,high2 = low+cycles+cost,high+cycles+cost
+				if target == end:
+					best = low2 if best is None else min(best,low2)
+					worst = high2 if worst is None else max(worst,high2)
+				elif target is not None and target > start and target < last:
+					if target in reached:
+						low2,high2 = min(reached[target][0],low2),max(reached[target][1],high2)
+					reached[target] = (low2,high2)
+		return (best,worst)
+	#
+	#		The most expensive loop iteration, or the procedure if it has no loops.
+	#
+	def worst(self):
+		costs = [l[3] for l in self.loops if l[3] is not None]
+		return max(costs) if len(costs) > 0 else (self.once[1] or 0)
+	#
+	def __str__(self):
+		text = lambda c: "-" if c[0] is None else "{0}-{1}".format(*c)
+		report = ["{0} {1} bytes, {2} blocks, {3} T once through".format(self.name[:-1],self.size,
+																		len(self.blocks),text(self.once))]
+		for start,end,cycles,exits in self.blocks:
+			costs = [cycles+cost for target,cost in exits]
+			report.append("    block +${0:04x}-+${1:04x} {2:5} bytes {3} T".format(start,end-1,end-start,
+																			text((min(costs),max(costs)))))
+		for start,end,best,worst in self.loops:
+			report.append("    loop  +${0:04x}-+${1:04x} {2:5} bytes {3} T per iteration".format(start,end-1,
+																			end-start,text((best,worst))))
+		return "\n".join(report)
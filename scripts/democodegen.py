@@ -9,20 +9,47 @@
 # ***************************************************************************************
 # ***************************************************************************************
 
+from listing import *
+from ir import *
+
 # ***************************************************************************************
 #					This is a code generator for an idealised CPU
 # ***************************************************************************************
 
-class DemoCodeGenerator(object):
+class DemoCodeGenerator(IRLowering):
 	def __init__(self):
 		self.pc = 0x1000
 		self.ops = { "+":"add","-":"sub","*":"mul","/":"div","%":"mod","&":"and","|":"ora","^":"xor" }
+		self.listing = Listing()
+		self.strings = {} 													# text -> address
+	#
+	#		Set/Get the listing sink. The generated code itself is always printed.
+	#
+	def setListing(self,listing):
+		self.listing = listing
+	def getListing(self):
+		return self.listing
 	#
 	#		Get current address
 	#
 	def getAddress(self):
 		return self.pc
 	#
+	#		Define the procedure being compiled, returns the value used to call it.
+	#
+	def defineProcedure(self,name):
+		return self.getAddress()
+	#
+	#		Can't be run in a worker process, as the code is printed.
+	#
+	def getWorker(self):
+		return None
+	#
+	#		Nothing to link, the code is printed as it is generated.
+	#
+	def link(self):
+		return {}
+	#
 	#		Get word size
 	#
 	def getWordSize(self):
@@ -38,9 +65,9 @@ class DemoCodeGenerator(object):
 	#		Do a binary operation on a constant or variable on the accumulator
 	#
 	def binaryOperation(self,operator,isConstant,value):
-		if operator == "!":
+		if operator == "!" or operator == "?":
 			self.binaryOperation("+",isConstant,value)
-			print("${0:06x}  lda.w [a]".format(self.pc))
+			print("${0:06x}  lda.{1} [a]".format(self.pc,"w" if operator == "!" else "b"))
 			self.pc += 1
 		elif operator == ">":
 			if isConstant:
@@ -85,10 +112,14 @@ class DemoCodeGenerator(object):
 		print("${0:06x}  str   r{1},(${2:04x})".format(self.pc,regNumber,address))
 		self.pc += 1
 	#
-	#		Create a string constant (done outside procedures)
+	#		Create a string constant (done outside procedures). Each string is only 
+	#		stored once, and the end of a longer string is used if it matches.
 	#
 	def createStringConstant(self,string):
-		sAddr = self.pc
+		for text,address in self.strings.items():
+			if text.endswith(string):
+				return address+len(text)-len(string)
+		sAddr = self.strings[string] = self.pc
 		print("${0:06x}  db    \"{1}\",0".format(self.pc,string))
 		self.pc += len(string)+1
 		return sAddr
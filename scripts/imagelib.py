@@ -9,18 +9,76 @@
 # ***************************************************************************************
 # ***************************************************************************************
 
-import sys
+import copy,mmap,os,re,struct,sys,tempfile
+from listing import *
+
+# ***************************************************************************************
+#									Exception for Images
+# ***************************************************************************************
+
+class ImageError(Exception):
+	def __init__(self,message):
+		Exception.__init__(self,message)
+		self.message = message
+
+# ***************************************************************************************
+#
+#		Memory image. The dictionary grows up from $C000 in the dictionary page, its
+#		hash table is at the top of that window, the bucket heads ending at $FFFF.
+#
+# ***************************************************************************************
 
 class MemoryImage(object):
+	FirstPage = 0x20 													# pages loaded by the boot
+	LastPage = 0x5F 													# loader (bootloader.asm)
+	SparseMagic = b"HLA\x01" 											# sparse image header
+	MinimumRun = 16 													# shortest run stored
+	HashBuckets = 128 													# dictionary hash table,
+	HashTable = 0x10000-HashBuckets*2 									# at the top of the
+	HashHeader = HashTable-4 											# dictionary page
+
 	def __init__(self,fileName = "boot.img"):
 		self.fileName = fileName
-		h = open(fileName,"rb")
-		self.image = [x for x in h.read(-1)]
-		h.close()
+		self.loadImage(fileName)
 		self.sysInfo = self.read(0,0x8004)+self.read(0,0x8005)*256
 		self.currentPage = 	self.read(0,self.sysInfo+2)
 		self.currentAddress = self.read(0,self.sysInfo+0)+self.read(0,self.sysInfo+1)*256
-		self.echo = True
+		self.listing = Listing()
+		self.indexDictionary()
+	#
+	#		Load the image into a buffer sized once for the whole page range. The buffer
+	#		never grows, size tracks how much of it is actually in use.
+	#
+	def loadImage(self,fileName):
+		h = open(fileName,"rb")
+		data = h.read(-1)
+		h.close()
+		if data[:4] == MemoryImage.SparseMagic:
+			data = MemoryImage.expandSparse(data)
+		capacity = self.address(MemoryImage.LastPage,0xFFFF)+1
+		self.image = bytearray(max(capacity,len(data)))
+		self.image[:len(data)] = data
+		self.view = memoryview(self.image)
+		self.size = len(data)
+	#
+	#		Independent copy of the image as it is now, without reading the file again,
+	#		so one loaded image can be the start of many builds.
+	#
+	def copy(self):
+		image = copy.copy(self)
+		image.dictionaryIndex = dict(self.dictionaryIndex)
+		image.listing = Listing()
+		self.copyData(image)
+		return image
+	#
+	def copyData(self,image):
+		image.image = bytearray(self.image)
+		image.view = memoryview(image.image)
+	#
+	#		Return number of bytes in use (e.g. the size of the saved file)
+	#
+	def getSize(self):
+		return self.size
 	#
 	#		Return sys.info address
 	#
@@ -48,85 +106,220 @@ class MemoryImage(object):
 		if address < 0xC000:
 			return address & 0x3FFF
 		else:
+			assert page >= MemoryImage.FirstPage and page <= MemoryImage.LastPage
 			return (page - 0x20) * 0x2000 + 0x4000 + (address & 0x3FFF)
 	#
 	#		Read byte from image
 	#
 	def read(self,page,address):
-		self.expandImage(page,address)
 		return self.image[self.address(page,address)]
 	#
 	#		Write byte to image
 	#
 	def write(self,page,address,data,dataType = 2):
-		self.expandImage(page,address)
 		assert data >= 0 and data < 256
-		self.image[self.address(page,address)] = data
+		a = self.address(page,address)
+		self.image[a] = data
+		if a >= self.size:
+			self.size = a + 1
+	#
+	#		Fast versions of read/write, with only the page checked. A page past the
+	#		last one is caught by the bytearray itself, but one below $20 would give a
+	#		negative index, which Python would take from the end of the image.
+	#
+	def fastRead(self,page,address):
+		if address < 0xC000:
+			return self.image[address & 0x3FFF]
+		assert page >= 0x20,"Bad page"
+		return self.image[((page - 0x20) << 13) + 0x4000 + (address & 0x3FFF)]
+	#
+	def fastWrite(self,page,address,data):
+		assert page >= 0x20 or address < 0xC000,"Bad page"
+		a = (address & 0x3FFF) if address < 0xC000 else ((page - 0x20) << 13) + 0x4000 + (address & 0x3FFF)
+		self.image[a] = data
+		if a >= self.size:
+			self.size = a + 1
+	#
+	#		Bulk read/write of a block, which must not cross the end of the 16k window
+	#
+	def readBlock(self,page,address,count):
+		a = self.address(page,address)
+		assert (address & 0x3FFF) + count <= 0x4000,"Block crosses window"
+		return bytes(self.view[a:a+count])
+	#
+	def writeBlock(self,page,address,data):
+		a = self.address(page,address)
+		assert (address & 0x3FFF) + len(data) <= 0x4000,"Block crosses window"
+		self.view[a:a+len(data)] = data
+		if a + len(data) > self.size:
+			self.size = a + len(data)
+	#
+	#		Set the listing sink
+	#
+	def setListing(self,listing):
+		self.listing = listing
 	#
 	#		Write byte/word
 	#
 	def cByte(self,data):
-		self.write(self.currentPage,self.currentAddress,data)
-		if self.echo:
-			print("{0:02x}:{1:04x}   {2:02x}".format(self.currentPage,self.currentAddress,data))
+		self.fastWrite(self.currentPage,self.currentAddress,data)
+		if self.listing.level >= Listing.Code:
+			self.listing.byte(self.currentPage,self.currentAddress,data)
 		self.currentAddress += 1
 	#
 	def cWord(self,data):
-		self.write(self.currentPage,self.currentAddress,data & 0xFF)
-		self.write(self.currentPage,self.currentAddress+1,data >> 8)
-		if self.echo:
-			print("{0:02x}:{1:04x}   {2:04x}".format(self.currentPage,self.currentAddress,data))
+		self.fastWrite(self.currentPage,self.currentAddress,data & 0xFF)
+		self.fastWrite(self.currentPage,self.currentAddress+1,data >> 8)
+		if self.listing.level >= Listing.Code:
+			self.listing.byte(self.currentPage,self.currentAddress,data & 0xFF)
+			self.listing.byte(self.currentPage,self.currentAddress+1,data >> 8)
 		self.currentAddress += 2
 	#
-	#		Expand physical size of image to include given address
+	#		Build the dictionary index, walking the linked list once. The index maps 
+	#		name -> (page,address,offset) and also holds the end of dictionary pointer.
+	#		Both layouts, with and without the hash table, are read. Nothing is changed.
+	#
+	def indexDictionary(self):
+		self.dictionaryIndex = {}
+		dp = self.dictionaryPage()
+		hashed = self.readBlock(dp,MemoryImage.HashHeader+2,2) == bytes([MemoryImage.HashBuckets,1])
+		entries = []
+		p = 0xC000
+		header = self.readBlock(dp,p,5)
+		while header[0] != 0:
+			name = self.readBlock(dp,p+5,header[4] & 0x3F).decode("latin-1")
+			self.dictionaryIndex[name] = (header[1],header[2]+256*header[3],p)
+			entries.append((name,header[1],header[2]+256*header[3],header[4] & 0xC0))
+			hashed = hashed and header[0] == (header[4] & 0x3F)+8
+			p = p + header[0]
+			header = self.readBlock(dp,p,5)
+		self.dictionaryEnd = p
+		self.hashed = hashed
+		self.entries = entries 												# in order, for rewriting
+	#
+	#		Rewrite a dictionary without the hash table (as the kernel builds it), in
+	#		the same order, with one. This is done by the code generator, so loading
+	#		an image to look at it does not change it. The space is checked first, so
+	#		a dictionary too large for the table is left as it was.
+	#
+	def hashDictionary(self):
+		if self.hashed:
+			return
+		dp = self.dictionaryPage()
+		entries = self.entries
+		if 0xC000 + sum([len(e[0])+8 for e in entries]) + 1 > MemoryImage.HashHeader:
+			raise ImageError("Dictionary too large for the hash table")
+		self.hashed = True
+		self.writeBlock(dp,MemoryImage.HashTable,bytes(MemoryImage.HashBuckets*2))
+		self.writeBlock(dp,MemoryImage.HashHeader,bytes([0,0,MemoryImage.HashBuckets,1]))
+		self.dictionaryIndex = {}
+		self.dictionaryEnd = 0xC000
+		for name,page,address,flags in entries:
+			self.addDictionary(name,page,address,flags)
+	#
+	#		Hash of a name, hash * 33 + character, 8 bit. On the Z80 this is five
+	#		add a,a then add a,b and add a,(hl).
+	#
+	@staticmethod
+	def hashName(name):
+		hash = 0
+		for c in name.encode("latin-1"):
+			hash = (hash * 33 + c) & 0xFF
+		return hash
 	#
-	def expandImage(self,page,address):
-		required = self.address(page,address)
-		while len(self.image) <= required:
-			self.image.append(0x00)
+	#		Add a physical entry to the image dictionary. Entries are
 	#
-	#		Add a physical entry to the image dictionary
+	#			length,page,address,name length,name,hash,next
 	#
-	def addDictionary(self,name,page,address):
+	#		next being the entry before in the same bucket, or 0. The bucket heads are
+	#		at HashTable, in the dictionary page, and the entry count and number of
+	#		buckets at HashHeader.
+	#
+	def addDictionary(self,name,page,address,flags = 0):
+		self.hashDictionary()
 		p = self.findEndDictionary()
-		#print("{0:04x} {1:20} {2:02x}:{3:04x}".format(p,name,page,address))
 		name = name.strip().lower()
 		assert len(name) < 64 and name != "","Bad name '"+name+"'"
+		if p + len(name) + 9 > MemoryImage.HashHeader:
+			raise ImageError("Dictionary full")
 		dp = self.dictionaryPage()
+		hash = MemoryImage.hashName(name)
+		bucket = MemoryImage.HashTable + (hash % MemoryImage.HashBuckets) * 2
 		self.lastDictionaryEntry = p
-		self.write(dp,p+0,len(name)+5)
-		self.write(dp,p+1,page)
-		self.write(dp,p+2,address & 0xFF)
-		self.write(dp,p+3,address >> 8)
-		self.write(dp,p+4,len(name) & 0x3F)
-		aname = [ord(x) for x in name]
-		for i in range(0,len(aname)):
-			self.write(dp,p+5+i,aname[i])
-		p = p + len(name) + 5
-		self.write(dp,p,0)
+		entry = bytearray([len(name)+8,page,address & 0xFF,address >> 8,(len(name) & 0x3F) | flags])
+		entry += name.encode("latin-1")
+		entry += bytes([hash]) + self.readBlock(dp,bucket,2)				# hash, chain
+		entry.append(0)														# end marker
+		self.writeBlock(dp,p,entry)
+		self.writeBlock(dp,bucket,bytes([p & 0xFF,p >> 8]))
+		count = self.readBlock(dp,MemoryImage.HashHeader,2)
+		count = count[0] + count[1] * 256 + 1
+		self.writeBlock(dp,MemoryImage.HashHeader,bytes([count & 0xFF,count >> 8]))
+		self.dictionaryIndex[name] = (page,address,p)
+		self.dictionaryEnd = p + len(name) + 8
 	#
 	#		Find the end of the dictionary
 	#
 	def findEndDictionary(self):
-		p = 0xC000
-		while self.read(self.dictionaryPage(),p) != 0:
-			p = p + self.read(self.dictionaryPage(),p)
-		return p
+		return self.dictionaryEnd
+	#
+	#		Look up a name, returns (page,address,offset) or None
+	#
+	def lookup(self,name):
+		return self.dictionaryIndex.get(name.strip().lower())
+	#
+	def contains(self,name):
+		return name.strip().lower() in self.dictionaryIndex
+	#
+	#		Look up a name through the hash table in the image, as code on the Next
+	#		would. Returns (page,address,offset) or None, always None if there is no
+	#		hash table.
+	#
+	def hashLookup(self,name):
+		if not self.hashed:
+			return None
+		name = name.strip().lower()
+		hash = MemoryImage.hashName(name)
+		dp = self.dictionaryPage()
+		for p in self.hashChain(hash % MemoryImage.HashBuckets):
+			header = self.readBlock(dp,p,5)
+			if self.read(dp,p+header[0]-3) == hash and \
+					self.readBlock(dp,p+5,header[4] & 0x3F).decode("latin-1") == name:
+				return (header[1],header[2]+256*header[3],p)
+		return None
+	#
+	#		Entries in a bucket, newest first.
+	#
+	def hashChain(self,bucket):
+		dp = self.dictionaryPage()
+		head = self.readBlock(dp,MemoryImage.HashTable+bucket*2,2)
+		p = head[0] + head[1] * 256
+		while p != 0:
+			yield p
+			size = self.read(dp,p)
+			p = self.read(dp,p+size-2) + self.read(dp,p+size-1) * 256
 	#
-	#		Extract the dictionary
+	#		Bucket use, and the load factor (entries per bucket).
+	#
+	def hashReport(self):
+		if not self.hashed:
+			return "no hash table"
+		chains = [len(list(self.hashChain(b))) for b in range(0,MemoryImage.HashBuckets)]
+		used = len([c for c in chains if c > 0])
+		return "{0} entries, {1} buckets, {2} used, load factor {3:.2f}, longest chain {4}".format(sum(chains),
+							MemoryImage.HashBuckets,used,sum(chains)/MemoryImage.HashBuckets,max(chains))
+	#
+	#		Extract the dictionary. Entries have their stored hash and bucket if there
+	#		is a hash table, otherwise these are None.
 	#
 	def getDictionary(self):
 		dictionary = {}
-		dp = self.dictionaryPage()
-		p = 0xC000
-		while self.read(dp,p) != 0:
-			name = ""
-			for i in range(0,self.read(dp,p+4) & 0x3F):
-				name += chr(self.read(dp,p+5+i))				
-			entry = { "name":name,"page":self.read(dp,p+1),	\
-							"address":self.read(dp,p+2)+256*self.read(dp,p+3)}
-			dictionary[name] = entry
-			p = p + self.read(dp,p)
+		for name,(page,address,offset) in self.dictionaryIndex.items():
+			hash = None
+			if self.hashed:
+				hash = self.read(self.dictionaryPage(),offset+self.read(self.dictionaryPage(),offset)-3)
+			dictionary[name] = { "name":name,"page":page,"address":address,"hash":hash,
+									"bucket":None if hash is None else hash % MemoryImage.HashBuckets }
 		return dictionary		
 	#
 	#		Set boot
@@ -140,19 +333,252 @@ class MemoryImage(object):
 	#		Write the image file out.
 	#
 	def save(self,fileName = None):
+		self.writeSysInfo()
+		self.writeImage(self.fileName if fileName is None else fileName)
+	#
+	def writeSysInfo(self):
 		self.write(0,self.sysInfo+0,self.currentAddress & 0xFF)
 		self.write(0,self.sysInfo+1,self.currentAddress >> 8)
 		self.write(0,self.sysInfo+2,self.currentPage)
 		self.write(0,self.sysInfo+3,0)
-
-		fileName = self.fileName if fileName is None else fileName
+	#
+	def writeImage(self,fileName):
+		h = open(fileName,"wb")
+		h.write(self.view[:self.size])
+		h.close()
+	#
+	#		Write a sparse image, which the boot loader loads only the banks of. It is
+	#		the header then records of
+	#
+	#			page (even, 0 for $8000-$BFFF), address, type, length
+	#
+	#		type 1 is followed by the data, type 2 by a byte repeated for the length, 
+	#		and type 0 is the end. $8000-$BFFF is always there, banks which are all 
+	#		zero are left out. Returns the size of the file.
+	#
+	def saveSparse(self,fileName):
+		self.writeSysInfo()
+		data = bytearray(MemoryImage.SparseMagic)
+		blocks = [(0,0x8000),(0,0xA000)]
+		for page in range(MemoryImage.FirstPage,MemoryImage.LastPage+1):
+			if self.address(page & 0xFE,0xC000+(page & 1)*0x2000) < self.size:
+				blocks.append((page & 0xFE,0xC000+(page & 1)*0x2000))
+		for page,address in blocks:
+			block = self.readBlock(page,address,0x2000)
+			if page == 0 or block.count(0) != len(block):
+				data += self.encodeSparse(page,address,block)
+		data += struct.pack("<BHBH",0,0,0,0)
 		h = open(fileName,"wb")
-		h.write(bytes(self.image))		
+		h.write(data)
 		h.close()
+		return len(data)
+	#
+	#		Records for an 8k block, runs of a byte are stored once.
+	#
+	def encodeSparse(self,page,address,block):
+		data = bytearray()
+		start = 0
+		for run in re.finditer(b"(.)\\1{"+str(MemoryImage.MinimumRun-1).encode()+b",}",block,re.DOTALL):
+			if run.start() > start:
+				data += struct.pack("<BHBH",page,address+start,1,run.start()-start)+block[start:run.start()]
+			data += struct.pack("<BHBH",page,address+run.start(),2,run.end()-run.start())+block[run.start():run.start()+1]
+			start = run.end()
+		if start < len(block):
+			data += struct.pack("<BHBH",page,address+start,1,len(block)-start)+block[start:]
+		return data
+	#
+	#		Convert a sparse image back to a flat one.
+	#
+	@staticmethod
+	def expandSparse(data):
+		image = bytearray()
+		p = len(MemoryImage.SparseMagic)
+		while True:
+			page,address,kind,length = struct.unpack_from("<BHBH",data,p)
+			p += 6
+			if kind == 0:
+				return image
+			a = (address & 0x3FFF) if address < 0xC000 else (page-0x20)*0x2000+0x4000+(address & 0x3FFF)
+			if len(image) < a+length:
+				image += bytes(a+length-len(image))
+			if kind == 1:
+				image[a:a+length] = data[p:p+length]
+				p += length
+			else:
+				image[a:a+length] = data[p:p+1]*length
+				p += 1
+
+# ***************************************************************************************
+#
+#		Memory mapped image. The file is mmap'ed and 8k/16k banks are copied in only
+#		when first accessed. Saving writes back just the dirty banks, or if the image
+#		has grown (or goes to another file) writes a temporary file and renames it.
+#
+# ***************************************************************************************
+
+class MappedMemoryImage(MemoryImage):
+	def __init__(self,fileName = "boot.img",bankSize = 0x4000):
+		assert bankSize == 0x2000 or bankSize == 0x4000,"Banks are 8k or 16k"
+		self.bankSize = bankSize
+		self.bankShift = 13 if bankSize == 0x2000 else 14
+		self.banks = {}
+		self.dirty = set()
+		MemoryImage.__init__(self,fileName)
+	#
+	#		Map the file read only, nothing is actually read yet.
+	#
+	def loadImage(self,fileName):
+		self.handle = open(fileName,"rb")
+		self.fileSize = os.fstat(self.handle.fileno()).st_size
+		self.map = None
+		if self.fileSize > 0:
+			self.map = mmap.mmap(self.handle.fileno(),0,access = mmap.ACCESS_READ)
+			assert self.map[:4] != MemoryImage.SparseMagic,"Sparse images can't be mapped"
+		self.size = self.fileSize
+	#
+	#		Get a bank, copying it from the file the first time it is used.
+	#
+	def getBank(self,bank):
+		if bank not in self.banks:
+			assert bank <= self.address(MemoryImage.LastPage,0xFFFF) >> self.bankShift
+			data = bytearray(self.bankSize)
+			start = bank << self.bankShift
+			if start < self.fileSize:
+				end = min(start+self.bankSize,self.fileSize)
+				data[:end-start] = self.map[start:end]
+			self.banks[bank] = data
+		return self.banks[bank]
+	#
+	#		The copy has its own banks and no mapping, so every bank of the file is read
+	#		into it first. Saving either one can't change what the other one reads.
+	#
+	def copyData(self,image):
+		for bank in range(0,(self.fileSize+self.bankSize-1) >> self.bankShift):
+			self.getBank(bank)
+		image.banks = { bank:bytearray(data) for bank,data in self.banks.items() }
+		image.dirty = set(self.dirty)
+		image.handle = image.map = None
+		image.fileSize = 0
+	#
+	#		Byte access, all through the bank table.
+	#
+	def read(self,page,address):
+		a = self.address(page,address)
+		return self.getBank(a >> self.bankShift)[a & (self.bankSize-1)]
+	#
+	def write(self,page,address,data,dataType = 2):
+		assert data >= 0 and data < 256
+		a = self.address(page,address)
+		self.getBank(a >> self.bankShift)[a & (self.bankSize-1)] = data
+		self.dirty.add(a >> self.bankShift)
+		if a >= self.size:
+			self.size = a + 1
+	#
+	def fastRead(self,page,address):
+		assert page >= 0x20 or address < 0xC000,"Bad page"
+		a = (address & 0x3FFF) if address < 0xC000 else ((page - 0x20) << 13) + 0x4000 + (address & 0x3FFF)
+		bank = self.banks.get(a >> self.bankShift)
+		if bank is None:
+			bank = self.getBank(a >> self.bankShift)
+		return bank[a & (self.bankSize-1)]
+	#
+	def fastWrite(self,page,address,data):
+		assert page >= 0x20 or address < 0xC000,"Bad page"
+		a = (address & 0x3FFF) if address < 0xC000 else ((page - 0x20) << 13) + 0x4000 + (address & 0x3FFF)
+		bank = self.banks.get(a >> self.bankShift)
+		if bank is None:
+			bank = self.getBank(a >> self.bankShift)
+		bank[a & (self.bankSize-1)] = data
+		self.dirty.add(a >> self.bankShift)
+		if a >= self.size:
+			self.size = a + 1
+	#
+	#		Block access, a 16k window can span two 8k banks.
+	#
+	def readBlock(self,page,address,count):
+		a = self.address(page,address)
+		assert (address & 0x3FFF) + count <= 0x4000,"Block crosses window"
+		data = bytearray()
+		while count > 0:
+			offset = a & (self.bankSize-1)
+			n = min(count,self.bankSize-offset)
+			data += self.getBank(a >> self.bankShift)[offset:offset+n]
+			a += n
+			count -= n
+		return bytes(data)
+	#
+	def writeBlock(self,page,address,data):
+		a = self.address(page,address)
+		assert (address & 0x3FFF) + len(data) <= 0x4000,"Block crosses window"
+		data = memoryview(bytes(data))
+		while len(data) > 0:
+			offset = a & (self.bankSize-1)
+			n = min(len(data),self.bankSize-offset)
+			self.getBank(a >> self.bankShift)[offset:offset+n] = data[:n]
+			self.dirty.add(a >> self.bankShift)
+			a += n
+			data = data[n:]
+		if a > self.size:
+			self.size = a
+	#
+	#		Write out. If it still fits in the mapped file, write the dirty banks into 
+	#		the file, which is only opened for writing here, otherwise rewrite via a
+	#		temporary file.
+	#
+	def writeImage(self,fileName):
+		if os.path.abspath(fileName) == os.path.abspath(self.fileName) and self.size <= self.fileSize:
+			h = open(fileName,"r+b")
+			for bank in sorted(self.dirty):
+				start = bank << self.bankShift
+				end = min(start+self.bankSize,self.fileSize)
+				h.seek(start)
+				h.write(self.banks[bank][:end-start])
+			h.close()
+			self.dirty = set()
+			return
+		h = tempfile.NamedTemporaryFile(dir = os.path.dirname(os.path.abspath(fileName)),delete = False)
+		for start in range(0,self.size,self.bankSize):
+			end = min(start+self.bankSize,self.size)
+			if start >> self.bankShift in self.banks:
+				h.write(self.banks[start >> self.bankShift][:end-start])
+			else:
+				if start < self.fileSize:
+					h.write(self.map[start:min(end,self.fileSize)])
+				h.write(bytes(max(0,end-max(start,self.fileSize))))
+		h.close()
+		if os.path.exists(fileName):
+			os.chmod(h.name,os.stat(fileName).st_mode)
+		if os.path.abspath(fileName) == os.path.abspath(self.fileName):
+			self.close()
+			os.replace(h.name,fileName)
+			self.loadImage(fileName)
+			self.dirty = set()
+		else:
+			os.replace(h.name,fileName)
+	#
+	#		Release the mapping, also done on leaving a with block or on deletion.
+	#
+	def close(self):
+		if self.map is not None:
+			self.map.close()
+			self.map = None
+		if self.handle is not None:
+			self.handle.close()
+			self.handle = None
+	#
+	def __enter__(self):
+		return self
+	#
+	def __exit__(self,excType,excValue,traceback):
+		self.close()
+	#
+	def __del__(self):
+		if getattr(self,"handle",None) is not None:
+			self.close()
 
 if __name__ == "__main__":
 	z = MemoryImage()
-	print(len(z.image))
+	print(z.getSize())
 	print(z.address(z.dictionaryPage(),0xC000))
 	print(z.getDictionary())
 	#	z.save()
@@ -0,0 +1,123 @@
+# ***************************************************************************************
+# ***************************************************************************************
+#
+#		Name : 		ir.py
+#		Author :	Paul Robson (paul@robsons.org.uk)
+#		Date : 		19th January 2019
+#		Purpose :	Intermediate representation of a procedure, and its lowering
+#
+# ***************************************************************************************
+# ***************************************************************************************
+
+from listing import *
+
+# ***************************************************************************************
+#
+#		A procedure is a list of operations, each a tuple of opcode and operands.
+#
+#			("source",line,text)					source command, for the listing
+#			("param",reg,address) 					store parameter register in variable
+#			("load",isConstant,value) 				load accumulator
+#			("binary",op,isConstant,value) 			binary operation on accumulator
+#			("label",label) 						branch target
+#			("branch",test,label)					branch if z/nz/p, or always if ""
+#			("loadparam",reg,isConstant,value) 		load parameter register
+#			("call",address) 						call procedure
+#			("return",) 							return from procedure
+#
+# ***************************************************************************************
+
+class IRProcedure(object):
+	def __init__(self,name):
+		self.name = name
+		self.ops = []
+		self.labelCount = 0
+	#
+	#		Append an operation
+	#
+	def add(self,*op):
+		self.ops.append(op)
+	#
+	#		Allocate a new label
+	#
+	def newLabel(self):
+		self.labelCount += 1
+		return self.labelCount
+	#
+	#		Calls made, target -> weight. Each call counts 1, multiplied by 8 for
+	#		each loop it is in (a loop is a label and a later branch back to it)
+	#
+	def callWeights(self):
+		labels = {}
+		loops = []
+		for i in range(0,len(self.ops)):
+			if self.ops[i][0] == "label":
+				labels[self.ops[i][1]] = i
+			elif self.ops[i][0] == "branch" and self.ops[i][2] in labels:
+				loops.append((labels[self.ops[i][2]],i))
+		weights = {}
+		for i in range(0,len(self.ops)):
+			if self.ops[i][0] == "call":
+				depth = len([l for l in loops if l[0] < i and i < l[1]])
+				weights[self.ops[i][1]] = weights.get(self.ops[i][1],0) + 8 ** depth
+		return weights
+	#
+	def __str__(self):
+		return "\n".join([self.name]+["\t"+" ".join([str(x) for x in op]) for op in self.ops])
+
+# ***************************************************************************************
+#
+#		Lowering of a procedure's IR onto a code generator's methods. Code generators
+#		inherit this ; forward branches are emitted incomplete and patched via the
+#		override address of jumpInstruction(), when the label is reached.
+#
+# ***************************************************************************************
+
+class IRLowering(object):
+	def lower(self,procedure):
+		self.labels = {} 													# label -> address
+		self.pendingBranches = {} 											# label -> [(test,addr)]
+		for op in procedure.ops:
+			code = op[0]
+			if code == "source":
+				self.lowerSource(op[1],op[2])
+			elif code == "param":
+				self.storeParamRegister(op[1],op[2])
+			elif code == "load":
+				self.loadDirect(op[1],op[2])
+			elif code == "binary":
+				self.binaryOperation(op[1],op[2],op[3])
+			elif code == "label":
+				self.lowerLabel(op[1])
+			elif code == "branch":
+				self.lowerBranch(op[1],op[2])
+			elif code == "loadparam":
+				self.loadParamRegister(op[1],op[2],op[3])
+			elif code == "call":
+				self.callSubroutine(op[1])
+			elif code == "return":
+				self.returnSubroutine()
+			else:
+				raise ValueError("Unknown IR operation "+code)
+		assert len(self.pendingBranches) == 0,"Unresolved label"
+	#
+	#		Source line, for the listing
+	#
+	def lowerSource(self,line,text):
+		self.getListing().source(line,text)
+	#
+	#		Label reached, patch forward jumps to it.
+	#
+	def lowerLabel(self,label):
+		self.labels[label] = self.getAddress()
+		for test,address in self.pendingBranches.pop(label,[]):
+			self.jumpInstruction(test,self.labels[label],address)
+	#
+	#		Branch to label, backward branches are known, forward ones are patched.
+	#
+	def lowerBranch(self,test,label):
+		if label in self.labels:
+			self.jumpInstruction(test,self.labels[label])
+		else:
+			self.pendingBranches.setdefault(label,[]).append((test,self.getAddress()))
+			self.jumpInstruction(test,self.getAddress())
@@ -0,0 +1,115 @@
+# ***************************************************************************************
+# ***************************************************************************************
+#
+#		Name : 		lexer.py
+#		Author :	Paul Robson (paul@robsons.org.uk)
+#		Date : 		18th January 2019
+#		Purpose :	Tokeniser for the high level assembler
+#
+# ***************************************************************************************
+# ***************************************************************************************
+
+import re
+
+# ***************************************************************************************
+#										Token
+# ***************************************************************************************
+
+class Token(object):
+	Identifier = "identifier" 											# local identifier
+	Global = "global" 													# $identifier
+	Number = "number" 													# constant
+	Address = "address" 												# @identifier or @nnnn
+	Variable = "variable" 												# resolved variable address
+	Operator = "operator" 												# + - * / % & | ^ > ! ? # = <
+	Punctuation = "punctuation" 										# ( ) ,
+	Keyword = "keyword" 												# if endif ...
+	String = "string" 													# "text"
+	Separator = "separator" 											# : or end of line
+
+	__slots__ = ("kind","value","line")
+
+	def __init__(self,kind,value,line):
+		self.kind = kind
+		self.value = value
+		self.line = line
+	#
+	#		Convert back to source form, variables appear as @<address>
+	#
+	def text(self):
+		if self.kind == Token.String:
+			return '"'+self.value+'"'
+		if self.kind == Token.Variable:
+			return "@"+str(self.value)
+		if self.kind == Token.Address:
+			return "@"+str(self.value)
+		return str(self.value)
+	#
+	def __repr__(self):
+		return "{0}:{1}:{2}".format(self.line,self.kind,self.text())
+
+# ***************************************************************************************
+#		Lexer. Converts the source in one pass to a stream of tokens. Case is not
+#		significant, except in strings.
+# ***************************************************************************************
+
+class Lexer(object):
+	keywords = set("if,endif,defproc,endproc,while,endwhile,include".split(","))
+
+	rxToken = re.compile(r"""
+		(?P<space>\s+)|
+		(?P<comment>//.*)|
+		(?P<string>"[^"]*")|
+		(?P<address>@(?:\$?[a-z][a-z0-9_\.]*|\$[a-z0-9_\.]+|\d+))|
+		(?P<number>\d+)|
+		(?P<globalid>\$[a-z0-9_\.]+)|
+		(?P<identifier>[a-z][a-z0-9_\.]*)|
+		(?P<operator>[-+*/%&|^>!?\#=<])|
+		(?P<punctuation>[(),])|
+		(?P<separator>:)|
+		(?P<error>.)
+	""",re.VERBOSE|re.IGNORECASE)
+	#
+	#		Tokenise an iterable of lines (list, file ...), first line is lineBase+1
+	#
+	def tokenise(self,source,lineBase = 0):
+		lineNumber = lineBase
+		for line in source:
+			lineNumber += 1
+			for m in Lexer.rxToken.finditer(line):
+				kind = m.lastgroup
+				if kind == "space" or kind == "comment":
+					continue
+				text = m.group(kind)
+				if kind == "identifier":
+					text = text.lower()
+					yield Token(Token.Keyword if text in Lexer.keywords else Token.Identifier,text,lineNumber)
+				elif kind == "number":
+					yield Token(Token.Number,int(text),lineNumber)
+				elif kind == "operator" or kind == "punctuation" or kind == "separator":
+					yield Token(kind,text,lineNumber)
+				elif kind == "globalid":
+					yield Token(Token.Global,text.lower(),lineNumber)
+				elif kind == "address":
+					text = text[1:].lower()
+					yield Token(Token.Address,int(text) if text.isdigit() else text,lineNumber)
+				elif kind == "string":
+					yield Token(Token.String,text[1:-1],lineNumber)
+				else:
+					raise LexerError("Imbalanced quotes" if text == '"' else "Can't recognise "+text,lineNumber)
+			yield Token(Token.Separator,"",lineNumber) 					# end of line separates
+	#
+	#		Tokenise a single string
+	#
+	def tokeniseText(self,text):
+		return list(self.tokenise(text.split("\n")))
+
+class LexerError(Exception):
+	def __init__(self,message,line):
+		Exception.__init__(self,message)
+		self.message = message
+		self.line = line
+
+if __name__ == "__main__":
+	for t in Lexer().tokeniseText('defproc demo(p1,p2)\n p1!0+P2>$g3:"Hello"+1>@a:"demo">b // c\n@12+@$x'):
+		print(t)
@@ -0,0 +1,400 @@
+# ***************************************************************************************
+# ***************************************************************************************
+#
+#		Name : 		linker.py
+#		Author :	Paul Robson (paul@robsons.org.uk)
+#		Date : 		22nd January 2019
+#		Purpose :	Link object modules into the memory image
+#
+# ***************************************************************************************
+# ***************************************************************************************
+
+from imagelib import *
+from objectcode import *
+
+# ***************************************************************************************
+#									Exception for Linker
+# ***************************************************************************************
+
+class LinkerError(Exception):
+	def __init__(self,message,module = None):
+		Exception.__init__(self,message)
+		self.message = message
+		self.module = module
+
+# ***************************************************************************************
+#
+#		The linker places modules in the common code area ($8000-$BFFF) from the
+#		image's code address, and when that is full in the paged area ($C000-$FFFF)
+#		of the code pages. It allocates their variables downwards from varTop, then
+#		fills in the fixups and writes each module out as a single block. Local
+#		variables are overlaid where they cannot be in use at the same time. Symbols
+#		are kept between calls to link(), so modules can call procedures linked
+#		earlier.
+#
+#		Calls to a procedure in another page go through a trampoline in the common
+#		area, which switches pages. These are created by the pager (the code
+#		generator), without one everything must be in the common area.
+#
+# ***************************************************************************************
+
+class Linker(object):
+	PageSize = 0x4000
+
+	def __init__(self,image,varTop = 0x8000,pager = None):
+		self.image = image
+		self.varTop = self.varAlloc = varTop
+		self.pager = pager
+		self.symbols = {} 													# global name -> address
+		self.regions = {} 													# procedure -> page or None
+		self.pageFree = {} 													# page -> next free address
+		self.crossPageCalls = 0 											# calls via trampolines
+		self.sameCalls = 0 													# calls that are not
+		self.recursive = [] 												# recursive procedures
+		self.strings = {} 													# text -> address
+		self.parameters = {} 												# procedure -> addresses
+	#
+	#		Link a list of modules. Returns the global symbols they defined, procedures
+	#		as (page << 16) + address, variables as address.
+	#
+	def link(self,modules):
+		defined = {}
+		page = self.image.getCodePage()
+		address = self.image.getCodeAddress()
+		pool = self.poolStrings(modules)									# (text,offset) in pool
+		poolSize = sum([len(text)+1 for text,offset in pool if offset is None])
+		regions = self.plan(modules,0xC000-address-poolSize)
+		for i in range(0,len(modules)):										# place modules
+			module = modules[i]
+			if regions[i] is None:
+				module.page,module.base = page,address
+				address += module.size()
+			else:
+				module.page = regions[i]
+				module.base = self.pageFree.get(module.page,0xC000)
+				self.pageFree[module.page] = module.base + module.size()
+			defined.update(self.export(module,regions[i]))
+		extra = self.createTrampolines(modules)								# trampolines, in common
+		for module in extra:
+			if address + module.size() + poolSize > 0xC000:
+				raise LinkerError("Out of common code space",module)
+			module.page,module.base = page,address
+			address += module.size()
+			self.export(module,None)
+		modules = modules + extra
+		if poolSize > 0:
+			self.writePool(pool,page,address)
+			address += poolSize
+		arity = { m.name:len(m.parameters) for m in modules }				# extra parameters are
+		for module in modules:												# stored in ~discard
+			for offset,symbol in module.fixups:
+				if "(@" in symbol.name and not symbol.name.startswith('"'):
+					procedure,number = symbol.name.rsplit("@",1)
+					if int(number) >= arity.get(procedure,len(self.parameters.get(procedure,[]))):
+						module.addVariable("~discard")
+		for module in modules:												# allocate globals
+			module.allocated = []											# (name,address) new here
+			for name in module.variables:
+				if not name.startswith(":") and name not in self.symbols:
+					self.symbols[name] = self.allocate(name)
+					if not name.startswith("~"):							# ~discard is not global
+						defined[name] = self.symbols[name]
+					module.allocated.append((name,self.varAlloc))
+		self.allocateFrames(modules)										# then locals
+		for module in modules:												# resolve and write
+			data = bytearray(module.data)
+			for offset,symbol in module.fixups:
+				value = self.resolve(module,symbol)
+				data[offset] = value & 0xFF
+				data[offset+1] = value >> 8
+			if len(data) > 0:
+				self.image.writeBlock(module.page,module.base,data)
+			if self.image.listing.level >= Listing.Source:
+				self.list(module,data)
+		self.image.setCodeAddress(address)
+		return defined
+	#
+	#		Add a placed module's symbols to the global symbols, returns the procedures.
+	#
+	def export(self,module,region):
+		defined = {}
+		for name,offset in module.symbols.items():
+			if not name.startswith(":"):
+				if name in self.symbols:
+					raise LinkerError("Duplicate symbol "+name,module)
+				self.symbols[name] = module.base + offset
+				if name == module.name:
+					self.regions[name] = region
+					if not name.startswith("~"):
+						defined[name] = (module.page << 16) + self.symbols[name]
+		return defined
+	#
+	#		String pool. Strings are referenced by "text symbols. Each distinct string is
+	#		stored once, and a string which is the end of another uses its end. Sorting 
+	#		by the reversed text puts a string just before the strings it is the end of.
+	#		Returns (text,None) for strings to store, in order of use, followed by
+	#		(text,(host,offset)) for the ones which share, to store after.
+	#
+	def poolStrings(self,modules):
+		new = []
+		for module in modules:
+			for offset,symbol in module.fixups:
+				if symbol.name.startswith('"') and symbol.name[1:] not in self.strings:
+					new.append(symbol.name[1:])
+		new = sorted(set(new),key = new.index)
+		texts = sorted(list(self.strings)+new,key = lambda t:t[::-1])
+		host = {}
+		for i in range(len(texts)-1,-1,-1):
+			if i+1 < len(texts) and texts[i+1].endswith(texts[i]):
+				host[texts[i]] = host.get(texts[i+1],texts[i+1])
+		stored = [(text,None) for text in new if text not in host]
+		shared = [(text,(host[text],len(host[text])-len(text))) for text in new if text in host]
+		return stored+shared
+	#
+	#		Write the string pool as one block at address.
+	#
+	def writePool(self,pool,page,address):
+		data = bytearray()
+		listing = self.image.listing
+		for text,shared in pool:
+			if shared is None:
+				self.strings[text] = address+len(data)
+				listing.note(Listing.Source,"${0:04x} \"{1}\"",self.strings[text],text)
+				if listing.level >= Listing.Code:
+					listing.instruction(page,self.strings[text],"db \""+text+"\",0")
+				data += bytes([ord(c) for c in text]+[0])
+				if listing.level >= Listing.Code:
+					for i in range(self.strings[text]-address,len(data)):
+						listing.byte(page,address+i,data[i])
+			else:
+				self.strings[text] = self.strings[shared[0]]+shared[1]
+				listing.note(Listing.Source,"${0:04x} \"{1}\" end of \"{2}\"",self.strings[text],text,shared[0])
+		self.image.writeBlock(page,address,data)
+	#
+	#		Decide where modules go, returns a list of pages, None for the common area.
+	#
+	#		Procedures which call each other are grouped, heaviest calls first (calls
+	#		in loops count more), as long as the group fits in a page. Groups most
+	#		called from other groups, for their size, go in the common area as they can
+	#		be called from anywhere. The rest are packed into pages, largest first. Room
+	#		is kept in the common area for the trampolines this needs.
+	#
+	def plan(self,modules,commonFree):
+		index = { modules[i].name:i for i in range(0,len(modules)) }
+		calls = [] 															# (caller,callee,weight)
+		for i in range(0,len(modules)):
+			for callee,weight in sorted(modules[i].calls.items()):
+				if index.get(callee,i) != i:
+					calls.append((i,index[callee],weight))
+		cluster = list(range(0,len(modules)))								# module -> group
+		members = { i:[i] for i in cluster }								# group -> modules
+		size = { i:modules[i].size() for i in cluster }						# group -> size
+		pairs = {}
+		for i,j,weight in calls:
+			key = (min(i,j),max(i,j))
+			pairs[key] = pairs.get(key,0) + weight
+		for (i,j),weight in sorted(pairs.items(),key = lambda p:(-p[1],p[0])):
+			a,b = cluster[i],cluster[j]
+			if a != b and size[a] + size[b] <= Linker.PageSize:
+				for k in members[b]:
+					cluster[k] = a
+				members[a] += members.pop(b)
+				size[a] += size.pop(b)
+		inbound = { c:0 for c in members }									# calls from other groups
+		for i,j,weight in calls:
+			if cluster[i] != cluster[j]:
+				inbound[cluster[j]] += weight
+		order = sorted(members,key = lambda c:(-inbound[c]/max(1,size[c]),c))
+		reserve = 0
+		while True:
+			free = commonFree - reserve
+			groupPage = {}
+			for c in order:													# fill the common area
+				if size[c] <= free:
+					groupPage[c] = None
+					free -= size[c]
+			groupPage.update(self.pack([c for c in order if c not in groupPage],size))
+			regions = [groupPage[cluster[i]] for i in range(0,len(modules))]
+			need = self.trampolineSpace(modules,regions,index)
+			if need <= reserve:
+				return regions
+			if need > commonFree:
+				raise LinkerError("Out of common code space for trampolines, {0} bytes needed".format(need))
+			reserve = need
+	#
+	#		Pack groups into the code pages, first fit, largest first.
+	#
+	def pack(self,groups,size):
+		first = max(self.image.getCodePage(),self.image.dictionaryPage()+2)
+		pages = list(range(first,MemoryImage.LastPage+1,2))
+		free = { p:0x10000-self.pageFree.get(p,0xC000) for p in pages }
+		placed = {}
+		for c in sorted(groups,key = lambda c:(-size[c],c)):
+			for p in pages:
+				if size[c] <= free[p]:
+					placed[c] = p
+					free[p] -= size[c]
+					break
+			else:
+				raise LinkerError("Out of code space")
+		if len(placed) > 0 and self.pager is None:
+			raise LinkerError("Out of code space, and no paging")
+		return placed
+	#
+	#		Space needed in the common area for trampolines, given where modules go.
+	#
+	def trampolineSpace(self,modules,regions,index):
+		targets = set()
+		for i in range(0,len(modules)):
+			for callee in modules[i].calls:
+				region = regions[index[callee]] if callee in index else self.regions.get(callee)
+				if region is not None and region != regions[i] and "~"+callee not in self.symbols:
+					targets.add(callee)
+		if len(targets) == 0:
+			return 0
+		if not hasattr(self,"trampolineSize"):
+			self.trampolineSize = self.pager.createTrampoline("~(",0).size()
+			self.pagingSize = self.pager.createPaging().size()
+		return len(targets) * self.trampolineSize + (0 if "~setpage" in self.symbols else self.pagingSize)
+	#
+	#		True if a reference from module to name goes through a trampoline.
+	#
+	def isCrossPage(self,module,name):
+		if name == module.name or module.name.startswith("~"):				# trampolines call direct
+			return False
+		region = self.regions.get(name)
+		return region is not None and region != self.regions.get(module.name)
+	#
+	#		Create the trampolines needed by these modules, and the paging routine.
+	#
+	def createTrampolines(self,modules):
+		extra = []
+		for module in modules:
+			for offset,symbol in module.fixups:
+				if self.isCrossPage(module,symbol.name):
+					self.crossPageCalls += 1
+					name = "~"+symbol.name
+					if name not in self.symbols and name not in [m.name for m in extra]:
+						extra.append(self.pager.createTrampoline(symbol.name,self.regions[symbol.name]))
+				elif symbol.name in self.regions and symbol.name != module.name:
+					self.sameCalls += 1
+		if len(extra) > 0 and "~setpage" not in self.symbols:
+			extra.insert(0,self.pager.createPaging())
+		return extra
+	#
+	#		Name of the procedure at (page << 16) + address
+	#
+	def procedureAt(self,address):
+		for name,region in self.regions.items():
+			if self.symbols[name] == address & 0xFFFF and (region is None or region == address >> 16):
+				return name
+		raise LinkerError("No procedure at ${0:06x}".format(address))
+	#
+	#		Allocate local variables. A procedure's locals are its frame. The frames of
+	#		procedures that cannot be active at the same time share memory : each frame
+	#		goes after the frames of all the procedures calling it, so the space used is
+	#		set by the longest chain of calls, not the number of procedures. Procedures
+	#		linked earlier can't call these, so these frames go below theirs.
+	#
+	#		Recursive procedures are reported. Their locals are not saved on a call, as
+	#		before, and they are given frames of their own.
+	#
+	def allocateFrames(self,modules):
+		frame = { m.name:[v for v in m.variables if v.startswith(":")] for m in modules }
+		calls = { m.name:[c for c in m.calls if c in frame and c != m.name] for m in modules }
+		pending = { name:0 for name in frame }								# callers not yet done
+		for name in calls:
+			for callee in calls[name]:
+				pending[callee] += 1
+		ready = [m.name for m in modules if pending[m.name] == 0]
+		offset = {}
+		done = set()
+		while len(ready) > 0:												# callers before callees
+			name = ready.pop(0)
+			done.add(name)
+			end = offset.setdefault(name,0) + 2 * len(frame[name])
+			for callee in calls[name]:
+				offset[callee] = max(offset.get(callee,0),end)
+				pending[callee] -= 1
+				if pending[callee] == 0:
+					ready.append(callee)
+		top = max([0]+[offset[n] + 2 * len(frame[n]) for n in done])
+		for module in modules:
+			if module.name not in done or module.name in module.calls:		# recursion
+				self.recursive.append(module.name)
+				offset[module.name] = top
+				top += 2 * len(frame[module.name])
+		for module in modules:
+			module.locals = {}
+			for i in range(0,len(frame[module.name])):
+				name = frame[module.name][i]
+				module.locals[name] = self.varAlloc - offset[module.name] - 2 * (i+1)
+				module.allocated.append((name[1:],module.locals[name]))
+			self.parameters[module.name] = [module.locals.get(p,p) for p in module.parameters]
+		self.varAlloc -= top
+	#
+	#		Allocate a variable.
+	#
+	def allocate(self,name):
+		self.varAlloc -= 2
+		return self.varAlloc
+	#
+	#		Value of a symbol in a given module.
+	#
+	def resolve(self,module,symbol):
+		name = symbol.name
+		if name in module.symbols:											# in the module
+			value = module.base + module.symbols[name]
+		elif name in module.locals:											# local variable
+			value = module.locals[name]
+		elif self.isCrossPage(module,name):									# other page, trampoline
+			value = self.symbols["~"+name]
+		elif name.startswith('"'):											# pooled string
+			value = self.strings[name[1:]]
+		elif "(@" in name:													# parameter variable
+			procedure,number = name.rsplit("@",1)
+			slots = self.parameters.get(procedure,[])
+			value = slots[int(number)] if int(number) < len(slots) else self.symbols["~discard"]
+		elif name in self.symbols:											# procedure or global
+			value = self.symbols[name]
+		else:
+			entry = self.image.lookup(name)									# kernel routine
+			if entry is None:
+				raise LinkerError("Undefined symbol "+name,module)
+			if entry[1] >= 0xC000 and entry[0] != module.page:
+				raise LinkerError("Cannot reach "+name+" from page {0:02x}".format(module.page),module)
+			value = entry[1]
+		return (value + symbol.offset) & 0xFFFF
+	#
+	#		List a linked module : its variables, then source, strings and code.
+	#
+	def list(self,module,data):
+		listing = self.image.listing
+		for name,address in module.allocated:
+			listing.note(Listing.Source,"{0} := ${1:04x}",name,address)
+		if module.name in self.recursive:
+			listing.note(Listing.Source,"{0} is recursive, its variables are not saved",module.name[:-1])
+		for entry in module.lines:
+			if entry[0] == "source":
+				listing.source(entry[1],entry[2])
+			elif entry[0] == "note":
+				listing.note(Listing.Source,entry[1],module.base+entry[2])
+			elif listing.level >= Listing.Code:
+				kind,offset,size,format,operand = entry
+				if isinstance(operand,Symbol):
+					operand = self.resolve(module,operand)
+				listing.instruction(module.page,module.base+offset,format.format(operand))
+				for i in range(offset,offset+size):
+					listing.byte(module.page,module.base+i,data[i])
+	#
+	#		Report of the global symbols, and of the calls between pages.
+	#
+	def report(self):
+		report = ["{0:24} ${1:04x}".format(name,self.symbols[name]) for name in sorted(self.symbols)]
+		pages = sorted(set([r for r in self.regions.values() if r is not None]))
+		report.append("variables ${0:04x}-${1:04x}, recursive {2}".format(self.varAlloc,self.varTop-1,
+					",".join([name[:-1] for name in self.recursive]) if len(self.recursive) > 0 else "none"))
+		report.append("pages used {0}, {1} of {2} calls cross pages".format(
+					",".join(["${0:02x}".format(p) for p in pages]) if len(pages) > 0 else "none",
+					self.crossPageCalls,self.crossPageCalls+self.sameCalls))
+		return "\n".join(report)
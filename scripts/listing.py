@@ -0,0 +1,126 @@
+# ***************************************************************************************
+# ***************************************************************************************
+#
+#		Name : 		listing.py
+#		Author :	Paul Robson (paul@robsons.org.uk)
+#		Date : 		17th January 2019
+#		Purpose :	Listing sinks for the assembler and code generators
+#
+# ***************************************************************************************
+# ***************************************************************************************
+
+import sys
+
+# ***************************************************************************************
+#			Null listing. Also the base class, everything here does nothing.
+# ***************************************************************************************
+
+class Listing(object):
+	Off = 0 															# nothing
+	Source = 1 															# commands, variables, strings
+	Code = 2 															# and every instruction
+
+	def __init__(self):
+		self.level = Listing.Off
+	#
+	#		Source command about to be compiled.
+	#
+	def source(self,line,text):
+		pass
+	#
+	#		Information (variable allocation etc.), only formatted if it is listed.
+	#
+	def note(self,level,text,*args):
+		pass
+	#
+	#		Start a new instruction at page:address
+	#
+	def instruction(self,page,address,mnemonic):
+		pass
+	#
+	#		A byte has been written at page:address
+	#
+	def byte(self,page,address,data):
+		pass
+	#
+	#		Finish off
+	#
+	def close(self):
+		pass
+
+# ***************************************************************************************
+#		Buffered listing writer. Writes lines in the style of a zasm .lst file, e.g.
+#
+#		22:8000: 2AF27F  	ld hl,($7ff2)
+#
+# ***************************************************************************************
+
+class ListingWriter(Listing):
+	def __init__(self,target = "hla.lst",level = Listing.Code,bufferSize = 1024):
+		self.level = level
+		self.ownsFile = isinstance(target,str)
+		self.handle = open(target,"w") if self.ownsFile else target
+		self.bufferSize = bufferSize
+		self.lines = []
+		self.current = None 												# [page,address,bytes,text]
+	#
+	def source(self,line,text):
+		if self.level >= Listing.Source:
+			self.endInstruction()
+			self.add("{0:19}\t; {1:<5} {2}".format("",line,text))
+	#
+	def note(self,level,text,*args):
+		if self.level >= level:
+			self.endInstruction()
+			self.add("{0:19}\t; {1}".format("",text.format(*args)))
+	#
+	def instruction(self,page,address,mnemonic):
+		self.endInstruction()
+		self.current = [page,address,[],mnemonic]
+	#
+	def byte(self,page,address,data):
+		c = self.current
+		if c is None or c[0] != page or c[1]+len(c[2]) != address:		# not following on
+			self.endInstruction()
+			c = self.current = [page,address,[],""]
+		c[2].append(data)
+	#
+	#		Complete the current instruction, 4 bytes per line.
+	#
+	def endInstruction(self):
+		c = self.current
+		if c is not None:
+			self.current = None
+			data = c[2] if len(c[2]) > 0 else [None]
+			for i in range(0,len(data),4):
+				hexData = "".join(["{0:02X}".format(x) for x in data[i:i+4] if x is not None])
+				self.add("{0:02x}:{1:04x}: {2:8}  \t{3}".format(c[0],c[1]+i,hexData,c[3] if i == 0 else ""))
+	#
+	#		Buffer lines, writing them out in blocks.
+	#
+	def add(self,line):
+		self.lines.append(line)
+		if len(self.lines) >= self.bufferSize:
+			self.flush()
+	#
+	def flush(self):
+		if len(self.lines) > 0:
+			self.handle.write("\n".join(self.lines)+"\n")
+			self.lines = []
+	#
+	def close(self):
+		self.endInstruction()
+		self.flush()
+		if self.ownsFile:
+			self.handle.close()
+		else:
+			self.handle.flush()
+
+if __name__ == "__main__":
+	lst = ListingWriter(sys.stdout)
+	lst.source(1,"a+1>@b")
+	lst.instruction(0x22,0x8000,"ld hl,($7ff2)")
+	for i,b in enumerate([0x2A,0xF2,0x7F]):
+		lst.byte(0x22,0x8000+i,b)
+	lst.note(Listing.Source,"{0} := ${1:04x}","b",0x7FF0)
+	lst.close()
@@ -0,0 +1,110 @@
+# ***************************************************************************************
+# ***************************************************************************************
+#
+#		Name : 		objectcode.py
+#		Author :	Paul Robson (paul@robsons.org.uk)
+#		Date : 		22nd January 2019
+#		Purpose :	Relocatable object code, one module per procedure
+#
+# ***************************************************************************************
+# ***************************************************************************************
+
+# ***************************************************************************************
+#
+#		A reference to a symbol, plus an offset. Names are
+#
+#			name(		procedure (the start of its code)
+#			name(@n 	variable holding parameter n of a procedure
+#			$name 		global variable
+#			:name 		local to the module, a local variable
+#			"text 		string constant, in the string pool
+#
+#		Anything else is looked up in the image dictionary (kernel routines)
+#
+# ***************************************************************************************
+
+class Symbol(object):
+	__slots__ = ("name","offset")
+
+	def __init__(self,name,offset = 0):
+		self.name = name
+		self.offset = offset
+	#
+	def isLocal(self):
+		return self.name.startswith(":")
+	#
+	def add(self,offset):
+		return Symbol(self.name,(self.offset+offset) & 0xFFFF)
+	#
+	def __eq__(self,other):
+		return isinstance(other,Symbol) and self.name == other.name and self.offset == other.offset
+	def __ne__(self,other):
+		return not self.__eq__(other)
+	def __hash__(self):
+		return hash((self.name,self.offset))
+	#
+	def __str__(self):
+		name = self.name+'"' if self.name.startswith('"') else self.name
+		return name if self.offset == 0 else "{0}+{1}".format(name,self.offset)
+	def __repr__(self):
+		return "Symbol("+str(self)+")"
+
+# ***************************************************************************************
+#
+#		Object module. The module is a block of bytes, the procedure code.
+#
+#			symbols 	local symbol or procedure name -> offset in the module
+#			fixups 		(offset,Symbol) 16 bit words to be filled in when linked
+#			variables 	variable names in the order they were first used
+#			calls 		procedure name -> weight, calls in loops weigh more
+#			parameters	variables holding the parameters
+#			inline 		code to inline for a call, small procedures only, or None
+#			profile 	StaticProfile of the code, or None
+#			lines 		listing entries, kept only when listing. These are
+#						("source",line,text) ("note",text,None)
+#						and ("code",offset,size,format,operand)
+#
+# ***************************************************************************************
+
+class ObjectModule(object):
+	def __init__(self,name = None):
+		self.name = name
+		self.data = bytearray()
+		self.symbols = {}
+		self.fixups = []
+		self.variables = []
+		self.calls = {}
+		self.parameters = []
+		self.inline = None
+		self.profile = None
+		self.lines = []
+	#
+	#		Size of the module in bytes
+	#
+	def size(self):
+		return len(self.data)
+	#
+	#		Add a variable, if it is new
+	#
+	def addVariable(self,name):
+		if name not in self.variables:
+			self.variables.append(name)
+	#
+	#		Add a 16 bit reference to a symbol at the end of the module.
+	#
+	def addReference(self,symbol):
+		self.fixups.append((len(self.data),symbol))
+		self.data += bytes(2)
+	#
+	#		Move the source line numbers in the listing entries
+	#
+	def moveLines(self,offset):
+		self.lines = [(e[0],e[1]+offset,e[2]) if e[0] == "source" else e for e in self.lines]
+	#
+	#		Non local symbols used by this module
+	#
+	def externals(self):
+		return set([symbol.name for offset,symbol in self.fixups if not symbol.isLocal()]) - set([self.name])
+	#
+	def __str__(self):
+		return "{0} {1} bytes {2} fixups [{3}]".format(self.name,self.size(),len(self.fixups),",".join(self.variables))
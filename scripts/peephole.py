@@ -0,0 +1,246 @@
+# ***************************************************************************************
+# ***************************************************************************************
+#
+#		Name : 		peephole.py
+#		Author :	Paul Robson (paul@robsons.org.uk)
+#		Date : 		20th January 2019
+#		Purpose :	Peephole optimiser for generated Z80 code
+#
+# ***************************************************************************************
+# ***************************************************************************************
+
+# ***************************************************************************************
+#
+#		Works on a list of (template,operand) instructions, as buffered by the Z80 code
+#		generator. ("source",..) markers are looked through, ("label",..) markers are
+#		not matched by any pattern so nothing is rewritten across a label. After the
+#		rules, register contents are tracked to remove loads of values already held,
+#		then stores to local variables which are never read are removed.
+#
+# ***************************************************************************************
+
+from objectcode import *
+
+loadBC = ("ld bc,nn","ld bc,(nn)")
+loadHL = ("ld hl,nn","ld hl,(nn)")
+
+#
+#		Small constants, 1 to 3 inc/dec hl are shorter and quicker than ld bc,nn ; add.
+#
+def incdec(value,up):
+	if not isinstance(value,int):											# symbol, not known yet
+		return None
+	value = value & 0xFFFF
+	if value > 0x8000:
+		value = value - 0x10000
+		up = not up
+		value = -value
+	if value > 3:
+		return None
+	return [("inc hl" if up else "dec hl",None)] * value
+
+class Peephole(object):
+	#
+	#		name, pattern (each item a template or tuple of templates) and a function
+	#		given the matched instructions returning the replacement, or None.
+	#
+	rules = [
+		("add constant",("ld bc,nn","add hl,bc"),
+				lambda c: incdec(c[0][1],True)),
+		("subtract constant",("ld bc,nn","xor a","sbc hl,bc"),
+				lambda c: incdec(c[0][1],False)),
+		("store then load",("ld (nn),hl","ld hl,(nn)"),
+				lambda c: c[:1] if c[0][1] == c[1][1] else None),
+		("load then store",("ld hl,(nn)","ld (nn),hl"),
+				lambda c: c[:1] if c[0][1] == c[1][1] else None),
+		("store then load bc",("ld (nn),hl","ld bc,(nn)"),
+				lambda c: [c[0],("ld b,h",None),("ld c,l",None)] if c[0][1] == c[1][1] else None),
+		("unused bc load",(loadBC,loadBC),
+				lambda c: c[1:]),
+		("unused hl load",(loadHL,loadHL),
+				lambda c: c[1:]),
+		("double exchange",("ex de,hl","ex de,hl"),
+				lambda c: []),
+	]
+
+	def __init__(self):
+		self.index = {} 													# first template -> rules
+		for name,pattern,replace in Peephole.rules:
+			pattern = [x if isinstance(x,tuple) else (x,) for x in pattern]
+			for template in pattern[0]:
+				self.index.setdefault(template,[]).append((name,pattern,replace))
+		self.hits = { rule[0]:0 for rule in Peephole.rules }
+		self.registers = RegisterTracker()
+		self.deadStores = 0
+	#
+	#		Optimise a list of instructions, returns a new list.
+	#
+	def optimise(self,code):
+		code = list(code)
+		i = 0
+		while i < len(code):
+			if self.rewrite(code,i):
+				i = max(0,i-4)												# back up, may now match
+			else:
+				i += 1
+		return self.removeDeadStores(self.registers.optimise(code))
+	#
+	#		Remove stores to local variables which are not otherwise used, such as
+	#		parameters only used while they are still in their registers.
+	#
+	def removeDeadStores(self,code):
+		stores = ("ld (nn),hl","ld (nn),de","ld (nn),bc","ld (nn),ix")
+		used = set([o.name for t,o in code if isinstance(o,Symbol) and t not in stores])
+		result = [(t,o) for t,o in code if t not in stores or not isinstance(o,Symbol) or 
+														not o.isLocal() or o.name in used]
+		self.deadStores += len(code)-len(result)
+		return result
+	#
+	#		Try all rules at position i, rewrite code and return True if one applies.
+	#
+	def rewrite(self,code,i):
+		for name,pattern,replace in self.index.get(code[i][0],[]):
+			positions = self.window(code,i,len(pattern))
+			if positions is None:
+				continue
+			instructions = [code[p] for p in positions]
+			for n in range(0,len(pattern)):
+				if instructions[n][0] not in pattern[n]:
+					break
+			else:
+				replacement = replace(instructions)
+				if replacement is not None:
+					for p in reversed(positions):
+						del code[p]
+					code[i:i] = replacement
+					self.hits[name] += 1
+					return True
+		return False
+	#
+	#		Positions of the next count instructions from i, skipping source markers.
+	#
+	def window(self,code,i,count):
+		positions = []
+		while len(positions) < count:
+			if i >= len(code):
+				return None
+			if code[i][0] != "source":
+				positions.append(i)
+			i += 1
+		return positions
+	#
+	#		Report of the rules used.
+	#
+	def report(self):
+		return "\n".join(["{0:24} {1}".format(name,self.hits[name]) for name,p,r in Peephole.rules]+
+									[self.registers.report(),"{0:24} {1}".format("dead stores",self.deadStores)])
+
+# ***************************************************************************************
+#
+#		Tracks what HL, DE and BC hold, as a set of facts ("var",address) (the contents
+#		of a variable) and ("const",value), through a procedure. A load of something a
+#		register already holds is removed, a load of something another register holds
+#		becomes a register copy. Everything is forgotten at labels and calls, as is any
+#		variable stored to through a pointer.
+#
+# ***************************************************************************************
+
+class RegisterTracker(object):
+	#
+	#		Loads, template -> (register,kind)
+	#
+	loads = { "ld hl,nn":("hl","const"),"ld hl,(nn)":("hl","var"),"ld de,nn":("de","const"),
+			  "ld de,(nn)":("de","var"),"ld bc,nn":("bc","const"),"ld bc,(nn)":("bc","var") }
+	#
+	#		Stores to a variable, template -> register (None if not tracked)
+	#
+	stores = { "ld (nn),hl":"hl","ld (nn),de":"de","ld (nn),bc":"bc","ld (nn),ix":None,"ld (nn),a":None }
+	#
+	#		Copying one register pair to another, (target,source) -> instructions
+	#
+	copies = { ("hl","de"):["ex de,hl"],("de","hl"):["ld d,h","ld e,l"],("bc","hl"):["ld b,h","ld c,l"],
+			   ("bc","de"):["ld b,d","ld c,e"],("hl","bc"):["ld h,b","ld l,c"],("de","bc"):["ld d,b","ld e,c"] }
+	pairs = { tuple(code):key for key,code in copies.items() if len(code) == 2 }
+	#
+	#		Instructions that change none of the tracked registers.
+	#
+	unchanged = set(["xor a","ld a,(hl)","ld a,h","ld a,l","or l","cpl","bit 7,h","and n","or n","xor n",
+					 "and d","and e","or d","or e","xor d","xor e","ld ix,nn","ld ix,(nn)","source","branch"])
+
+	def __init__(self):
+		self.removed = 0
+		self.copied = 0
+	#
+	#		Optimise a list of instructions, returns a new list.
+	#
+	def optimise(self,code):
+		self.facts = { "hl":set(),"de":set(),"bc":set() }
+		result = []
+		previous = None
+		for template,operand in code:
+			if template in RegisterTracker.loads:
+				register,kind = RegisterTracker.loads[template]
+				fact = (kind,operand)
+				if fact in self.facts[register]:							# already there
+					self.removed += 1
+					continue
+				source = [r for r in ("hl","de","bc") if fact in self.facts[r]]
+				if len(source) > 0:											# in another register
+					self.copied += 1
+					for copy in RegisterTracker.copies[(register,source[0])]:
+						result.append((copy,None))
+					self.copy(register,source[0])
+					previous = None
+					continue
+				self.facts[register] = set([fact])
+			elif template in RegisterTracker.stores:
+				self.forget(operand)
+				if RegisterTracker.stores[template] is not None:
+					self.facts[RegisterTracker.stores[template]].add(("var",operand))
+			elif template == "ex de,hl":
+				self.facts["hl"],self.facts["de"] = self.facts["de"],self.facts["hl"]
+			elif template == "ld (hl),e" or template == "ld (hl),d":		# through a pointer
+				self.forget(None)
+			elif (previous,template) in RegisterTracker.pairs:				# e.g. ld b,h ; ld c,l
+				self.copy(*RegisterTracker.pairs[(previous,template)])
+			elif template in RegisterTracker.unchanged:
+				pass
+			elif template[:3] == "ld " and template[3] in "bcdehl" and template[4] == ",":
+				for r in self.facts:										# 8 bit load to a register
+					if template[3] in r:
+						self.facts[r] = set()
+			elif template in ("inc hl","dec hl","add hl,bc","sbc hl,bc","add hl,hl","add hl,de",
+								"srl h","rr l","srl l"):
+				self.facts["hl"] = set()
+			else:															# label, call, anything else
+				for r in self.facts:
+					self.facts[r] = set()
+			previous = template
+			result.append((template,operand))
+		return result
+	#
+	#		Register target now holds what source holds.
+	#
+	def copy(self,target,source):
+		if target == "hl" and source == "de":								# ex de,hl swaps
+			self.facts["hl"],self.facts["de"] = self.facts["de"],self.facts["hl"]
+		else:
+			self.facts[target] = set(self.facts[source])
+	#
+	#		Memory at address has been written, forget any variable it may overlap. 
+	#		None is an unknown address. Different symbols are different variables, a 
+	#		number may be any of them.
+	#
+	def forget(self,address):
+		for r in self.facts:
+			self.facts[r] = set([f for f in self.facts[r] if f[0] == "const" or not self.overlaps(f[1],address)])
+	#
+	def overlaps(self,a,b):
+		if a is None or b is None or isinstance(a,int) != isinstance(b,int):
+			return True
+		if isinstance(a,int):
+			return abs(a-b) < 2
+		return a.name == b.name and abs(a.offset-b.offset) < 2
+	#
+	def report(self):
+		return "{0:24} {1}\n{2:24} {3}".format("register loads removed",self.removed,"register copies",self.copied)
@@ -0,0 +1,291 @@
+# ***************************************************************************************
+# ***************************************************************************************
+#
+#		Name : 		regression.py
+#		Author :	Paul Robson (paul@robsons.org.uk)
+#		Date : 		26th January 2019
+#		Purpose :	Executed checks of the generated code
+#
+# ***************************************************************************************
+# ***************************************************************************************
+
+from assembler import *
+from z80executor import *
+from benchmark import ProgramGenerator
+import tempfile
+
+# ***************************************************************************************
+#
+#		Each check builds HLA source, runs procedures in the Z80 executor and compares
+#		the results (HL and global variables) with the values expected, or with the
+#		same source built another way.
+#
+# ***************************************************************************************
+
+class NoTracking(RegisterTracker):
+	def optimise(self,code):
+		return list(code)
+
+class NoDeadStores(Peephole):
+	def removeDeadStores(self,code):
+		return code
+
+class NoTailCalls(Z80CodeGenerator):
+	def tailCall(self,code):
+		return code
+
+class RegressionCheck(object):
+	def __init__(self,imageFile = None):
+		self.imageFile = imageFile or os.path.join(os.path.dirname(os.path.abspath(__file__)),"boot.img")
+		self.checks = 0
+		self.failures = []
+	#
+	#		Build source, returns the code generator and the global symbols. The code
+	#		address can be moved up, to force procedures into the code pages.
+	#
+	def build(self,source,codeAddress = None,codeGen = None,workers = 1):
+		codeGen = Z80CodeGenerator(MemoryImage(self.imageFile)) if codeGen is None else codeGen
+		if codeAddress is not None:
+			codeGen.image.setCodeAddress(codeAddress)
+		worker = AssemblerWorker(codeGen,workers = workers)
+		worker.assemble(source.split("\n") if isinstance(source,str) else source)
+		return codeGen,worker.globals
+	#
+	#		Call a procedure, returns HL and the values of the variables given.
+	#
+	def call(self,build,procedure,parameters = (),variables = ()):
+		codeGen,symbols = build
+		cpu = Z80Executor(codeGen.image)
+		value = symbols[procedure+"("]
+		cpu.call(value >> 16,value & 0xFFFF,parameters,1000000)
+		return self.results(cpu,symbols,variables) if cpu.stopped == "sentinel" else cpu.stopped
+	#
+	#		Boot the image with procedure as the boot procedure, it is finished when
+	#		it returns to the kernel, which then loops.
+	#
+	def boot(self,build,procedure,variables = ()):
+		codeGen,symbols = build
+		value = symbols[procedure+"("]
+		codeGen.image.setBoot(value >> 16,value & 0xFFFF)
+		cpu = Z80Executor(codeGen.image)
+		cpu.boot(1000000)
+		return self.results(cpu,symbols,variables)
+	#
+	def results(self,cpu,symbols,variables):
+		return tuple([cpu.getPair((H,L))]+[cpu.readWord(symbols[v]) for v in variables])
+	#
+	def check(self,name,expected,actual):
+		self.checks += 1
+		if expected != actual:
+			self.failures.append("{0}: expected {1} got {2}".format(name,expected,actual))
+	#
+	#		Calls between code pages. fill and top are too large to share a page,
+	#		top must still be running in its own page when fill returns, whether it
+	#		was called directly or booted.
+	#
+	def crossPage(self):
+		count = 1600
+		source = ["defproc fill(n)"]+["\t$r+n+{0}>@$r".format(i % 7) for i in range(0,count)]+["endproc"]
+		source += ["defproc top()","\t0>@$r"]+["\t$s+{0}>@$s".format(i % 5) for i in range(0,count)]
+		source += ["\tfill(1)","\t$r+5>@$r","endproc"]
+		expected = (count+sum([i % 7 for i in range(0,count)])+5) & 0xFFFF
+		build = self.build(source,0xB000)
+		pages = [build[1][p+"("] >> 16 for p in ("fill","top")]
+		self.check("cross page placement",True,pages[0] != pages[1] and min(pages) >= 0x22)
+		self.check("cross page call",(expected,),self.call(build,"top",(),("$r",))[1:])
+		self.check("cross page boot",(expected,),self.boot(build,"top",("$r",))[1:])
+	#
+	#		A large program with many calls between pages links, with one trampoline
+	#		for each procedure called from another page and none for the others.
+	#
+	def trampolines(self):
+		codeGen = Z80CodeGenerator(MemoryImage(self.imageFile))
+		modules = []
+		link = codeGen.link
+		def keepModules():													# the call graph
+			modules.extend(codeGen.modules)
+			return link()
+		codeGen.link = keepModules
+		try:
+			self.build(ProgramGenerator(procedures = 1500,fanOut = 8).generate(),codeGen = codeGen)
+		except LinkerError as e:
+			self.check("trampolines link","linked",e.message)
+			return
+		regions = codeGen.linker.regions
+		targets = set()
+		for module in modules:
+			for callee in module.calls:
+				if regions.get(callee) is not None and regions[callee] != regions[module.name]:
+					targets.add(callee)
+		created = set([name[1:] for name in codeGen.linker.symbols if name.startswith("~") and name.endswith("(")])
+		self.check("trampolines for cross page calls",[],sorted(targets ^ created))
+	#
+	#		Build and run the same source with each code generator, the results must
+	#		all be the ones expected, and the code must not be the same size for all.
+	#
+	def compare(self,name,source,expected,codeGens):
+		variables = sorted(expected)
+		sizes = set()
+		for description,codeGen in codeGens:
+			build = self.build(source,codeGen = codeGen)
+			sizes.add(codeGen.image.getCodeAddress())
+			result = self.call(build,"main",(),variables)
+			result = result[1:] if isinstance(result,tuple) else result
+			self.check(name+" "+description,tuple([expected[v] for v in variables]),result)
+		self.check(name+" changes the code",True,len(sizes) > 1)
+	#
+	def codeGen(self,peephole = True,inlineSize = 8):
+		return Z80CodeGenerator(MemoryImage(self.imageFile),peephole,inlineSize)
+	#
+	#		Arithmetic, conditions and loops with and without the peephole optimiser.
+	#
+	arithmetic = """
+		defproc fact(n)
+			1>@$fact
+			while (n#0):$fact*n>@$fact:n-1>@n:endwhile
+		endproc
+		defproc ops(a,b)
+			a/b>@$div:a%b>@$mod:a*b>@$mul:a&b>@$and:a|b>@$or:a^b>@$xor:a-b>@$sub:b-a>@$neg
+			0>@$less:if (a-b<0):1>@$less:endif
+			0>@$same:if (a-1234=0):a+1>@$same:endif
+		endproc
+		defproc sum(count)
+			0>@$sum
+			while (count#0):$sum+count>@$sum:count-1>@count:endwhile
+		endproc
+		defproc main()
+			fact(7):ops(1234,56):sum(300)
+		endproc
+	"""
+	arithmeticResults = { "$fact":5040,"$div":22,"$mod":2,"$mul":(1234*56) & 0xFFFF,"$and":1234 & 56,
+						  "$or":1234 | 56,"$xor":1234 ^ 56,"$sub":1178,"$neg":-1178 & 0xFFFF,"$less":0,
+						  "$same":1235,"$sum":45150 }
+	#
+	def peephole(self):
+		self.compare("peephole",self.arithmetic,self.arithmeticResults,
+								(("off",self.codeGen(False)),("on",self.codeGen(True))))
+	#
+	#		Values reused while they are still in registers, with and without register
+	#		tracking. The write through a pointer must be seen by what follows.
+	#
+	tracking = """
+		defproc track(a,b,c)
+			a+b>@$y:a+b>@$z:a-b>@$d:a+c>@$x
+			@c>@$p:7>$p
+			a+c>@$w:$p!0>@$r:b+a+$d>@$s
+		endproc
+		defproc main()
+			track(100,23,5)
+		endproc
+	"""
+	trackingResults = { "$x":105,"$y":123,"$z":123,"$d":77,"$w":107,"$r":7,"$s":200 }
+	#
+	def registerTracking(self):
+		plain = self.codeGen()
+		plain.peephole.registers = NoTracking()
+		self.compare("register tracking",self.tracking,self.trackingResults,(("off",plain),("on",self.codeGen())))
+	#
+	#		Parameters kept in registers, with and without removing the stores to their
+	#		variables. The fourth is stored into the procedure's variable by the caller,
+	#		arguments beyond the parameters go to ~discard. A string which looks like a
+	#		parameter variable is not one.
+	#
+	parameters = """
+		defproc four(a,b,c,d)
+			a>@$a1:b>@$b1:c>@$c1:d>@$d1:d+a>@$da
+		endproc
+		defproc many(a,b,c,d)
+			d*10+a>@$m
+		endproc
+		defproc two(a,b)
+			a-b>@$two
+		endproc
+		defproc main()
+			four(1,2,3,4):many(5,6,7,8):two(9,4,$m,77):"two(@x">@$text
+		endproc
+	"""
+	parameterResults = { "$a1":1,"$b1":2,"$c1":3,"$d1":4,"$da":5,"$m":85,"$two":5 }
+	#
+	def parameterPassing(self):
+		plain = self.codeGen()
+		plain.peephole = NoDeadStores()
+		optimised = self.codeGen()
+		self.compare("parameters",self.parameters,self.parameterResults,(("stored",plain),("in registers",optimised)))
+		self.check("extra arguments discarded",True,"~discard" in optimised.linker.symbols)
+	#
+	#		Calls at the end of a procedure, some inside an if, which become jumps,
+	#		and a small procedure which is inlined, each with and without.
+	#
+	calls = """
+		defproc bump()
+			$n+1>@$n
+		endproc
+		defproc store(a)
+			a+$v>@$t
+		endproc
+		defproc tail(a)
+			a*3>@$v
+			store(a)
+		endproc
+		defproc loop(count)
+			while (count#0):bump():count-1>@count:endwhile
+			if ($n-6=0):store(1):endif
+		endproc
+		defproc skip()
+			if ($n=0):store(100):endif
+		endproc
+		defproc main()
+			0>@$n:tail(5):bump():bump():loop(4):skip():$n+10>@$n
+		endproc
+	"""
+	callResults = { "$n":16,"$v":15,"$t":16 }
+	#
+	def tailCallsAndInlining(self):
+		optimised = self.codeGen(inlineSize = 0)
+		self.compare("tail calls",self.calls,self.callResults,
+								(("off",NoTailCalls(MemoryImage(self.imageFile),True,0)),("on",optimised)))
+		self.check("tail calls made",True,optimised.tailCalls > 0)
+		optimised = self.codeGen()
+		self.compare("inlining",self.calls,self.callResults,
+								(("off",self.codeGen(inlineSize = 0)),("on",optimised)))
+		self.check("calls inlined",True,optimised.inlinedCalls > 0)
+	#
+	#		A parallel build gives the same image as a serial one, including inlining
+	#		of procedures which only became inlinable by inlining others.
+	#
+	chain = """
+		defproc a()
+			$x+1>@$x
+		endproc
+		defproc b()
+			a()
+		endproc
+		defproc c()
+			b():b()
+		endproc
+	"""
+	#
+	def parallelBuild(self):
+		sources = (("inline chain",self.chain),("calls",self.calls),
+				   ("generated",ProgramGenerator(procedures = 150,fanOut = 3).generate()))
+		with tempfile.TemporaryDirectory() as directory:
+			for name,source in sources:
+				images = []
+				for workers in (1,4):
+					codeGen = self.build(source,workers = workers)[0]
+					codeGen.image.save(os.path.join(directory,"build.img"))
+					images.append(open(os.path.join(directory,"build.img"),"rb").read())
+				self.check("parallel build "+name,True,images[0] == images[1])
+	#
+	def run(self):
+		for check in (self.crossPage,self.trampolines,self.peephole,self.registerTracking,self.parameterPassing,
+																				self.tailCallsAndInlining,self.parallelBuild):
+			check()
+		return self.failures
+
+if __name__ == "__main__":
+	checks = RegressionCheck()
+	failures = checks.run()
+	print("\n".join(failures))
+	print("{0} checks, {1} failed".format(checks.checks,len(failures)))
+	sys.exit(0 if len(failures) == 0 else 1)
@@ -10,20 +10,379 @@
 # ***************************************************************************************
 
 from imagelib import *
+from ir import *
+from peephole import *
+from linker import *
+from costmodel import *
+import re
 
 # ***************************************************************************************
 #					This is a code generator for an idealised CPU
 # ***************************************************************************************
 
-class Z80CodeGenerator(object):
-	def __init__(self):
-		self.image = MemoryImage()
+class Z80CodeGenerator(IRLowering):
+	#
+	#		Instructions used, template -> (opcode bytes, operand size). nn is a 16 bit
+	#		operand, n an 8 bit one, e a relative jump whose operand is the target (size -1)
+	#
+	opcodes = {
+		"ld hl,nn":((0x21,),2),		"ld hl,(nn)":((0x2A,),2),		"ld (nn),hl":((0x22,),2),
+		"ld de,nn":((0x11,),2),		"ld de,(nn)":((0xED,0x5B),2),	"ld (nn),de":((0xED,0x53),2),
+		"ld bc,nn":((0x01,),2),		"ld bc,(nn)":((0xED,0x4B),2),	"ld (nn),bc":((0xED,0x43),2),
+		"ld ix,nn":((0xDD,0x21),2),	"ld ix,(nn)":((0xDD,0x2A),2),	"ld (nn),ix":((0xDD,0x22),2),
+		"add hl,bc":((0x09,),0),	"sbc hl,bc":((0xED,0x42),0),	"xor a":((0xAF,),0),
+		"inc hl":((0x23,),0),		"dec hl":((0x2B,),0),			"ex de,hl":((0xEB,),0),
+		"ld a,(hl)":((0x7E,),0),	"ld l,(hl)":((0x6E,),0),		"ld h,(hl)":((0x66,),0),
+		"ld l,a":((0x6F,),0),		"ld h,n":((0x26,),1),			"ld b,h":((0x44,),0),
+		"ld c,l":((0x4D,),0),		"ld (hl),e":((0x73,),0),		"ld (hl),d":((0x72,),0),
+		"call nn":((0xCD,),2),		"jp nn":((0xC3,),2),			"ret":((0xC9,),0),
+		"add hl,hl":((0x29,),0),	"add hl,de":((0x19,),0),		"ld d,h":((0x54,),0),
+		"ld e,l":((0x5D,),0),		"srl h":((0xCB,0x3C),0),		"rr l":((0xCB,0x1D),0),
+		"srl l":((0xCB,0x3D),0),
+		"ld a,h":((0x7C,),0),		"ld a,l":((0x7D,),0),			"ld h,a":((0x67,),0),
+		"ld l,h":((0x6C,),0),		"ld l,n":((0x2E,),1),			"cpl":((0x2F,),0),
+		"and n":((0xE6,),1),		"or n":((0xF6,),1),				"xor n":((0xEE,),1),
+		"or l":((0xB5,),0),			"bit 7,h":((0xCB,0x7C),0),
+		"jr e":((0x18,),-1),		"jr z,e":((0x28,),-1),			"jr nz,e":((0x20,),-1),
+		"jp z,nn":((0xCA,),2),		"jp nz,nn":((0xC2,),2),			"jp p,nn":((0xF2,),2),
+		"and d":((0xA2,),0),		"and e":((0xA3,),0),			"or d":((0xB2,),0),
+		"or e":((0xB3,),0),			"xor d":((0xAA,),0),			"xor e":((0xAB,),0),
+		"ld a,(nn)":((0x3A,),2),	"ld (nn),a":((0x32,),2),		"ld a,n":((0x3E,),1),
+		"push af":((0xF5,),0),		"pop af":((0xF1,),0),			"inc a":((0x3C,),0),
+		"nextreg $56,a":((0xED,0x92,0x56),0),						"nextreg $57,a":((0xED,0x92,0x57),0),
+		"ld b,d":((0x42,),0),		"ld c,e":((0x4B,),0),			"ld h,b":((0x60,),0),
+		"ld l,c":((0x69,),0),		"ld d,b":((0x50,),0),			"ld e,c":((0x59,),0),
+		"ex af,af'":((0x08,),0),	"push bc":((0xC5,),0),			"pop bc":((0xC1,),0),
+		"out (c),a":((0xED,0x79),0),"in a,(c)":((0xED,0x78),0),		"inc b":((0x04,),0),
+		"jp (ix)":((0xDD,0xE9),0),
+	}
+	#
+	#		Listing formats for the templates.
+	#
+	formats = { t:re.sub(r"\bn\b","${0:02x}",re.sub(r"\bnn\b","${0:04x}",t)) for t in opcodes }
+	formats.update({ t:t[:-1]+"${0:04x}" for t,(code,size) in opcodes.items() if size < 0 })
+	sizes = { t:len(code)+abs(size) for t,(code,size) in opcodes.items() }
+	timedFormats = { t:f+"\t; "+CostModel.text(t) for t,f in formats.items() }
+	#
+	#		Register loaders/savers for parameters. The fourth is passed in memory, the
+	#		caller stores it directly into the callee's variable.
+	#
+	paramRegisters = [ "hl","de","bc",None ]
+	#
+	#		Logical operators, and the kernel routines for HL := HL op DE. The divide
+	#		and modulus routines work out DE op HL, so the operands are exchanged.
+	#
+	logicalOps = { "&":"and","|":"or","^":"xor" }
+	kernelRoutines = { "*":"sysmultiply(0","/":"sysdivide(0","%":"sysmodulus(0" }
+
+	def __init__(self,image = None,peephole = True,inlineSize = 8):
+		self.image = MemoryImage() if image is None else image				# or a MappedMemoryImage
+		self.image.hashDictionary()											# hash table for the Next
 		self.varAlloc = 0x8000
+		self.peephole = Peephole() if peephole else None 					# optimiser
+		self.inlineSize = inlineSize 										# largest inlined body
+		self.inlines = {} 													# procedure -> body
+		self.inlinedCalls = 0
+		self.tailCalls = 0
+		self.profiles = [] 													# StaticProfile of each
+		self.code = None 													# buffered procedure
+		self.module = None 													# module being built
+		self.modules = [] 													# modules to link
+		self.linker = Linker(self.image,self.varAlloc,self)
+	#
+	#		Set/Get the listing sink
+	#
+	def setListing(self,listing):
+		self.image.setListing(listing)
+	def getListing(self):
+		return self.image.listing
+	#
+	#		Start listing a new instruction. The mnemonic is only formatted if listed.
+	#
+	def instruction(self,mnemonic,*args):
+		if self.image.listing.level >= Listing.Code:
+			self.image.listing.instruction(self.image.getCodePage(),self.image.getCodeAddress(),mnemonic.format(*args))
+	#
+	#		Emit an instruction. Inside a procedure it is buffered until the procedure
+	#		is complete, otherwise it is written out straight away.
+	#
+	def emit(self,template,operand = None):
+		if self.code is not None:
+			self.code.append((template,operand))
+			self.codeSize += Z80CodeGenerator.sizes[template]
+		else:
+			self.writeInstruction(template,operand)
+	#
+	#		Write an instruction to the image
+	#
+	def writeInstruction(self,template,operand):
+		opcode,size = Z80CodeGenerator.opcodes[template]
+		if self.image.listing.level >= Listing.Code:
+			self.instruction(Z80CodeGenerator.formats[template],operand)
+		for b in opcode:
+			self.image.cByte(b)
+		if size == 1:
+			self.image.cByte(operand & 0xFF)
+		elif size == -1:
+			offset = (operand & 0xFFFF) - (self.image.getCodeAddress()+1)	# relative jump
+			assert offset >= -128 and offset < 128,"jr out of range"
+			self.image.cByte(offset & 0xFF)
+		elif size == 2:
+			self.image.cWord(operand & 0xFFFF)
+	#
+	#		Assemble an instruction onto the end of a module. Addresses in the code are
+	#		offsets from its start, symbol operands become fixups.
+	#
+	def assembleInstruction(self,module,template,operand,start):
+		opcode,size = Z80CodeGenerator.opcodes[template]
+		offset = len(module.data)
+		if self.image.listing.level >= Listing.Code:
+			target = Symbol(module.name,operand) if size < 0 else operand 		# list jr as address
+			module.lines.append(("code",offset,len(opcode)+abs(size),Z80CodeGenerator.timedFormats[template],target))
+		module.data += bytes(opcode)
+		if size == 1:
+			module.data.append(operand & 0xFF)
+		elif size == -1:
+			relative = operand - (offset - start + len(opcode) + 1)				# relative jump
+			assert relative >= -128 and relative < 128,"jr out of range"
+			module.data.append(relative & 0xFF)
+		elif size == 2:
+			if isinstance(operand,Symbol):
+				module.addReference(operand)
+				if operand.name.startswith("$"):							# all globals used are
+					module.addVariable(operand.name)						# listed, for the linker
+			else:
+				module.data += bytes((operand & 0xFF,(operand >> 8) & 0xFF))
+	#
+	#		Lower a procedure. The code is buffered, optimised, laid out and then
+	#		assembled into the procedure's object module, which is linked later. The
+	#		cost of the laid out code is worked out for the profile report.
+	#
+	def lower(self,procedure):
+		module = self.getModule()
+		module.name = procedure.name
+		self.code = []
+		self.codeSize = 0
+		self.parameters = [] 												# for the next call
+		IRLowering.lower(self,procedure)
+		code = self.code
+		self.code = None
+		if self.peephole is not None:
+			code = self.peephole.optimise(code)
+		code = self.tailCall(code)
+		module.inline = self.inlineBody(code)
+		if module.inline is not None:
+			self.inlines[module.name] = module.inline
+		used = set([operand.name for t,operand in code if isinstance(operand,Symbol)])
+		module.variables = [v for v in module.variables if v in used or v in module.parameters]
+		module.calls = { t.name:w for t,w in procedure.callWeights().items() 
+											if isinstance(t,Symbol) and t.name not in self.inlines }
+		start = module.symbols[module.name] = module.size()
+		code = self.layout(code,module.name)
+		module.profile = StaticProfile(module.name,code,Z80CodeGenerator.sizes)
+		self.profiles.append(module.profile)
+		for template,operand in code:
+			if template == "source":										# source line marker
+				if self.image.listing.level >= Listing.Source:
+					module.lines.append(("source",operand[0],operand[1]))
+			elif template != "label":										# labels have no code
+				self.assembleInstruction(module,template,operand,start)
+		self.modules.append(module)
+		self.module = None
+		return module
+	#
+	#		A call just before the return becomes a jump, and the called procedure 
+	#		returns for it. Only labels may come between, in which case the return is
+	#		kept for the branches to them. A jump to a trampoline works the same way.
+	#
+	def tailCall(self,code):
+		i = len(code)-1
+		while i >= 0 and code[i][0] == "source":
+			i -= 1
+		if i < 0 or code[i][0] != "ret":
+			return code
+		end = i
+		i -= 1
+		while i >= 0 and (code[i][0] == "source" or code[i][0] == "label"):
+			i -= 1
+		if i < 0 or code[i][0] != "call nn":
+			return code
+		self.tailCalls += 1
+		labels = [c for c in code[i+1:end] if c[0] == "label"]
+		return code[:i]+[("jp nn",code[i][1])]+code[i+1:end]+(code[end:] if len(labels) > 0 else code[end+1:])
+	#
+	#		The body of a procedure which can be inlined, or None. It must make no
+	#		calls, use no local variables, and be no larger than the size budget.
+	#		The body is the code without the return and source markers.
+	#
+	def inlineBody(self,code):
+		body = [(t,o) for t,o in code if t != "source"]
+		if len(body) == 0 or body[-1][0] != "ret":
+			return None
+		body.pop()
+		size = 0
+		for template,operand in body:
+			if template == "call nn" or template == "jp nn" or template == "ret":
+				return None
+			if isinstance(operand,Symbol) and operand.isLocal():
+				return None
+			if template != "label":
+				size += 2 if template == "branch" else Z80CodeGenerator.sizes[template]
+		return body if size <= self.inlineSize else None
+	#
+	#		Paging routines for trampolines. ~setpage selects page A at $C000-$FFFF with
+	#		nextreg $56/$57, as the bootloader does. ~farcall calls the procedure at IX in
+	#		page A and then restores the page that was selected, read back from the MMU,
+	#		so it is right however the caller was entered. BC is saved for the parameter.
+	#
+	def createPaging(self):
+		module = ObjectModule("~setpage")
+		if self.image.listing.level >= Listing.Source:
+			module.lines.append(("note","${0:04x} paging",0))
+		code = (("~setpage",None,None),("nextreg $56,a",None),("inc a",None),("nextreg $57,a",None),("ret",None),
+				("~farcall",None,None),("ex af,af'",None),("push bc",None),("ld bc,nn",0x243B),("ld a,n",0x56),
+				("out (c),a",None),("inc b",None),("in a,(c)",None),("pop bc",None),("push af",None),
+				("ex af,af'",None),("call nn",Symbol("~setpage")),("call nn",Symbol("~callix")),
+				("pop af",None),("jp nn",Symbol("~setpage")),
+				("~callix",None,None),("jp (ix)",None))
+		for item in code:
+			if len(item) == 3:
+				module.symbols[item[0]] = len(module.data)
+			else:
+				self.assembleInstruction(module,item[0],item[1],0)
+		return module
+	#
+	#		Trampoline to call a procedure in another page, restoring the caller's page
+	#		after. A and IX are used, the parameter registers are not changed.
+	#
+	def createTrampoline(self,name,page):
+		module = ObjectModule("~"+name)
+		module.symbols[module.name] = 0
+		if self.image.listing.level >= Listing.Source:
+			module.lines.append(("note","${0:04x} "+name+" in page $"+"{0:02x}".format(page),0))
+		for template,operand in (("ld ix,nn",Symbol(name)),("ld a,n",page),("jp nn",Symbol("~farcall"))):
+			self.assembleInstruction(module,template,operand,0)
+		return module
+	#
+	#		Add a module compiled earlier, returns the value used to call it.
+	#
+	def addModule(self,module):
+		self.modules.append(module)
+		if module.inline is not None:
+			self.inlines[module.name] = module.inline
+		if module.profile is not None:
+			self.profiles.append(module.profile)
+		return Symbol(module.name)
+	#
+	#		How to create a code generator like this one in a worker process, which
+	#		only compiles procedures to modules.
+	#
+	def getWorker(self):
+		return (Z80CodeGenerator.createWorker,(self.image.fileName,self.peephole is not None,
+														self.inlineSize,self.getListing().level))
+	#
+	@staticmethod
+	def createWorker(fileName,peephole,inlineSize,level):
+		codeGen = Z80CodeGenerator(MemoryImage(fileName),peephole,inlineSize)
+		codeGen.getListing().level = level
+		return codeGen
+	#
+	#		Everything other than the source which changes the generated code.
+	#
+	def getConfiguration(self):
+		return "z80 peephole={0} inline={1} listing={2}".format(self.peephole is not None,self.inlineSize,
+																					self.image.listing.level)
+	#
+	#		Link the modules compiled so far into the image. Returns the addresses of
+	#		the procedures and global variables.
+	#
+	def link(self):
+		defined = self.linker.link(self.modules)
+		self.modules = []
+		return defined
+	#
+	#		The module being built, created when first needed (strings and variables
+	#		come before the procedure is defined)
+	#
+	def getModule(self):
+		if self.module is None:
+			self.module = ObjectModule()
+		return self.module
+	#
+	#		Define the procedure being compiled, returns the value used to call it.
+	#
+	def defineProcedure(self,name):
+		self.getModule().name = name
+		return Symbol(name)
+	#
+	#		Resolve branches. They all start as jr, any out of range become jp, and the
+	#		layout is repeated until nothing changes. Sizes only grow, so this ends.
+	#		Addresses are offsets from the start of the procedure, so jp targets are
+	#		relative to the procedure's symbol.
+	#
+	def layout(self,code,name):
+		longBranches = set()
+		while True:
+			address = 0
+			labels = {}
+			branches = []
+			for i in range(0,len(code)):
+				template,operand = code[i]
+				if template == "label":
+					labels[operand] = address
+				elif template == "branch":
+					address += 3 if i in longBranches else 2
+					branches.append((i,address))
+				elif template != "source":
+					address += Z80CodeGenerator.sizes[template]
+			changed = False
+			for i,nextAddress in branches:
+				offset = labels[code[i][1][1]] - nextAddress
+				if i not in longBranches and (offset < -128 or offset > 127):
+					longBranches.add(i)
+					changed = True
+			if not changed:
+				break
+		resolved = []
+		for i in range(0,len(code)):
+			template,operand = code[i]
+			if template == "branch":
+				test,label = operand
+				if i in longBranches:
+					template = "jp nn" if test == "" else "jp "+test+",nn"
+					operand = Symbol(name,labels[label])
+				else:
+					template = "jr e" if test == "" else "jr "+test+",e"
+					operand = labels[label]
+			resolved.append((template,operand))
+		return resolved
+	#
+	#		Source lines, labels and branches are kept in the buffer as markers. The
+	#		peephole optimiser looks through source lines but not past the others.
+	#
+	def lowerSource(self,line,text):
+		self.code.append(("source",(line,text)))
+	#
+	def lowerLabel(self,label):
+		self.code.append(("label",label))
+	#
+	#		Branches test HL. Positive is tested with bit 7,h so all tests are z/nz
+	#		and can use jr. The jr/jp choice is made in layout()
+	#
+	def lowerBranch(self,test,label):
+		if test == "z" or test == "nz":
+			self.emit("ld a,h")
+			self.emit("or l")
+		elif test == "p":
+			self.emit("bit 7,h")
+			test = "z"
+		self.code.append(("branch",(test,label)))
 	#
 	#		Get current address
 	#
 	def getAddress(self):
-		return (self.image.getCodePage() << 16)+self.image.getCodeAddress()
+		size = self.codeSize if self.code is not None else 0
+		return (self.image.getCodePage() << 16)+self.image.getCodeAddress()+size
 	#
 	#		Get word size
 	#
@@ -33,8 +392,7 @@ class Z80CodeGenerator(object):
 	#		Load a constant or variable into the accumulator.
 	#
 	def loadDirect(self,isConstant,value):
-		self.image.cByte(0x21 if isConstant else 0x2A)							# ld hl,xxxx/(xxxx)
-		self.image.cWord(value & 0xFFFF)
+		self.emit("ld hl,nn" if isConstant else "ld hl,(nn)",value)
 	#
 	#		Do a binary operation on a constant or variable on the accumulator
 	#
@@ -42,87 +400,198 @@ class Z80CodeGenerator(object):
 		if operator == "!" or operator == "?":
 			self.binaryOperation("+",isConstant,value)
 			if operator == "?":
-				self.image.cByte(0x6E)											# ld l,(hl)
-				self.image.cByte(0x26)											# ld h,0
-				self.image.cByte(0x00)											
+				self.emit("ld l,(hl)")
+				self.emit("ld h,n",0)
 			else:
-				self.image.cByte(0x7E)											# ld a,(hl)
-				self.image.cByte(0x23)											# inc hl
-				self.image.cByte(0x66)											# ld h,(hl)
-				self.image.cByte(0x6F)											# ld l,a
+				self.emit("ld a,(hl)")
+				self.emit("inc hl")
+				self.emit("ld h,(hl)")
+				self.emit("ld l,a")
+			return
 
-		if isConstant:
-			self.image.cByte(0x01)												# ld bc,xxxx
-		else:
-			self.image.cByte(0xED)												# ld bc,(xxxx)
-			self.image.cByte(0x4B)
-		self.image.cWord(value & 0xFFFF)										# value to use.
+		if operator == ">":
+			if isConstant:
+				self.emit("ld (nn),hl",value)									# store at address
+			else:
+				self.emit("ld de,(nn)",value)									# store at address
+				self.emit("ex de,hl")											# in variable
+				self.emit("ld (hl),e")
+				self.emit("inc hl")
+				self.emit("ld (hl),d")
+				self.emit("ex de,hl")
+			return
+
+		if operator in Z80CodeGenerator.logicalOps:								# and or xor
+			if isConstant and not isinstance(value,Symbol):
+				self.logicalConstant(Z80CodeGenerator.logicalOps[operator],value & 0xFFFF)
+			else:
+				self.emit("ld de,nn" if isConstant else "ld de,(nn)",value)
+				for r in "hl":											 	# byte at a time
+					self.emit("ld a,"+r)
+					self.emit(Z80CodeGenerator.logicalOps[operator]+" "+("d" if r == "h" else "e"))
+					self.emit("ld "+r+",a")
+			return
+
+		if operator in Z80CodeGenerator.kernelRoutines:							# * / %
+			if isConstant and not isinstance(value,Symbol) and self.constantMultiplyDivide(operator,value & 0xFFFF):
+				return
+			self.emit("ld de,nn" if isConstant else "ld de,(nn)",value)
+			if operator != "*":
+				self.emit("ex de,hl")
+			self.emit("call nn",Symbol(Z80CodeGenerator.kernelRoutines[operator]))
+			return
+
+		self.emit("ld bc,nn" if isConstant else "ld bc,(nn)",value)			# value to use.
 		if operator == "+":
-			self.image.cByte(0x09)												# add hl,bc
+			self.emit("add hl,bc")
 			return
 		if operator == "-":
-			self.image.cByte(0xAF)												# xor a
-			self.image.cByte(0xED)												# sbc hl,bc
-			self.image.cByte(0x42)
+			self.emit("xor a")
+			self.emit("sbc hl,bc")
 			return
-			
+
+	#
+	#		And/Or/Xor with a constant, a byte at a time. Bytes which are unchanged (and
+	#		$FF, or $00, xor $00) are left alone, bytes which become fixed are loaded.
+	#
+	def logicalConstant(self,operation,value):
+		for r,byte in (("h",value >> 8),("l",value & 0xFF)):
+			if (operation == "and" and byte == 0xFF) or (operation != "and" and byte == 0x00):
+				continue
+			if operation == "and" and byte == 0x00:
+				self.emit("ld "+r+",n",0x00)
+			elif operation == "or" and byte == 0xFF:
+				self.emit("ld "+r+",n",0xFF)
+			else:
+				self.emit("ld a,"+r)
+				if operation == "xor" and byte == 0xFF:
+					self.emit("cpl")
+				else:
+					self.emit(operation+" n",byte)
+				self.emit("ld "+r+",a")
+	#
+	#		Multiply/Divide/Modulus by a constant using shifts and adds where it is
+	#		worth it. Returns False if the kernel routine should be called instead.
+	#
+	def constantMultiplyDivide(self,operator,value):
+		isPower = value != 0 and (value & (value-1)) == 0
+		shift = value.bit_length()-1
+		if operator == "*":
+			if value == 0:
+				self.emit("ld hl,nn",0)
+				return True
+			if shift + bin(value).count("1") - 1 > 10:						# too long, call it.
+				return False
+			if not isPower:													# keep a copy in DE
+				self.emit("ld d,h")
+				self.emit("ld e,l")
+			for bit in range(shift-1,-1,-1):								# shift and add
+				self.emit("add hl,hl")
+				if value & (1 << bit):
+					self.emit("add hl,de")
+			return True
+		if not isPower:
+			return False
+		if operator == "/":
+			if shift >= 8:													# byte shift first
+				self.emit("ld l,h")
+				self.emit("ld h,n",0)
+				shift -= 8
+				for i in range(0,shift):
+					self.emit("srl l")
+			else:
+				for i in range(0,shift):
+					self.emit("srl h")
+					self.emit("rr l")
+			return True
+		self.logicalConstant("and",value-1) 								# % is a mask
+		return True
 	#
 	#	Compile a loop instruction. Test are z, nz, p or "" (unconditional). The compilation
-	#	address can be overridden to patch forward jumps.
+	#	address can be overridden to patch forward jumps. This is the fixed size (jp) 
+	#	form, for use outside procedures ; procedure branches are done in layout()
 	#
 	def jumpInstruction(self,test,target,override = None):
-		pass
+		template = "jp nn" if test == "" else "jp "+test+",nn"
+		if override is None:
+			self.emit(template,target & 0xFFFF)
+		else:
+			page = self.image.getCodePage()
+			opcode = Z80CodeGenerator.opcodes[template][0][0]
+			self.image.write(page,override & 0xFFFF,opcode)
+			self.image.write(page,(override+1) & 0xFFFF,target & 0xFF)
+			self.image.write(page,(override+2) & 0xFFFF,(target >> 8) & 0xFF)
 	#
-	#		Allocate count bytes of meory, default is word size
+	#		Allocate a variable. Globals are $name, others are local to the module. The
+	#		address is given by the linker.
 	#
 	def allocVar(self,reason = None):
-		self.varAlloc = self.varAlloc - self.getWordSize()
-		if reason is not None:
-			print("{0} := 0x{1:04x}".format(reason,self.varAlloc))
-		return self.varAlloc
+		module = self.getModule()
+		if reason is None:
+			reason = "~{0}".format(len(module.variables))
+		symbol = Symbol(reason if reason.startswith("$") else ":"+reason)
+		module.addVariable(symbol.name)
+		return symbol
 	#
-	#		Load constant/variable to a temporary area
+	#		Load constant/variable to a parameter register, done when the call is made
 	#
 	def loadParamRegister(self,regNumber,isConstant,value):
-		loader = [ 0x2A, 0xED5B, 0xED4B, 0xDD2A][regNumber]
-		if isConstant:
-			loader = [ 0x21, 0x11, 0x01, 0xDD21][regNumber]
-		if loader < 0x100:
-			self.image.cByte(loader)
-		else:
-			self.image.cByte(loader >> 8)
-			self.image.cByte(loader & 0xFF)
-		self.image.cWord(value)
+		self.parameters.append((regNumber,isConstant,value))
 	#
-	#		Copy parameter to a temporary area
+	#		Copy parameter to its variable. The optimiser removes the store if the value
+	#		is only used while it is still in the register. The fourth parameter is 
+	#		already there.
 	#
 	def storeParamRegister(self,regNumber,address):
-		saver = [ 0x22, 0xED53,0xED43,0xDD22 ][regNumber]
-		if saver < 0x100:
-			self.image.cByte(saver)
-		else:
-			self.image.cByte(saver >> 8)
-			self.image.cByte(saver & 0xFF)
-		self.image.cWord(address)
+		self.getModule().parameters.append(address.name if isinstance(address,Symbol) else address)
+		register = Z80CodeGenerator.paramRegisters[regNumber]
+		if register is not None:
+			self.emit("ld (nn),{0}".format(register),address)
 	#
-	#		Create a string constant (done outside procedures)
+	#		Create a string constant, which is placed in the linker's string pool
 	#
 	def createStringConstant(self,string):
-		strAddr = self.image.getCodeAddress()
-		print("{0:04x} \"{1}\"".format(strAddr,string))
-		for s in string:
-			self.image.cByte(ord(s))
-		self.image.cByte(0)
-		return strAddr
+		return Symbol("\""+string)
 	#
-	#		Call a subroutine
+	#		Call a subroutine, a procedure symbol or the address of one linked earlier.
+	#		Small procedures are inlined, their labels renamed for each copy.
 	#
 	def callSubroutine(self,address):
-		assert (address >> 16) == self.image.getCodePage(),"add cross page !!"
-		self.image.cByte(0xCD)												# call xxxx
-		self.image.cWord(address & 0xFFFF)									# address
+		if not isinstance(address,Symbol):
+			address = Symbol(self.linker.procedureAt(address))
+		for regNumber,isConstant,value in sorted(self.parameters,key = lambda p:(p[0] != 3,p[0])):
+			register = Z80CodeGenerator.paramRegisters[regNumber]
+			self.emit(("ld {0},nn" if isConstant else "ld {0},(nn)").format(register or "hl"),value)
+			if register is None:											# 4th, into the callee
+				self.emit("ld (nn),hl",Symbol(address.name+"@{0}".format(regNumber)))
+		self.parameters = []
+		if address.name not in self.inlines or self.code is None:
+			self.emit("call nn",address)
+			return
+		self.inlinedCalls += 1
+		for template,operand in self.inlines[address.name]:
+			if template == "label":
+				self.code.append((template,(address.name,self.inlinedCalls,operand)))
+			elif template == "branch":
+				self.code.append((template,(operand[0],(address.name,self.inlinedCalls,operand[1]))))
+			else:
+				self.emit(template,operand)
 	#
 	#		Return from subroutine.
 	#
 	def returnSubroutine(self):
-		self.image.cByte(0xC9)												# ret
+		self.emit("ret")
+	#
+	#		Report of the optimisations.
+	#
+	def report(self):
+		lines = [] if self.peephole is None else [self.peephole.report()]
+		return "\n".join(lines+["{0:24} {1}".format("tail calls",self.tailCalls),
+								 "{0:24} {1}".format("inlined calls",self.inlinedCalls)])
+	#
+	#		Static profile of the procedures, those with loops first, the most expensive
+	#		first. Costs are in T-states, best-worst.
+	#
+	def profileReport(self):
+		profiles = sorted(self.profiles,key = lambda p:(len(p.loops) == 0,-p.worst()))
+		return "\n".join([str(p) for p in profiles])
@@ -0,0 +1,855 @@
+# ***************************************************************************************
+# ***************************************************************************************
+#
+#		Name : 		z80executor.py
+#		Author :	Paul Robson (paul@robsons.org.uk)
+#		Date : 		24th January 2019
+#		Purpose :	Headless Z80 executor, runs a boot image counting T-states
+#
+# ***************************************************************************************
+# ***************************************************************************************
+
+from imagelib import *
+import bisect
+
+# ***************************************************************************************
+#									Executor errors
+# ***************************************************************************************
+
+class Z80Error(Exception):
+	def __init__(self,message,address):
+		Exception.__init__(self,"{0} at ${1:04x}".format(message,address))
+		self.message = message
+		self.address = address
+
+# ***************************************************************************************
+#
+#		Z80 with the Spectrum Next memory as the boot loader sets it up. $0000-$BFFF is
+#		RAM, $8000-$BFFF loaded from the image, and $C000-$DFFF/$E000-$FFFF are the 8k
+#		banks selected by next registers $56/$57. The image is not changed. I/O reads
+#		give $FF, writes are ignored, and there are no interrupts.
+#
+#		Execution stops at the sentinel, the CSpect break $DD $01, at halt, at a jump
+#		to itself (syshalt) or when the cycle limit is reached.
+#
+#		Registers are held in r[] as bytes, B C D E H L F A IXH IXL IYH IYL, so IX/IY
+#		instructions are the HL ones with other register numbers.
+#
+# ***************************************************************************************
+
+B,C,D,E,H,L,F,A,IXH,IXL,IYH,IYL = range(0,12)
+
+FS,FZ,FY,FH,FX,FP,FN,FC = 0x80,0x40,0x20,0x10,0x08,0x04,0x02,0x01
+
+SZ = [(n & 0xA8) | (FZ if n == 0 else 0) for n in range(0,256)]			# S Z and 5/3 of result
+SZP = [SZ[n] | (0 if bin(n).count("1") & 1 else FP) for n in range(0,256)]	# and parity
+
+class Z80Executor(object):
+	Sentinel = 0x0000 														# $DD $01 placed here
+	Stack = 0x5FFE 															# as the kernel sets
+
+	def __init__(self,image = None):
+		self.image = MemoryImage() if image is None else image
+		self.memory = bytearray(0xC000)
+		self.memory[0x8000:0xC000] = self.image.readBlock(0,0x8000,0x4000)
+		self.memory[Z80Executor.Sentinel:Z80Executor.Sentinel+2] = bytes([0xDD,0x01])
+		self.banks = {} 													# 8k bank -> bytearray
+		self.nextRegisters = {}
+		self.nextSelect = 0 												# register at $253B
+		self.r = [0] * 12
+		self.alternate = [0] * 8 											# BC' DE' HL' AF'
+		self.sp = Z80Executor.Stack
+		self.pc = 0x8000
+		self.i = self.rr = 0
+		self.setBank(0,self.image.dictionaryPage())
+		self.setBank(1,self.image.dictionaryPage()+1)
+		self.cycles = 0
+		self.instructions = 0
+		self.stopped = None
+		self.starts = None 													# page -> [(address,name)]
+		self.main = Z80Executor.decodeTable(None)
+		self.tables = { 0xDD:Z80Executor.decodeTable((IXH,IXL)),0xFD:Z80Executor.decodeTable((IYH,IYL)) }
+	#
+	#		Select the 8k bank for $C000 (slot 0) or $E000 (slot 1)
+	#
+	def setBank(self,slot,bank):
+		if bank not in self.banks:
+			data = bytearray(0x2000)
+			if bank >= MemoryImage.FirstPage and bank <= MemoryImage.LastPage:
+				data[:] = self.image.readBlock(bank,0xC000,0x2000)
+			self.banks[bank] = data
+		if slot == 0:
+			self.bankC000,self.pageC000 = self.banks[bank],bank
+		else:
+			self.bankE000,self.pageE000 = self.banks[bank],bank
+	#
+	def writeNextRegister(self,register,value):
+		self.nextRegisters[register] = value
+		if register == 0x56 or register == 0x57:
+			self.setBank(register-0x56,value)
+	#
+	def readNextRegister(self,register):
+		if register == 0x56 or register == 0x57:
+			return self.pageC000 if register == 0x56 else self.pageE000
+		return self.nextRegisters.get(register,0)
+	#
+	#		I/O. Next registers are selected with port $243B and read or written with
+	#		port $253B, other ports read $FF and ignore writes.
+	#
+	def input(self,port):
+		if port == 0x253B:
+			return self.readNextRegister(self.nextSelect)
+		return 0xFF
+	#
+	def output(self,port,data):
+		if port == 0x243B:
+			self.nextSelect = data
+		elif port == 0x253B:
+			self.writeNextRegister(self.nextSelect,data)
+	#
+	#		Memory access
+	#
+	def read(self,address):
+		if address < 0xC000:
+			return self.memory[address]
+		return (self.bankC000 if address < 0xE000 else self.bankE000)[address & 0x1FFF]
+	#
+	def write(self,address,data):
+		if address < 0xC000:
+			self.memory[address] = data
+		else:
+			(self.bankC000 if address < 0xE000 else self.bankE000)[address & 0x1FFF] = data
+	#
+	def readWord(self,address):
+		return self.read(address) + (self.read((address+1) & 0xFFFF) << 8)
+	#
+	def writeWord(self,address,data):
+		self.write(address,data & 0xFF)
+		self.write((address+1) & 0xFFFF,data >> 8)
+	#
+	def fetch(self):
+		data = self.read(self.pc)
+		self.pc = (self.pc+1) & 0xFFFF
+		return data
+	#
+	def fetchWord(self):
+		data = self.readWord(self.pc)
+		self.pc = (self.pc+2) & 0xFFFF
+		return data
+	#
+	def push(self,data):
+		self.sp = (self.sp-2) & 0xFFFF
+		self.writeWord(self.sp,data)
+	#
+	def pop(self):
+		data = self.readWord(self.sp)
+		self.sp = (self.sp+2) & 0xFFFF
+		return data
+	#
+	#		Register pairs, as (high,low) register numbers.
+	#
+	def getPair(self,pair):
+		return (self.r[pair[0]] << 8) | self.r[pair[1]]
+	#
+	def setPair(self,pair,data):
+		self.r[pair[0]] = (data >> 8) & 0xFF
+		self.r[pair[1]] = data & 0xFF
+	#
+	#		Procedures to total the cycles for, name -> (page << 16) + address as in
+	#		AssemblerWorker.globals. Names not ending in ( are ignored. Kernel routines
+	#		in the image dictionary are added. Code is counted to the procedure which
+	#		starts before it, in common memory or in the same page.
+	#
+	def setProcedures(self,symbols):
+		starts = {}
+		for name,info in self.image.getDictionary().items():
+			starts[(info["page"] if info["address"] >= 0xC000 else None,info["address"])] = name
+		for name,value in symbols.items():
+			if name.endswith("(") and isinstance(value,int):
+				page,address = value >> 16,value & 0xFFFF
+				starts[(page if address >= 0xC000 else None,address)] = name
+		self.starts = {}
+		for (page,address),name in starts.items():
+			self.starts.setdefault(page,[]).append((address,name))
+		for page in self.starts:
+			self.starts[page].sort()
+		self.owners = {}
+		self.totals = {}
+		self.entries = {}
+	#
+	def owner(self,address):
+		page = self.pageC000 if address >= 0xC000 else None
+		key = (page,address)
+		if key not in self.owners:
+			starts = self.starts.get(page,[])
+			n = bisect.bisect_left(starts,(address+1,))-1
+			self.owners[key] = (starts[n][1] if n >= 0 else None,n >= 0 and starts[n][0] == address)
+		return self.owners[key]
+	#
+	#		Run from the reset address of the kernel, which runs the program set by
+	#		setBoot. Returns the T-states used.
+	#
+	def boot(self,limit = None):
+		self.pc = 0x8000
+		return self.run(limit)
+	#
+	#		Call the procedure at page:address with parameters in HL DE BC, returning
+	#		when it does. Returns the T-states used, HL is the result.
+	#
+	def call(self,page,address,parameters = (),limit = None):
+		if address >= 0xC000:
+			self.writeNextRegister(0x56,page)
+			self.writeNextRegister(0x57,page+1)
+		for pair,value in zip(((H,L),(D,E),(B,C)),parameters):
+			self.setPair(pair,value & 0xFFFF)
+		self.sp = Z80Executor.Stack
+		self.push(Z80Executor.Sentinel)
+		self.pc = address
+		return self.run(limit)
+	#
+	#		Execute until stopped. The reason is in self.stopped.
+	#
+	def run(self,limit = None):
+		start = self.cycles
+		main = self.main
+		self.stopped = None
+		last = None
+		while self.stopped is None:
+			pc = self.pc
+			cycles = main[self.fetch()](self)
+			self.cycles += cycles
+			self.instructions += 1
+			self.rr = (self.rr & 0x80) | ((self.rr+1) & 0x7F)
+			if self.starts is not None:										# entered from elsewhere
+				name,isStart = self.owner(pc)
+				self.totals[name] = self.totals.get(name,0)+cycles
+				if isStart and name != last:
+					self.entries[name] = self.entries.get(name,0)+1
+				last = name
+			if self.pc == pc and (self.read(pc) == 0xC3 or self.read(pc) == 0x18):
+				self.stopped = "loop"										# jump to itself
+			elif limit is not None and self.cycles-start >= limit:
+				self.stopped = "limit"
+		return self.cycles-start
+	#
+	#		Per procedure report, most expensive first.
+	#
+	def report(self):
+		report = ["{0:8} T-states {1} instructions, stopped by {2}".format(self.cycles,self.instructions,self.stopped)]
+		if self.starts is not None:
+			for name in sorted(self.totals,key = lambda n:-self.totals[n]):
+				report.append("{0:24} {1:10} T {2:6} entries".format(name if name is not None else "(other)",
+																self.totals[name],self.entries.get(name,0)))
+		return "\n".join(report)
+
+	# ***********************************************************************************
+	#
+	#		Decoding. Each opcode is decoded once to a function of the executor which
+	#		returns the T-states. For DD/FD the table is built again with H L and HL
+	#		replaced by the index register halves, and (HL) by (IX+d).
+	#
+	# ***********************************************************************************
+
+	@staticmethod
+	def decodeTable(index):
+		return [Z80Executor.decode(op,index) for op in range(0,256)]
+
+	@staticmethod
+	def decode(op,index):
+		x,y,z,p,q = op >> 6,(op >> 3) & 7,op & 7,(op >> 4) & 3,(op >> 3) & 1
+		hl = (H,L) if index is None else index
+		extra = 0 if index is None else 4									# prefix cost
+		rp = [(B,C),(D,E),hl,None][p] 										# None is SP
+		rp2 = [(B,C),(D,E),hl,(A,F)][p]
+		reg = lambda n: index[n-4] if index is not None and (n == 4 or n == 5) else [B,C,D,E,H,L,None,A][n]
+
+		if op == 0xCB:
+			return Z80Executor.decodeCB if index is None else \
+							lambda cpu:Z80Executor.decodeIndexCB(cpu,index)
+		if op == 0xED:
+			return lambda cpu:Z80Executor.executeED(cpu,cpu.fetch())
+		if op == 0xDD or op == 0xFD:
+			return lambda cpu:cpu.tables[op][cpu.fetch()](cpu)+extra
+		if op == 0x01 and index == (IXH,IXL):								# $DD $01 sentinel
+			def sentinel(cpu):
+				cpu.pc = (cpu.pc-2) & 0xFFFF
+				cpu.stopped = "sentinel"
+				return 0
+			return sentinel
+
+		if x == 1:															# LD r,r
+			if y == 6 and z == 6:
+				def halt(cpu):
+					cpu.stopped = "halt"
+					return 4
+				return halt
+			if y == 6 or z == 6:											# (hl) so no index halves
+				if z == 6:
+					target = [B,C,D,E,H,L,None,A][y]
+					def ldrm(cpu):
+						cpu.r[target] = cpu.read(Z80Executor.memoryAddress(cpu,index))
+						return 7+extra*3
+					return ldrm
+				source = [B,C,D,E,H,L,None,A][z]
+				def ldmr(cpu):
+					cpu.write(Z80Executor.memoryAddress(cpu,index),cpu.r[source])
+					return 7+extra*3
+				return ldmr
+			target,source = reg(y),reg(z)
+			def ldrr(cpu):
+				cpu.r[target] = cpu.r[source]
+				return 4+extra
+			return ldrr
+
+		if x == 2 or (x == 3 and z == 6):									# ALU
+			alu = Z80Executor.alu[y]
+			if x == 3:
+				return lambda cpu: alu(cpu,cpu.fetch()) or 7+extra
+			if z == 6:
+				return lambda cpu: alu(cpu,cpu.read(Z80Executor.memoryAddress(cpu,index))) or 7+extra*3
+			source = reg(z)
+			return lambda cpu: alu(cpu,cpu.r[source]) or 4+extra
+
+		if x == 0:
+			if z == 0:
+				if y == 0:
+					return lambda cpu: 4+extra
+				if y == 1:
+					def exaf(cpu):
+						r,a = cpu.r,cpu.alternate
+						r[A],a[6],r[F],a[7] = a[6],r[A],a[7],r[F]
+						return 4+extra
+					return exaf
+				if y == 2:
+					def djnz(cpu):
+						offset = cpu.fetch()
+						cpu.r[B] = (cpu.r[B]-1) & 0xFF
+						if cpu.r[B] == 0:
+							return 8+extra
+						cpu.pc = (cpu.pc+offset-(256 if offset & 0x80 else 0)) & 0xFFFF
+						return 13+extra
+					return djnz
+				test = None if y == 3 else Z80Executor.conditions[y-4]
+				def jr(cpu):
+					offset = cpu.fetch()
+					if test is not None and not test(cpu.r[F]):
+						return 7+extra
+					cpu.pc = (cpu.pc+offset-(256 if offset & 0x80 else 0)) & 0xFFFF
+					return 12+extra
+				return jr
+			if z == 1:
+				if q == 0:
+					def ldrpnn(cpu):
+						if rp is None:
+							cpu.sp = cpu.fetchWord()
+						else:
+							cpu.setPair(rp,cpu.fetchWord())
+						return 10+extra
+					return ldrpnn
+				def addhl(cpu):
+					a = cpu.getPair(hl)
+					b = cpu.sp if rp is None else cpu.getPair(rp)
+					result = a+b
+					cpu.r[F] = (cpu.r[F] & (FS|FZ|FP)) | ((result >> 8) & (FX|FY)) | \
+									(FH if (a & 0xFFF)+(b & 0xFFF) > 0xFFF else 0) | (FC if result > 0xFFFF else 0)
+					cpu.setPair(hl,result & 0xFFFF)
+					return 11+extra
+				return addhl
+			if z == 2:
+				if p == 2:
+					if q == 0:
+						def stnnhl(cpu):
+							cpu.writeWord(cpu.fetchWord(),cpu.getPair(hl))
+							return 16+extra
+						return stnnhl
+					def ldhlnn(cpu):
+						cpu.setPair(hl,cpu.readWord(cpu.fetchWord()))
+						return 16+extra
+					return ldhlnn
+				pair = [(B,C),(D,E),None,None][p]
+				if q == 0:
+					def starr(cpu):
+						cpu.write(cpu.fetchWord() if pair is None else cpu.getPair(pair),cpu.r[A])
+						return (13 if pair is None else 7)+extra
+					return starr
+				def ldarr(cpu):
+					cpu.r[A] = cpu.read(cpu.fetchWord() if pair is None else cpu.getPair(pair))
+					return (13 if pair is None else 7)+extra
+				return ldarr
+			if z == 3:
+				step = 1 if q == 0 else -1
+				def incdec16(cpu):
+					if rp is None:
+						cpu.sp = (cpu.sp+step) & 0xFFFF
+					else:
+						cpu.setPair(rp,(cpu.getPair(rp)+step) & 0xFFFF)
+					return 6+extra
+				return incdec16
+			if z == 4 or z == 5:
+				operation = Z80Executor.inc8 if z == 4 else Z80Executor.dec8
+				if y == 6:
+					def incdecm(cpu):
+						address = Z80Executor.memoryAddress(cpu,index)
+						cpu.write(address,operation(cpu,cpu.read(address)))
+						return 11+extra*3
+					return incdecm
+				target = reg(y)
+				def incdec8(cpu):
+					cpu.r[target] = operation(cpu,cpu.r[target])
+					return 4+extra
+				return incdec8
+			if z == 6:
+				if y == 6:
+					def ldmn(cpu):
+						address = Z80Executor.memoryAddress(cpu,index)
+						cpu.write(address,cpu.fetch())
+						return 10+(extra*2+1 if index is not None else 0)
+					return ldmn
+				target = reg(y)
+				def ldrn(cpu):
+					cpu.r[target] = cpu.fetch()
+					return 7+extra
+				return ldrn
+			return lambda cpu: Z80Executor.accumulatorOps[y](cpu) or 4+extra
+
+		if z == 0:															# RET cc
+			test = Z80Executor.conditions[y]
+			def retcc(cpu):
+				if not test(cpu.r[F]):
+					return 5+extra
+				cpu.pc = cpu.pop()
+				return 11+extra
+			return retcc
+		if z == 1:
+			if q == 0:
+				def pop(cpu):
+					cpu.setPair(rp2,cpu.pop())
+					return 10+extra
+				return pop
+			if p == 0:
+				def ret(cpu):
+					cpu.pc = cpu.pop()
+					return 10+extra
+				return ret
+			if p == 1:
+				def exx(cpu):
+					r,a = cpu.r,cpu.alternate
+					r[B],r[C],r[D],r[E],r[H],r[L],a[0],a[1],a[2],a[3],a[4],a[5] = \
+							a[0],a[1],a[2],a[3],a[4],a[5],r[B],r[C],r[D],r[E],r[H],r[L]
+					return 4+extra
+				return exx
+			if p == 2:
+				def jphl(cpu):
+					cpu.pc = cpu.getPair(hl)
+					return 4+extra
+				return jphl
+			def ldsphl(cpu):
+				cpu.sp = cpu.getPair(hl)
+				return 6+extra
+			return ldsphl
+		if z == 2 or (z == 3 and y == 0):									# JP cc,nn JP nn
+			test = Z80Executor.conditions[y] if z == 2 else None
+			def jp(cpu):
+				target = cpu.fetchWord()
+				if test is None or test(cpu.r[F]):
+					cpu.pc = target
+				return 10+extra
+			return jp
+		if z == 3:
+			if y == 2:
+				def outna(cpu):
+					cpu.output((cpu.r[A] << 8) | cpu.fetch(),cpu.r[A])
+					return 11+extra
+				return outna
+			if y == 3:
+				def inan(cpu):
+					cpu.r[A] = cpu.input((cpu.r[A] << 8) | cpu.fetch())
+					return 11+extra
+				return inan
+			if y == 4:
+				def exsphl(cpu):
+					value = cpu.readWord(cpu.sp)
+					cpu.writeWord(cpu.sp,cpu.getPair(hl))
+					cpu.setPair(hl,value)
+					return 19+extra
+				return exsphl
+			if y == 5:
+				def exdehl(cpu):
+					r = cpu.r
+					r[D],r[E],r[H],r[L] = r[H],r[L],r[D],r[E]
+					return 4+extra
+				return exdehl
+			return lambda cpu: 4+extra										# DI EI
+		if z == 4 or (z == 5 and q == 1):									# CALL cc,nn CALL nn
+			test = Z80Executor.conditions[y] if z == 4 else None
+			def call(cpu):
+				target = cpu.fetchWord()
+				if test is not None and not test(cpu.r[F]):
+					return 10+extra
+				cpu.push(cpu.pc)
+				cpu.pc = target
+				return 17+extra
+			return call
+		if z == 5:
+			def push(cpu):
+				cpu.push(cpu.getPair(rp2))
+				return 11+extra
+			return push
+		def rst(cpu):
+			cpu.push(cpu.pc)
+			cpu.pc = y * 8
+			return 11+extra
+		return rst
+	#
+	#		(HL) or (IX+d) address, the displacement follows the opcode.
+	#
+	@staticmethod
+	def memoryAddress(cpu,index):
+		if index is None:
+			return (cpu.r[H] << 8) | cpu.r[L]
+		offset = cpu.fetch()
+		return (cpu.getPair(index)+offset-(256 if offset & 0x80 else 0)) & 0xFFFF
+
+	# ***********************************************************************************
+	#										Flags
+	# ***********************************************************************************
+
+	conditions = [ lambda f: not f & FZ,lambda f: f & FZ,lambda f: not f & FC,lambda f: f & FC,
+				   lambda f: not f & FP,lambda f: f & FP,lambda f: not f & FS,lambda f: f & FS ]
+
+	@staticmethod
+	def add8(cpu,value,carry = 0):
+		a = cpu.r[A]
+		result = a+value+carry
+		cpu.r[F] = SZ[result & 0xFF] | (FC if result > 0xFF else 0) | ((a ^ value ^ result) & FH) | \
+							(FP if (~(a ^ value) & (a ^ result)) & 0x80 else 0)
+		cpu.r[A] = result & 0xFF
+	#
+	@staticmethod
+	def sub8(cpu,value,carry = 0,store = True):
+		a = cpu.r[A]
+		result = a-value-carry
+		cpu.r[F] = SZ[result & 0xFF] | FN | (FC if result < 0 else 0) | ((a ^ value ^ result) & FH) | \
+							(FP if ((a ^ value) & (a ^ result)) & 0x80 else 0)
+		if store:
+			cpu.r[A] = result & 0xFF
+		else:
+			cpu.r[F] = (cpu.r[F] & ~(FX|FY)) | (value & (FX|FY))			# CP, 5/3 from operand
+	#
+	@staticmethod
+	def logical(cpu,result,half):
+		cpu.r[A] = result
+		cpu.r[F] = SZP[result] | half
+
+	alu = [ lambda cpu,v: Z80Executor.add8(cpu,v),
+			lambda cpu,v: Z80Executor.add8(cpu,v,cpu.r[F] & FC),
+			lambda cpu,v: Z80Executor.sub8(cpu,v),
+			lambda cpu,v: Z80Executor.sub8(cpu,v,cpu.r[F] & FC),
+			lambda cpu,v: Z80Executor.logical(cpu,cpu.r[A] & v,FH),
+			lambda cpu,v: Z80Executor.logical(cpu,cpu.r[A] ^ v,0),
+			lambda cpu,v: Z80Executor.logical(cpu,cpu.r[A] | v,0),
+			lambda cpu,v: Z80Executor.sub8(cpu,v,0,False) ]
+	#
+	@staticmethod
+	def inc8(cpu,value):
+		result = (value+1) & 0xFF
+		cpu.r[F] = (cpu.r[F] & FC) | SZ[result] | (FH if value & 0x0F == 0x0F else 0) | (FP if value == 0x7F else 0)
+		return result
+	#
+	@staticmethod
+	def dec8(cpu,value):
+		result = (value-1) & 0xFF
+		cpu.r[F] = (cpu.r[F] & FC) | SZ[result] | FN | (FH if value & 0x0F == 0 else 0) | (FP if value == 0x80 else 0)
+		return result
+	#
+	#		RLCA RRCA RLA RRA DAA CPL SCF CCF
+	#
+	@staticmethod
+	def rotateA(cpu,operation):
+		r = cpu.r
+		a,carry = r[A],r[F] & FC
+		if operation == 0:
+			carry,a = a >> 7,((a << 1) | (a >> 7)) & 0xFF
+		elif operation == 1:
+			carry,a = a & 1,(a >> 1) | ((a & 1) << 7)
+		elif operation == 2:
+			carry,a = a >> 7,((a << 1) | carry) & 0xFF
+		else:
+			carry,a = a & 1,(a >> 1) | (carry << 7)
+		r[A] = a
+		r[F] = (r[F] & (FS|FZ|FP)) | (a & (FX|FY)) | carry
+	#
+	@staticmethod
+	def daa(cpu):
+		r = cpu.r
+		a,f = r[A],r[F]
+		correction,carry = 0,f & FC
+		if f & FH or (a & 0x0F) > 9:
+			correction = 0x06
+		if carry or a > 0x99:
+			correction |= 0x60
+			carry = FC
+		result = (a-correction if f & FN else a+correction) & 0xFF
+		half = FH if (a ^ result) & 0x10 else 0
+		r[A] = result
+		r[F] = SZP[result] | (f & FN) | half | carry
+	#
+	@staticmethod
+	def cpl(cpu):
+		r = cpu.r
+		r[A] ^= 0xFF
+		r[F] = (r[F] & (FS|FZ|FP|FC)) | FH | FN | (r[A] & (FX|FY))
+	#
+	@staticmethod
+	def carryFlag(cpu,ccf):
+		r = cpu.r
+		carry = r[F] & FC
+		r[F] = (r[F] & (FS|FZ|FP)) | (r[A] & (FX|FY)) | ((FH if carry else 0) if ccf else 0) | \
+																		((carry ^ FC) if ccf else FC)
+
+	accumulatorOps = [ lambda cpu: Z80Executor.rotateA(cpu,0),lambda cpu: Z80Executor.rotateA(cpu,1),
+					   lambda cpu: Z80Executor.rotateA(cpu,2),lambda cpu: Z80Executor.rotateA(cpu,3),
+					   lambda cpu: Z80Executor.daa(cpu),lambda cpu: Z80Executor.cpl(cpu),
+					   lambda cpu: Z80Executor.carryFlag(cpu,False),lambda cpu: Z80Executor.carryFlag(cpu,True) ]
+
+	# ***********************************************************************************
+	#									CB prefix
+	# ***********************************************************************************
+
+	@staticmethod
+	def shift(cpu,operation,value):
+		carry = cpu.r[F] & FC
+		if operation == 0:													# RLC
+			carry,value = value >> 7,((value << 1) | (value >> 7)) & 0xFF
+		elif operation == 1:												# RRC
+			carry,value = value & 1,(value >> 1) | ((value & 1) << 7)
+		elif operation == 2:												# RL
+			carry,value = value >> 7,((value << 1) | carry) & 0xFF
+		elif operation == 3:												# RR
+			carry,value = value & 1,(value >> 1) | (carry << 7)
+		elif operation == 4:												# SLA
+			carry,value = value >> 7,(value << 1) & 0xFF
+		elif operation == 5:												# SRA
+			carry,value = value & 1,(value >> 1) | (value & 0x80)
+		elif operation == 6:												# SLL
+			carry,value = value >> 7,((value << 1) | 1) & 0xFF
+		else:																# SRL
+			carry,value = value & 1,value >> 1
+		cpu.r[F] = SZP[value] | carry
+		return value
+	#
+	#		Rotate/shift, bit, res and set on a value, returns the new value, or None
+	#		for bit which changes only the flags.
+	#
+	@staticmethod
+	def bitOperation(cpu,op,value):
+		x,y = op >> 6,(op >> 3) & 7
+		if x == 0:
+			return Z80Executor.shift(cpu,y,value)
+		if x == 1:
+			result = value & (1 << y)
+			cpu.r[F] = (cpu.r[F] & FC) | FH | (SZP[result] & ~(FX|FY)) | (value & (FX|FY))
+			return None
+		return value & ~(1 << y) if x == 2 else value | (1 << y)
+	#
+	@staticmethod
+	def decodeCB(cpu):
+		op = cpu.fetch()
+		z = op & 7
+		if z == 6:
+			address = (cpu.r[H] << 8) | cpu.r[L]
+			result = Z80Executor.bitOperation(cpu,op,cpu.read(address))
+			if result is None:
+				return 12
+			cpu.write(address,result)
+			return 15
+		target = [B,C,D,E,H,L,None,A][z]
+		result = Z80Executor.bitOperation(cpu,op,cpu.r[target])
+		if result is not None:
+			cpu.r[target] = result
+		return 8
+	#
+	#		DD CB d op, the result is also copied to a register if one is given.
+	#
+	@staticmethod
+	def decodeIndexCB(cpu,index):
+		address = Z80Executor.memoryAddress(cpu,index)
+		op = cpu.fetch()
+		result = Z80Executor.bitOperation(cpu,op,cpu.read(address))
+		if result is None:
+			return 20
+		cpu.write(address,result)
+		if op & 7 != 6:
+			cpu.r[[B,C,D,E,H,L,None,A][op & 7]] = result
+		return 23
+
+	# ***********************************************************************************
+	#						ED prefix, with the Spectrum Next additions
+	# ***********************************************************************************
+
+	@staticmethod
+	def executeED(cpu,op):
+		r = cpu.r
+		x,y,z,p,q = op >> 6,(op >> 3) & 7,op & 7,(op >> 4) & 3,(op >> 3) & 1
+		pair = [(B,C),(D,E),(H,L),None][p]
+		if op in Z80Executor.nextOps:
+			return Z80Executor.nextOps[op](cpu)
+		if x == 1:
+			if z == 0:														# IN r,(C)
+				value = cpu.input(cpu.getPair((B,C)))
+				if y != 6:
+					r[[B,C,D,E,H,L,None,A][y]] = value
+				r[F] = (r[F] & FC) | SZP[value]
+				return 12
+			if z == 1:														# OUT (C),r
+				cpu.output(cpu.getPair((B,C)),0 if y == 6 else r[[B,C,D,E,H,L,None,A][y]])
+				return 12
+			if z == 2:														# SBC/ADC HL,rp
+				a = cpu.getPair((H,L))
+				b = cpu.sp if pair is None else cpu.getPair(pair)
+				carry = r[F] & FC
+				if q == 0:
+					result = a-b-carry
+					flags = FN | (FC if result < 0 else 0) | (FP if ((a ^ b) & (a ^ result)) & 0x8000 else 0)
+				else:
+					result = a+b+carry
+					flags = (FC if result > 0xFFFF else 0) | (FP if (~(a ^ b) & (a ^ result)) & 0x8000 else 0)
+				result &= 0xFFFF
+				r[F] = flags | ((result >> 8) & (FS|FX|FY)) | (FZ if result == 0 else 0) | \
+									(((a ^ b ^ result) >> 8) & FH)
+				cpu.setPair((H,L),result)
+				return 15
+			if z == 3:														# LD (nn),rp / LD rp,(nn)
+				address = cpu.fetchWord()
+				if q == 0:
+					cpu.writeWord(address,cpu.sp if pair is None else cpu.getPair(pair))
+				elif pair is None:
+					cpu.sp = cpu.readWord(address)
+				else:
+					cpu.setPair(pair,cpu.readWord(address))
+				return 20
+			if z == 4:														# NEG
+				value = r[A]
+				r[A] = 0
+				Z80Executor.sub8(cpu,value)
+				return 8
+			if z == 5:														# RETN RETI
+				cpu.pc = cpu.pop()
+				return 14
+			if z == 6:														# IM
+				return 8
+			if y == 0 or y == 1:											# LD I,A LD R,A
+				if y == 0:
+					cpu.i = r[A]
+				else:
+					cpu.rr = r[A]
+				return 9
+			if y == 2 or y == 3:											# LD A,I LD A,R
+				r[A] = cpu.i if y == 2 else cpu.rr
+				r[F] = (r[F] & FC) | SZ[r[A]]
+				return 9
+			if y == 4 or y == 5:											# RRD RLD
+				address = cpu.getPair((H,L))
+				value = cpu.read(address)
+				if y == 4:
+					r[A],value = (r[A] & 0xF0) | (value & 0x0F),((r[A] << 4) | (value >> 4)) & 0xFF
+				else:
+					r[A],value = (r[A] & 0xF0) | (value >> 4),((value << 4) | (r[A] & 0x0F)) & 0xFF
+				cpu.write(address,value)
+				r[F] = (r[F] & FC) | SZP[r[A]]
+				return 18
+			return 8
+		if x == 2 and z <= 3 and y >= 4:									# block instructions
+			return Z80Executor.block(cpu,y,z)
+		return 8															# undefined, NOP
+	#
+	#		LDI LDD LDIR LDDR CPI CPD CPIR CPDR, the I/O ones just count.
+	#
+	@staticmethod
+	def block(cpu,y,z):
+		r = cpu.r
+		step = 1 if y & 1 == 0 else -1
+		repeat = y >= 6
+		hl,bc = cpu.getPair((H,L)),(cpu.getPair((B,C))-1) & 0xFFFF
+		if z == 0:
+			de = cpu.getPair((D,E))
+			cpu.write(de,cpu.read(hl))
+			cpu.setPair((D,E),(de+step) & 0xFFFF)
+			r[F] = (r[F] & (FS|FZ|FC)) | (FP if bc != 0 else 0)
+			again = repeat and bc != 0
+		elif z == 1:
+			value = cpu.read(hl)
+			result = (r[A]-value) & 0xFF
+			r[F] = (r[F] & FC) | (SZ[result] & (FS|FZ)) | FN | ((r[A] ^ value ^ result) & FH) | \
+															(FP if bc != 0 else 0)
+			again = repeat and bc != 0 and result != 0
+		else:
+			r[B] = (r[B]-1) & 0xFF
+			bc = cpu.getPair((B,C))+1
+			r[F] = FN | (FZ if r[B] == 0 else 0)
+			again = repeat and r[B] != 0
+		cpu.setPair((H,L),(hl+step) & 0xFFFF)
+		if z == 0 or z == 1:
+			cpu.setPair((B,C),bc)
+		if again:
+			cpu.pc = (cpu.pc-2) & 0xFFFF
+			return 21
+		return 16
+	#
+	#		Spectrum Next extended instructions. The display ones are not emulated.
+	#
+	@staticmethod
+	def nextregNN(cpu):
+		register = cpu.fetch()
+		cpu.writeNextRegister(register,cpu.fetch())
+		return 20
+	@staticmethod
+	def nextregA(cpu):
+		cpu.writeNextRegister(cpu.fetch(),cpu.r[A])
+		return 17
+	@staticmethod
+	def mul(cpu):
+		cpu.setPair((D,E),cpu.r[D] * cpu.r[E])
+		return 8
+	@staticmethod
+	def addPair(cpu,pair,value,cycles):
+		cpu.setPair(pair,(cpu.getPair(pair)+value) & 0xFFFF)
+		return cycles
+	@staticmethod
+	def pushImmediate(cpu):
+		value = cpu.fetch() << 8											# big endian operand
+		cpu.push(value | cpu.fetch())
+		return 23
+	@staticmethod
+	def test(cpu):
+		value = cpu.r[A] & cpu.fetch()
+		cpu.r[F] = SZP[value] | FH
+		return 11
+	@staticmethod
+	def notEmulated(cpu):
+		raise Z80Error("Next instruction not emulated",(cpu.pc-2) & 0xFFFF)
+
+	nextOps = {
+		0x91:lambda cpu: Z80Executor.nextregNN(cpu),
+		0x92:lambda cpu: Z80Executor.nextregA(cpu),
+		0x30:lambda cpu: Z80Executor.mul(cpu),
+		0x23:lambda cpu: cpu.r.__setitem__(A,((cpu.r[A] << 4) | (cpu.r[A] >> 4)) & 0xFF) or 8,
+		0x24:lambda cpu: cpu.r.__setitem__(A,int("{0:08b}".format(cpu.r[A])[::-1],2)) or 8,
+		0x31:lambda cpu: Z80Executor.addPair(cpu,(H,L),cpu.r[A],8),
+		0x32:lambda cpu: Z80Executor.addPair(cpu,(D,E),cpu.r[A],8),
+		0x33:lambda cpu: Z80Executor.addPair(cpu,(B,C),cpu.r[A],8),
+		0x34:lambda cpu: Z80Executor.addPair(cpu,(H,L),cpu.fetchWord(),16),
+		0x35:lambda cpu: Z80Executor.addPair(cpu,(D,E),cpu.fetchWord(),16),
+		0x36:lambda cpu: Z80Executor.addPair(cpu,(B,C),cpu.fetchWord(),16),
+		0x8A:lambda cpu: Z80Executor.pushImmediate(cpu),
+		0x27:lambda cpu: Z80Executor.test(cpu),
+	}
+	for op in (0x28,0x29,0x2A,0x2B,0x2C,0x90,0x93,0x94,0x95,0x98,0xA4,0xA5,0xAC,0xB4,0xB7,0xBC):
+		nextOps[op] = notEmulated.__func__
+	del op
+
+if __name__ == "__main__":
+	cpu = Z80Executor(MemoryImage(sys.argv[1] if len(sys.argv) > 1 else "boot.img"))
+	cpu.setProcedures({})
+	cpu.boot(1000000)
+	print(cpu.report())